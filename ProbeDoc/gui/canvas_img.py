@@ -34,10 +34,19 @@ Stuff to add:
 # Advanced zoom for images of various types from small to huge up to several GB
 import math
 import warnings
+import queue
+import threading
 import tkinter as tk
+from collections import OrderedDict
 
 from tkinter import ttk
 from PIL import Image, ImageTk, ImageDraw
+from ..utils.startup_profile import phase
+from ..utils import pyramid_cache
+from ..utils import mapped_raster
+from ..utils import image_pyramid
+from ..utils.config import config
+from .render_pool import render_pool
 
 class AutoScrollbar(ttk.Scrollbar):
     """ A scrollbar that hides itself if it's not needed. Works only for grid geometry manager """
@@ -62,8 +71,17 @@ class CanvasImage:
         self.imscale = 1.0  # scale for the canvas image zoom, public for outer classes
         self.__delta = 1.3  # zoom magnitude
         self.__filter = Image.Resampling.LANCZOS  # LANCZOS used for highest quality resizing
+        # Filter used while the view is moving, the settled view is rendered again with LANCZOS
+        self.__interactive_filter = Image.Resampling.BILINEAR if config["InteractiveFilter"] == "bilinear" else Image.Resampling.NEAREST
+        self.__interacting = False
+        self.__settle_job = None
         self.__previous_state = 0  # previous state of the keyboard
         self.path = path  # path to the image, should be public for outer classes
+        self.shown_points = []  # names of the data points shown on it, MainGui brings them back when it is shown again
+        # Redraws asked for while one is already pending are folded into it, see request_redraw
+        self.__redraw_pending = False
+        self.frames_rendered = 0
+        self.frames_dropped = 0
         # Create ImageFrame in placeholder widget
         if given_frame:
             self.__imframe = placeholder
@@ -84,7 +102,7 @@ class CanvasImage:
         hbar.configure(command=self.__scroll_x)  # bind scrollbars to the canvas
         vbar.configure(command=self.__scroll_y)
         # # Bind events to the Canvas
-        self.canvas.bind('<Configure>', lambda event: self.__show_image())  # canvas is resized
+        self.canvas.bind('<Configure>', lambda event: self.request_redraw())  # canvas is resized
         self.canvas.bind('<ButtonPress-1>', self.__move_from)  # remember canvas position
         self.canvas.bind('<B1-Motion>',     self.__move_to)  # move canvas to the new position
         # This is to focus the canvas when the mouse enters the canvas
@@ -98,34 +116,69 @@ class CanvasImage:
         self.canvas.bind('<Key>', lambda event: self.canvas.after_idle(self.__keystroke, event))
         # Decide if this image huge or not
         self.__huge = False  # huge or not
-        self.__huge_size = 14000  # define size of the huge image
-        self.__band_width = 1024  # width of the tile band
+        self.__huge_size = image_pyramid.huge_size  # define size of the huge image
         Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for big images
         with warnings.catch_warnings():  # suppress DecompressionBombWarning
             warnings.simplefilter('ignore')
             self.__image = Image.open(self.path)  # open image, but down't load it
         self.imwidth, self.imheight = self.__image.size  # public for outer classes
-        if self.imwidth * self.imheight > self.__huge_size * self.__huge_size and \
-           self.__image.tile[0][0] == 'raw':  # only raw images could be tiled
+        # A huge image is read through a memory map (see utils/mapped_raster.py): uncompressed files in place,
+        # others from the raw copy made the first time they were opened, which the pyramid worker makes if needed
+        self.__raster = None
+        if image_pyramid.is_huge(self.imwidth, self.imheight):
             self.__huge = True  # image is huge
-            self.__offset = self.__image.tile[0][2]  # initial tile offset
-            self.__tile = [self.__image.tile[0][0],  # it have to be 'raw'
-                           [0, 0, self.imwidth, 0],  # tile extent (a rectangle)
-                           self.__offset,
-                           self.__image.tile[0][3]]  # list of arguments to the decoder
+            self.__raster = mapped_raster.open_raster(self.path, self.__image)
         self.__min_side = min(self.imwidth, self.imheight)  # get the smaller image side
-        # Create image pyramid
-        self.__pyramid = [self.smaller()] if self.__huge else [Image.open(self.path)]
-        # Set ratio coefficient for image pyramid
-        self.__ratio = max(self.imwidth, self.imheight) / self.__huge_size if self.__huge else 1.0
-        self.__curr_img = 0  # current image from the pyramid
-        self.__scale = self.imscale * self.__ratio  # image pyramide scale
-        self.__reduction = 2  # reduction degree of image pyramid
-        w, h = self.__pyramid[-1].size
-        while w > 512 and h > 512:  # top pyramid image is around 512 pixels in size
-            w /= self.__reduction  # divide on reduction degree
-            h /= self.__reduction  # divide on reduction degree
-            self.__pyramid.append(self.__pyramid[-1].resize((int(w), int(h)), self.__filter))
+        with phase("CanvasImage pyramid"):
+            # Set ratio coefficient for image pyramid
+            self.__ratio = max(self.imwidth, self.imheight) / self.__huge_size if self.__huge else 1.0
+            self.__curr_img = 0  # current image from the pyramid
+            self.__scale = self.imscale * self.__ratio  # image pyramide scale
+            self.__reduction = image_pyramid.reduction  # reduction degree of image pyramid
+            # Sizes of the pyramid levels, the levels themselves are built on a worker thread coarsest first,
+            # a level that is not built yet is None and a coarser one is shown in its place
+            self.__level_sizes = image_pyramid.level_sizes(self.imwidth, self.imheight)
+            self.__pyramid = [None] * len(self.__level_sizes)
+            # A pyramid prepared on import or built before is memory mapped from the cache (see utils/pyramid_cache.py),
+            # tiles only read the pixels they cover
+            cached = pyramid_cache.load(self.path)
+            self.__cached = False  # the levels came from the cache, released again in destroy
+            self.__mapped = 0  # the last levels are memory mapped, they are not counted in memory_size
+            if cached is not None and len(cached) == len(self.__pyramid):
+                self.__pyramid[:] = cached
+                self.__cached = True
+                self.__mapped = len(cached)
+            elif cached is not None:
+                pyramid_cache.release(self.path)  # cached for other level sizes, built again below
+            if len(self.__pyramid) == 1 and self.__pyramid[0] is None and not self.__huge:
+                self.__pyramid[0] = Image.open(self.path)  # small image, nothing to build
+                self.__pyramid[0].load()  # loaded here, the render pool reads it from several threads
+            self.__levels_built = 0  # bumped by the worker every time a level lands
+            self.__levels_shown = 0
+            # (bands done, bands) of level 0 of a huge image, set by the worker and shown by poll_pyramid__
+            self.__progress = None
+            self.__progress_text = None
+            self.__cancel = threading.Event()  # set when the viewer goes away (a newer image was selected)
+            self.__builder = None
+            if None in self.__pyramid or (self.__huge and self.__raster is None):
+                self.__builder = threading.Thread(target=self.build_pyramid__, args=(self.__pyramid, self.__cancel),
+                                                  name="pyramid", daemon=True)
+                self.__builder.start()
+        # The visible part of the image is drawn as a grid of fixed size tiles, see render_tiles__
+        self.__tile_size = config["TileSize"]
+        self.__tile_cache = OrderedDict()  # (level, scale, column, row, filter) -> PhotoImage, least recently used first
+        self.__tile_items = {}  # (column, row) -> canvas item of the tiles on the canvas
+        self.__tile_filters = {}  # (column, row) -> filter the tile on the canvas was resampled with
+        self.__tile_generation = None  # level and scale the tiles on the canvas were rendered at
+        self.__free_tiles = []  # hidden tile items, reused for the next tiles that come into view
+        self.__visible_tiles = set()
+        # Tiles that are not cached are resampled on the render pool, finished ones come back through
+        # self.__rendered and are put on the canvas by poll_rendered__ on the Tk thread
+        self.__pending = {}  # tile cache key -> future
+        self.__rendered = queue.SimpleQueue()
+        self.__polling = False
+        self.__magnifier_job = None
+        self.__magnifier_request = None
         # Put image into container rectangle and use it to set proper coordinates to the image
         self.container = self.canvas.create_rectangle((0, 0, self.imwidth, self.imheight), width=0)
         self.__show_image()  # show image on the canvas
@@ -135,43 +188,291 @@ class CanvasImage:
         self.pos_input_fcn = None
         self.canvas.tag_bind("data_point", "<Enter>", self.show_tooltip)
         self.canvas.tag_bind("data_point", "<Leave>", self.hide_tooltip)
-
-
-
-    def smaller(self):
-        """ Resize image proportionally and return smaller image """
-        w1, h1 = float(self.imwidth), float(self.imheight)
-        w2, h2 = float(self.__huge_size), float(self.__huge_size)
-        aspect_ratio1 = w1 / h1
-        aspect_ratio2 = w2 / h2  # it equals to 1.0
-        if aspect_ratio1 == aspect_ratio2:
-            image = Image.new('RGB', (int(w2), int(h2)))
-            k = h2 / h1  # compression ratio
-            w = int(w2)  # band length
-        elif aspect_ratio1 > aspect_ratio2:
-            image = Image.new('RGB', (int(w2), int(w2 / aspect_ratio1)))
-            k = h2 / w1  # compression ratio
-            w = int(w2)  # band length
-        else:  # aspect_ratio1 < aspect_ration2
-            image = Image.new('RGB', (int(h2 * aspect_ratio1), int(h2)))
-            k = h2 / h1  # compression ratio
-            w = int(h2 * aspect_ratio1)  # band length
-        i, j, n = 0, 1, round(0.5 + self.imheight / self.__band_width)
-        while i < self.imheight:
-            print('\rOpening image: {j} from {n}'.format(j=j, n=n), end='')
-            band = min(self.__band_width, self.imheight - i)  # width of the tile band
-            self.__tile[1][3] = band  # set band width
-            self.__tile[2] = self.__offset + self.imwidth * i * 3  # tile offset (3 bytes per pixel)
-            self.__image.close()
-            self.__image = Image.open(self.path)  # reopen / reset image
-            self.__image.size = (self.imwidth, band)  # set size of the tile band
-            self.__image.tile = [self.__tile]  # set tile
-            cropped = self.__image.crop((0, 0, self.imwidth, band))  # crop tile band
-            image.paste(cropped.resize((w, int(band * k)+1), self.__filter), (0, int(i * k)))
-            i += band
-            j += 1
-        print('\r' + 30*' ' + '\r', end='')  # hide printed string
-        return image
+        if self.__builder is not None:
+            self.poll_pyramid__()
+
+
+
+    def smaller_size__(self):
+        """ ((width, height) of the image smaller() makes, compression ratio, band length) """
+        return image_pyramid.smaller_size(self.imwidth, self.imheight)
+
+    def smaller(self, cancel = None):
+        """ Resize image proportionally and return smaller image, None if cancelled """
+        return image_pyramid.smaller(self.__raster, self.__filter, cancel, self.set_progress__)
+
+    def set_progress__(self, done, total):
+        """ Runs on the worker thread, the Tk thread picks it up in poll_pyramid__ """
+        self.__progress = (done, total) if done < total else None
+
+    def preview__(self, size):
+        """ Quick low quality image of the given size, shown until the real levels are built """
+        if self.__huge:
+            # Every n-th row of the file, a few hundred small reads instead of the whole file
+            preview = Image.new('RGB', size)
+            for r in range(size[1]):
+                row = self.__raster.crop((0, int(r * self.imheight / size[1]), self.imwidth, int(r * self.imheight / size[1]) + 1))
+                preview.paste(row.resize((size[0], 1), Image.Resampling.NEAREST), (0, r))
+            return preview
+        with Image.open(self.path) as image:
+            image.draft('RGB', size)  # JPEGs are decoded at 1/2..1/8 scale right away, other formats ignore this
+            return image.resize(size, Image.Resampling.BILINEAR)
+
+    def build_pyramid__(self, pyramid, cancel):
+        """ Runs on the worker thread: a coarse preview first, then every level from the finest down """
+        try:
+            if image_pyramid.preparing(self.path) and self.prepared_levels__(pyramid, cancel):
+                return
+            if self.__huge and self.__raster is None:
+                # A compressed huge image is decoded once into the raster cache, later sessions map it right away
+                raster = mapped_raster.convert(self.path, cancel)
+                if raster is None:
+                    return
+                self.__raster = raster
+                self.__levels_built += 1  # views zoomed in past the pyramid can be drawn now
+            if pyramid[-1] is None and len(pyramid) > 1:
+                pyramid[-1] = self.preview__(self.__level_sizes[-1])
+                self.__levels_built += 1
+            if cancel.is_set():
+                return
+            if pyramid[0] is None:
+                if self.__huge:
+                    base = self.smaller(cancel)
+                else:
+                    with Image.open(self.path) as image:
+                        base = image_pyramid.displayable(image)
+                        base.load()
+                if base is None or cancel.is_set():
+                    return
+                pyramid[0] = base
+                self.__levels_built += 1
+            if all(level is not None for level in pyramid[1:-1]) and self.__cached:
+                return  # the levels came from the cache, only the raster was missing
+            for i in range(1, len(pyramid)):
+                if cancel.is_set():
+                    return
+                pyramid[i] = pyramid[i - 1].resize(self.__level_sizes[i], self.__filter)
+                self.__levels_built += 1
+            pyramid_cache.store(self.path, pyramid)
+        except Exception as e:
+            if not cancel.is_set():
+                print(f"Error building the image pyramid of {self.path}: {e}")
+
+    def prepared_levels__(self, pyramid, cancel):
+        """ The image is being prepared on import right now, wait for it and map its levels instead of building them """
+        if not image_pyramid.wait(self.path, cancel):
+            return True  # cancelled
+        cached = pyramid_cache.load(self.path)
+        if cached is None:
+            return False
+        if len(cached) != len(pyramid):
+            pyramid_cache.release(self.path)
+            return False
+        if self.__cached:
+            pyramid_cache.release(self.path)  # released once in destroy
+        if self.__huge and self.__raster is None:
+            self.__raster = mapped_raster.open_raster(self.path)
+        pyramid[:] = cached
+        self.__cached = True
+        self.__mapped = len(cached)
+        self.__levels_built += 1
+        return True
+
+    def poll_pyramid__(self):
+        """ Show finer levels as the worker finishes them """
+        if self.__cancel.is_set():
+            return
+        if self.__levels_built != self.__levels_shown:
+            self.__levels_shown = self.__levels_built
+            self.request_redraw()
+        self.show_progress__()
+        if self.__builder.is_alive() or self.__levels_built != self.__levels_shown:
+            self.canvas.after(50, self.poll_pyramid__)
+
+    def show_progress__(self):
+        """ Status text in the top left corner of the view while level 0 of a huge image is being made """
+        progress = self.__progress if self.__builder.is_alive() else None
+        if progress is None:
+            if self.__progress_text is not None:
+                self.canvas.delete(self.__progress_text)
+                self.__progress_text = None
+            return
+        text = 'Opening image: {j} from {n}'.format(j=progress[0], n=progress[1])
+        x, y = self.canvas.canvasx(10), self.canvas.canvasy(10)
+        if self.__progress_text is None:
+            self.__progress_text = self.canvas.create_text(x, y, text=text, anchor="nw", fill="white")
+        else:
+            self.canvas.itemconfigure(self.__progress_text, text=text)
+            self.canvas.coords(self.__progress_text, x, y)
+        self.canvas.tag_raise(self.__progress_text)
+
+    def ready_level__(self, i):
+        """ Level i of the pyramid, or the closest coarser level already built, with the scale to crop it at and its index """
+        for j in range(i, len(self.__pyramid)):
+            level = self.__pyramid[j]
+            if level is not None:
+                scale = self.__scale if j == i else self.imscale * self.imwidth / level.size[0]
+                return level, scale, j
+        return None, None, None
+
+    def render_tiles__(self, box_image, x1, y1, x2, y2):
+        """ Cover the visible part (x1, y1, x2, y2) of the image with tiles
+            Tiles already on the canvas stay where they are (panning moves them along with the canvas),
+            cached tiles are put up right away and the rest are resampled with the current filter, see filter__ """
+        if self.__huge and self.__curr_img < 0:
+            level, scale, index = None, self.imscale, -1  # zoomed in past the pyramid, tiles are read from the file
+            if self.__raster is None:
+                return  # still being converted, poll_pyramid__ shows it once it is
+        else:
+            level, scale, index = self.ready_level__(max(0, self.__curr_img))
+            if level is None:
+                return  # nothing built yet, poll_pyramid__ shows it once it is
+        generation = (index, scale, box_image[0], box_image[1])
+        if generation != self.__tile_generation:
+            # Zoomed, or a finer level was built, the tiles on the canvas are at the wrong scale
+            for item in self.__tile_items.values():
+                self.canvas.itemconfigure(item, state='hidden')
+                self.__free_tiles.append(item)
+            self.__tile_items = {}
+            self.__tile_filters = {}
+            self.__tile_generation = generation
+        size = self.__tile_size
+        width, height = int(box_image[2] - box_image[0]), int(box_image[3] - box_image[1])
+        visible = {(i, j) for i in range(int(x1) // size, (int(x2) - 1) // size + 1)
+                          for j in range(int(y1) // size, (int(y2) - 1) // size + 1)}
+        self.__visible_tiles = visible
+        for key in [key for key in self.__tile_items if key not in visible]:
+            item = self.__tile_items.pop(key)
+            self.__tile_filters.pop(key)
+            self.canvas.itemconfigure(item, state='hidden')
+            self.__free_tiles.append(item)
+        # Tiles that were asked for but scrolled out of view or are at an old scale are not needed anymore
+        for key in [key for key in self.__pending if key[:2] != (index, scale) or key[2:4] not in visible]:
+            if render_pool().cancel(self.__pending[key]):
+                del self.__pending[key]
+        resample = self.filter__()
+        for i, j in sorted(visible):
+            shown = self.__tile_filters.get((i, j))
+            if shown == self.__filter or shown == resample:
+                continue  # already on the canvas at the quality asked for (or better)
+            # A tile cached at full quality is always used, even in the middle of a drag
+            for candidate in (self.__filter, resample):
+                photo = self.__tile_cache.get((index, scale, i, j, candidate))
+                if photo is not None:
+                    self.__tile_cache.move_to_end((index, scale, i, j, candidate))
+                    self.place_tile__(i, j, photo, candidate)
+                    break
+            if photo is not None:
+                continue
+            key = (index, scale, i, j, resample)
+            if resample == Image.Resampling.NEAREST and level is not None:
+                # A NEAREST tile takes well under a millisecond (see benchmarks/resample_benchmark.py),
+                # so it is done right here and a drag never shows gaps, anything slower goes to the pool
+                self.cache_tile__(key, ImageTk.PhotoImage(self.tile__(level, scale, i, j, width, height, resample)))
+                self.place_tile__(i, j, self.__tile_cache[key], resample)
+            elif key not in self.__pending:
+                self.__pending[key] = render_pool().submit(self.tile__, level, scale, i, j, width, height, resample,
+                                                           done=lambda future, key=key: self.__rendered.put((key, future)))
+        if self.__pending and not self.__polling:
+            self.__polling = True
+            self.poll_rendered__()
+
+    def place_tile__(self, i, j, photo, resample):
+        if (i, j) in self.__tile_items:
+            # A better version of a tile already up, swapped in place
+            self.canvas.itemconfigure(self.__tile_items[(i, j)], image=photo)
+            self.__tile_filters[(i, j)] = resample
+            return
+        x, y = self.__tile_generation[2] + i * self.__tile_size, self.__tile_generation[3] + j * self.__tile_size
+        if self.__free_tiles:
+            # Moving an existing item is cheaper than a new one, and the canvas does not fill up with items
+            item = self.__free_tiles.pop()
+            self.canvas.coords(item, x, y)
+            self.canvas.itemconfigure(item, image=photo, state='normal')
+        else:
+            item = self.canvas.create_image(x, y, anchor='nw', image=photo, tags="tile")
+            self.canvas.lower(item)  # set image into background
+        self.__tile_items[(i, j)] = item
+        self.__tile_filters[(i, j)] = resample
+
+    def tile__(self, level, scale, i, j, width, height, resample):
+        """ Tile (i, j) of the image shown at scale times the size of level (the file itself if level is None)
+            Runs on the render pool, except for the quick filters used during interaction """
+        size = self.__tile_size
+        left, top = i * size, j * size
+        right, bottom = min(left + size, width), min(top + size, height)
+        if level is None:
+            level = self.__raster
+        box = (left / scale, top / scale, min(right / scale, level.size[0]), min(bottom / scale, level.size[1]))
+        if not isinstance(level, Image.Image):
+            # A memory mapped level or the raster of a huge image, only the pixels under the tile are read
+            x0, y0 = int(box[0]), int(box[1])
+            level = level.crop((x0, y0, min(level.size[0], math.ceil(box[2])), min(level.size[1], math.ceil(box[3]))))
+            box = (box[0] - x0, box[1] - y0, box[2] - x0, box[3] - y0)
+        return level.resize((right - left, bottom - top), resample, box=box)
+
+    def filter__(self):
+        """ Resampling filter for new tiles, see ResamplingQuality in the config """
+        quality = config["ResamplingQuality"]
+        if quality == "fast" or (quality == "adaptive" and self.__interacting):
+            return self.__interactive_filter
+        return self.__filter
+
+    def interaction__(self):
+        """ A pan, zoom or scroll happened, quick filters are used until nothing happened for SettleDelay ms """
+        if config["ResamplingQuality"] != "adaptive":
+            return
+        self.__interacting = True
+        if self.__settle_job is not None:
+            self.canvas.after_cancel(self.__settle_job)
+        self.__settle_job = self.canvas.after(config["SettleDelay"], self.settle__)
+
+    def settle__(self):
+        """ The view stopped moving, render it again at full quality """
+        self.__settle_job = None
+        self.__interacting = False
+        self.request_redraw()
+
+    def poll_rendered__(self):
+        """ Turn the tiles the render pool finished into PhotoImages and put the ones still in view on the canvas """
+        if self.__cancel.is_set():
+            return
+        while True:
+            try:
+                key, future = self.__rendered.get_nowait()
+            except queue.Empty:
+                break
+            if key == "magnifier":
+                self.magnifier_done__(future)
+                continue
+            if self.__pending.get(key) is future:
+                del self.__pending[key]
+            if future.cancelled():
+                continue
+            try:
+                image = future.result()
+            except Exception as e:
+                print(f"Error rendering a tile of {self.path}: {e}")
+                continue
+            self.cache_tile__(key, ImageTk.PhotoImage(image))
+            position = key[2:4]
+            if self.__tile_generation is not None and key[:2] == self.__tile_generation[:2] \
+               and position in self.__visible_tiles and self.__tile_filters.get(position) != self.__filter:
+                self.place_tile__(key[2], key[3], self.__tile_cache[key], key[4])
+        if self.__pending or self.__magnifier_job is not None:
+            self.canvas.after(10, self.poll_rendered__)
+        else:
+            self.__polling = False
+
+    def cache_tile__(self, key, photo):
+        self.__tile_cache[key] = photo
+        shown = self.__tile_generation[:2] if self.__tile_generation is not None else None
+        for old in list(self.__tile_cache.keys()):
+            if len(self.__tile_cache) <= config["TileCacheSize"]:
+                break
+            if old[:2] == shown and self.__tile_filters.get(old[2:4]) == old[4]:
+                continue  # on the canvas right now, dropping the PhotoImage would blank it
+            del self.__tile_cache[old]
 
     def redraw_figures(self):
         """ Dummy function to redraw figures in the children classes """
@@ -184,6 +485,16 @@ class CanvasImage:
         self.__imframe.rowconfigure(0, weight=1)  # make canvas expandable
         self.__imframe.columnconfigure(0, weight=1)
 
+    def hide(self):
+        """ Take the widget off the parent, grid shows it again with the same zoom and position """
+        self.__imframe.grid_remove()
+
+    def memory_size(self):
+        """ Rough number of bytes held by the decoded pyramid levels and the cached tiles """
+        levels = self.__pyramid[:len(self.__pyramid) - self.__mapped]
+        tiles = len(self.__tile_cache) * self.__tile_size * self.__tile_size * 4
+        return tiles + sum(level.size[0] * level.size[1] * len(level.getbands()) for level in levels if level is not None)
+
     def pack(self, **kw):
         """ Exception: cannot use pack with this widget """
         raise Exception('Cannot use pack with the widget ' + self.__class__.__name__)
@@ -196,13 +507,15 @@ class CanvasImage:
     def __scroll_x(self, *args, **kwargs):
         """ Scroll canvas horizontally and redraw the image """
         self.canvas.xview(*args)  # scroll horizontally
-        self.__show_image()  # redraw the image
+        self.interaction__()
+        self.request_redraw()  # redraw the image
 
     # noinspection PyUnusedLocal
     def __scroll_y(self, *args, **kwargs):
         """ Scroll canvas vertically and redraw the image """
         self.canvas.yview(*args)  # scroll vertically
-        self.__show_image()  # redraw the image
+        self.interaction__()
+        self.request_redraw()  # redraw the image
 
     def __show_image(self):
         """ Show image on the Canvas. Implements correct image zoom almost like in Google Maps """
@@ -230,26 +543,7 @@ class CanvasImage:
         x2 = min(box_canvas[2], box_image[2]) - box_image[0]
         y2 = min(box_canvas[3], box_image[3]) - box_image[1]
         if int(x2 - x1) > 0 and int(y2 - y1) > 0:  # show image if it in the visible area
-            if self.__huge and self.__curr_img < 0:  # show huge image
-                h = int((y2 - y1) / self.imscale)  # height of the tile band
-                self.__tile[1][3] = h  # set the tile band height
-                self.__tile[2] = self.__offset + self.imwidth * int(y1 / self.imscale) * 3
-                self.__image.close()
-                self.__image = Image.open(self.path)  # reopen / reset image
-                self.__image.size = (self.imwidth, h)  # set size of the tile band
-                self.__image.tile = [self.__tile]
-                image = self.__image.crop((int(x1 / self.imscale), 0, int(x2 / self.imscale), h))
-            else:  # show normal image
-                image = self.__pyramid[max(0, self.__curr_img)].crop(  # crop current img from pyramid
-                                    (int(x1 / self.__scale), int(y1 / self.__scale),
-                                     int(x2 / self.__scale), int(y2 / self.__scale)))
-            #
-            imagetk = ImageTk.PhotoImage(image.resize((int(x2 - x1), int(y2 - y1)), self.__filter))
-            imageid = self.canvas.create_image(max(box_canvas[0], box_img_int[0]),
-                                               max(box_canvas[1], box_img_int[1]),
-                                               anchor='nw', image=imagetk)
-            self.canvas.lower(imageid)  # set image into background
-            self.canvas.imagetk = imagetk  # keep an extra reference to prevent garbage-collection
+            self.render_tiles__(box_image, x1, y1, x2, y2)
             # print(self.data_draw_points)
             # for data_pt in self.data_draw_points:
             #     img_x, img_y, color = data_pt
@@ -257,6 +551,26 @@ class CanvasImage:
     
     def show_image(self): self.__show_image()
 
+    def request_redraw(self):
+        """ Redraw once the pending events are handled, a burst of drags or resizes ends up as one frame """
+        if self.__redraw_pending:
+            self.frames_dropped += 1
+            return
+        self.__redraw_pending = True
+        self.canvas.after_idle(self.redraw__)
+
+    def redraw__(self):
+        self.__redraw_pending = False
+        if self.__cancel.is_set():
+            return  # destroyed while the redraw was pending
+        self.__show_image()
+        self.frames_rendered += 1
+
+    def render_stats(self):
+        """ Frames drawn, redraw requests folded into another frame, tile items on the canvas and tiles being rendered """
+        return {"rendered" : self.frames_rendered, "dropped" : self.frames_dropped,
+                "tile_items" : len(self.__tile_items) + len(self.__free_tiles), "pending" : len(self.__pending)}
+
     def __move_from(self, event):
         """ Remember previous coordinates for scrolling with the mouse """
         # print(f"zoom options are {self.zoom_in_option} and {self.zoom_out_option}")
@@ -282,7 +596,8 @@ class CanvasImage:
         # else:
         #     print("options were false")
         self.canvas.scan_dragto(event.x, event.y, gain=1)
-        self.__show_image()  # zoom tile and show it on the canvas
+        self.interaction__()
+        self.request_redraw()  # zoom tile and show it on the canvas
     
     def img_coords(self, x, y):
         """
@@ -354,16 +669,16 @@ class CanvasImage:
         self.__scale = k * math.pow(self.__reduction, max(0, self.__curr_img))
         #
         self.canvas.scale('all', x, y, scale, scale)  # rescale all objects
+        self.interaction__()
         # Redraw some figures before showing image on the screen
         self.redraw_figures()  # method for child classes
-        self.__show_image()
+        self.request_redraw()
     
     def motion_magnifier__(self, event):
         if not self.magnifier_on:
             return
         size = 120          # size of magnifier box
         zoom_factor = 2.5 * self.imscale   # magnification level
-        half = size // 2
 
         # Convert canvas coords to image coords
         canvas_x = self.canvas.canvasx(event.x)
@@ -383,9 +698,39 @@ class CanvasImage:
         right = img_x + crop_size // 2
         bottom = img_y + crop_size // 2
         
-        cropped = self.motion_image__.crop((left, top, right, bottom))
-        resized = cropped.resize((size, size), self.__filter)
-        
+        # Resampled on the render pool, one job at a time: while one runs only the latest position is kept
+        self.__magnifier_request = (canvas_x, canvas_y, (left, top, right, bottom), size)
+        if self.__magnifier_job is None:
+            self.start_magnifier__()
+
+    def start_magnifier__(self):
+        canvas_x, canvas_y, box, size = self.__magnifier_request
+        self.__magnifier_request = None
+        image = self.motion_image__
+        self.__magnifier_job = (canvas_x, canvas_y, size)
+        render_pool().submit(lambda: image.crop(box).resize((size, size), self.__filter),
+                             done=lambda future: self.__rendered.put(("magnifier", future)))
+        if not self.__polling:
+            self.__polling = True
+            self.poll_rendered__()
+
+    def magnifier_done__(self, future):
+        """ Draw the magnifier the render pool finished, then start on the latest position asked for """
+        canvas_x, canvas_y, size = self.__magnifier_job
+        self.__magnifier_job = None
+        if not getattr(self, "magnifier_on", False):
+            self.__magnifier_request = None
+            return
+        try:
+            resized = future.result()
+        except Exception as e:
+            print(f"Error rendering the magnifier: {e}")
+            resized = None
+        if self.__magnifier_request is not None:
+            self.start_magnifier__()
+        if resized is None:
+            return
+        half = size // 2
         self.magnifier_photo = ImageTk.PhotoImage(resized)
 
         # Remove old magnifier
@@ -434,6 +779,8 @@ class CanvasImage:
             self.magnifier_on = True
             if getattr(self, "temp_magnifier_img__", None) is not None:
                 self.motion_image__ = self.temp_magnifier_img__
+            elif self.__raster is not None:
+                self.motion_image__ = self.__raster  # crops of a huge image only read what the magnifier shows
             else:
                 self.motion_image__ = Image.open(self.path)
 
@@ -546,9 +893,10 @@ class CanvasImage:
         self.__scale = k * math.pow(self.__reduction, max(0, self.__curr_img))
         #
         self.canvas.scale('all', x, y, scale, scale)  # rescale all objects
+        self.interaction__()
         # Redraw some figures before showing image on the screen
         self.redraw_figures()  # method for child classes
-        self.__show_image()
+        self.request_redraw()
 
     def __keystroke(self, event):
         """ Scrolling with the keyboard.
@@ -569,24 +917,31 @@ class CanvasImage:
 
     def crop(self, bbox):
         """ Crop rectangle from the image and return it """
-        if self.__huge:  # image is huge and not totally in RAM
-            band = bbox[3] - bbox[1]  # width of the tile band
-            self.__tile[1][3] = band  # set the tile height
-            self.__tile[2] = self.__offset + self.imwidth * bbox[1] * 3  # set offset of the band
-            self.__image.close()
-            self.__image = Image.open(self.path)  # reopen / reset image
-            self.__image.size = (self.imwidth, band)  # set size of the tile band
-            self.__image.tile = [self.__tile]
-            return self.__image.crop((bbox[0], 0, bbox[2], band))
+        if self.__huge and self.__raster is not None:  # image is huge and not totally in RAM
+            return self.__raster.crop(bbox)  # only the pixels inside bbox are read
+        if self.__huge:  # the raster is still being made
+            with Image.open(self.path) as image:
+                return image.crop(bbox)
         else:  # image is totally in RAM
+            if self.__pyramid[0] is None:  # still being loaded by the worker
+                with Image.open(self.path) as image:
+                    return image.crop(bbox)
             return self.__pyramid[0].crop(bbox)
 
     def destroy(self):
         """ ImageFrame destructor """
+        self.__cancel.set()  # stop building levels nobody is going to see
+        for future in self.__pending.values():
+            render_pool().cancel(future)
+        self.__pending.clear()
+        if self.__cached:
+            pyramid_cache.release(self.path)
         self.__image.close()
         map(lambda i: i.close, self.__pyramid)  # close all pyramid images
         del self.__pyramid[:]  # delete pyramid list
         del self.__pyramid  # delete pyramid variable
+        self.__tile_cache.clear()
+        self.__raster = None  # unmapped once the render pool is done with it
         self.canvas.destroy()
         self.__imframe.destroy()
 
@@ -4,11 +4,17 @@ from tkinter import messagebox
 from tkinter import filedialog as fd
 from .zoom_image_viewer import ZoomImageViewer
 from .canvas_img import CanvasImage
+from .viewer_cache import ViewerCache
 from .multi_selector_side_table import MultiSelectSideTable
 from .name_color_dialog import get_name_and_color, get_name_and_color_edit
 from .ask_custom import askcustom
-from ..utils.safety import set_always_sync_on_startup, backup_from_sync, set_external_sync, external_sync, get_data_points, save_data_points, load_image_paths, add_image, get_image_path, delete_image
+from .transfer_dialog import show_transfer
+from ..utils.safety import set_always_sync_on_startup, backup_from_sync, set_external_sync, external_sync, get_data_points, load_image_paths, start_add_image, finish_add_image, get_image_path, delete_image
+from ..utils.safety import set_transfer_view, start_background_sync, has_interrupted_sync, start_resource_validation, check_failed_saves
+from ..utils.safety import save_new_image_points, save_data_point, save_edited_data_point, save_deleted_data_point, save_data_point_note
 from ..utils.config import config
+from ..utils.annotation_store import AnnotationStore
+from ..utils.startup_profile import phase
 from pathlib import Path
 from PIL import Image, ImageTk
 from functools import partial
@@ -18,13 +24,16 @@ class MainGui(tk.Tk):
         super().__init__()
         self.title("Neuropixel Probe Location Documentation")
         self.geometry("800x600")
+        # Syncs and backups show their progress in a window instead of freezing the gui
+        set_transfer_view(partial(show_transfer, self))
         self.toolbar = tk.Frame(self)
         self.toolbar.grid(row=0, column=0, columnspan=2, sticky="ew")
         # self.toolbar.pack(side="top", fill="x")
         # .name would give you with the extension
         # .stem would give you without the extension
         self.images = [Path(file_path).stem for file_path in load_image_paths()]
-        self.data_points = get_data_points()
+        with phase("load annotations"):
+            self.load_annotations__()
         self.selected_image = None
         self.combo_box = None
         if self.images == {} or len(self.images) == 0:
@@ -67,6 +76,8 @@ class MainGui(tk.Tk):
         self.zoom_out_button = tk.Button(self.toolbar, image=self.zoom_out_icon, command=self.zoom_out__)
         self.zoom_out_button.pack(side = 'left', padx=5, anchor="nw")
         self.image_viewer = None
+        self.viewers = ViewerCache()
+        self.restored_points__ = {}  # points that were shown on a viewer taken from self.viewers
         # Make the main column expand
         self.grid_rowconfigure(0, weight=0)   # toolbar does NOT expand
         self.grid_columnconfigure(1, weight=1)
@@ -75,7 +86,8 @@ class MainGui(tk.Tk):
         # self.grid_rowconfigure(1, weight=1)   # viewer expands
         # self.grid_columnconfigure(0, weight=0) # Column point viewer does NOT expand
         # self.grid_columnconfigure(1, weight=1) # viewer expands
-        self.display_new_image()
+        with phase("display_new_image"):
+            self.display_new_image()
         self.point_radius = tk.Scale(self.toolbar,
                                      from_ = 0.0,
                                      to = 50.0,
@@ -90,6 +102,7 @@ class MainGui(tk.Tk):
         self.options_menu = tk.Menu(self.menubar, tearoff=0)
         self.options_menu.add_command(label="Set External Sync", command=set_external_sync)
         self.options_menu.add_command(label="Sync", command= lambda f=True: external_sync(f))
+        self.options_menu.add_command(label="Preview Sync", command= lambda f=True: external_sync(f, dry_run=True))
         self.options_menu.add_command(label="Backup From Sync", command=lambda f=True: backup_from_sync)
         self.option_always_sync_on_startup_var = tk.BooleanVar()
         self.option_always_sync_on_startup_var.set(config.get("StartupBackupSync", False))
@@ -114,21 +127,47 @@ class MainGui(tk.Tk):
 
         self.update_data_point_selector()
         self.status_window = None
-
+        self.sync_status_label = None
+        self.background_sync = None
+        # A sync that was interrupted last time (the program was killed while syncing on exit) is picked up again
+        if has_interrupted_sync():
+            self.after(500, self.resume_interrupted_sync__)
+        # The slow checks of the images happen once the window is showing
+        self.resource_validation = None
+        self.after(1000, self.start_resource_validation__)
+        self.after(1000, self.poll_failed_saves__)
+
+
+    def load_annotations__(self):
+        self.annotations = AnnotationStore(get_data_points())
+        self.annotations.subscribe(self.save_annotation_change__)
+
+    # Every change to the annotations is saved as a single record
+    def save_annotation_change__(self, event, img, name, entry):
+        if event == "image":
+            save_new_image_points(img)
+        elif event == "add":
+            save_data_point(img, entry)
+        elif event == "edit":
+            save_edited_data_point(img, name, entry)
+        elif event == "delete":
+            save_deleted_data_point(img, name)
+        elif event == "note":
+            save_data_point_note(img, name, entry["notes"])
 
     def update_data_point_selector(self):
         var_cpy = {}
         for key in self.data_point_selector.vars.keys():
             var_cpy[key] = self.data_point_selector.vars[key].get()
+        var_cpy.update(self.restored_points__)
+        self.restored_points__ = {}
         self.toggle_data_points_off()
-        l = self.data_points[self.selected_image.get()]
-        if len(l) == 0:
-            self.data_point_selector.items = []
+        l = self.annotations.sorted_by_name(self.selected_image.get())
         
         self.data_point_selector.vars = {}
         self.data_point_selector.items = [(item["name"], item["color"]) for item in l]
-        self.data_point_selector.items = sorted(self.data_point_selector.items, key = lambda item: item[0])
-        self.data_point_selector.make_dropdown()
+        with phase("make_dropdown"):
+            self.data_point_selector.make_dropdown()
         keys = self.data_point_selector.vars.keys()
         for key in var_cpy.keys():
             if key in keys:
@@ -136,17 +175,15 @@ class MainGui(tk.Tk):
         
     
     def delete_data_point(self, name):
-        l = self.data_points[self.selected_image.get()]
-        indexes = [i for i, x in enumerate(l) if x["name"] == name]
-        if len(indexes) == 0:
+        img = self.selected_image.get()
+        item = self.annotations.get(img, name)
+        if item is None:
             return
         if not messagebox.askyesno("Confirm Delete", f"Are you sure that you would like to delete {name} data point?"):
             return
-        item = self.data_points[self.selected_image.get()][indexes[0]]
         if self.image_viewer:
             self.image_viewer.remove_data_point(item["pos"][0], item["pos"][1], item["color"])
-        self.data_points[self.selected_image.get()].pop(indexes[0])
-        save_data_points(self.data_points)
+        self.annotations.delete(img, name)
         self.update_data_point_selector()
         # self.data_point_selector.toggle_dropdown()
 
@@ -156,46 +193,35 @@ class MainGui(tk.Tk):
     #     self.data_point_selector
     
     def edit_note__(self, name, note):
-        l = self.data_points[self.selected_image.get()]
-        indexes = [i for i, x in enumerate(l) if x["name"] == name]
-        if len(indexes) == 0:
-            return
-        self.data_points[self.selected_image.get()][indexes[0]]["notes"] = note
-        save_data_points(self.data_points)
+        self.annotations.set_note(self.selected_image.get(), name, note)
     
     def get_note__(self, name):
-        l = self.data_points[self.selected_image.get()]
-        indexes = [i for i, x in enumerate(l) if x["name"] == name]
-        if len(indexes) == 0:
-            return ""
-        return self.data_points[self.selected_image.get()][indexes[0]].get("notes", "")
+        return self.annotations.get_note(self.selected_image.get(), name)
 
 
     def handle_final_data_point_adder__(self, img, name, color, pos):
         # print(f"handle final data point adder called {img}, {name}, {color}, {pos}")
         if pos is None: return
-        for item in self.data_points[img]:
-            if item["name"] == name:
-                messagebox.showwarning("Duplicate Name", "You are trying to register a date twice under the same image (please change name/date)")
-                return # because the name already exists
         # self.data_point_selector_add__(name, color)
-        self.data_points[img].append({"name" : name, "color" : color, "pos" : pos, "notes" : ""})
-        save_data_points(self.data_points)
+        if not self.annotations.add(img, {"name" : name, "color" : color, "pos" : pos, "notes" : ""}):
+            messagebox.showwarning("Duplicate Name", "You are trying to register a date twice under the same image (please change name/date)")
+            return # because the name already exists
         self.update_data_point_selector() 
         self.hide_status()
         self.data_point_selector.vars[name].set(True)
 
-    def handle_final_data_point_editer__(self, index, img, name, color, canvas_data_point, pos):
+    def handle_final_data_point_editer__(self, old_name, img, name, color, canvas_data_point, pos):
         # print(f"handle final data point adder called {img}, {name}, {color}, {pos}")
         print("handling final data point edit")
         if canvas_data_point is not None:
             self.manual_remove_data_point_on_canvas(*canvas_data_point)
         if pos is None: return
-        print(self.data_points[img][index])
-        n_notes = self.data_points[img][index].get("notes", "")
-        print(n_notes)
-        self.data_points[img][index] = {"name" : name, "color" : color, "pos" : pos, "notes" : n_notes}
-        save_data_points(self.data_points)
+        n_notes = self.annotations.get_note(img, old_name)
+        if not self.annotations.edit(img, old_name, {"name" : name, "color" : color, "pos" : pos, "notes" : n_notes}):
+            messagebox.showwarning("Duplicate Name", "You are trying to register a date twice under the same image (please change name/date)")
+            self.update_data_point_selector()
+            self.hide_status()
+            return
         self.update_data_point_selector()
         self.data_point_selector.vars[name].set(True)
         self.hide_status()
@@ -219,21 +245,15 @@ class MainGui(tk.Tk):
             self.image_viewer.pos_input_fcn = pos_func
             # self.toggle_data_points_off()
             img = self.selected_image.get()
-            data_pts = self.data_points[img]
+            data_pts = self.annotations.points(img)
 
             self.image_viewer.togle_motion_picker(self.point_radius.get(), data_pts)
 
     def edit_data_point(self, name):
         img = self.selected_image.get()
         print("going to edit", name)
-        index = -1
-        for i in range(len(self.data_points[img])):
-            if self.data_points[img][i]["name"] == name:
-                index = i
-                break
-        if index == -1: return
-        print("index is", index)
-        print(self.data_points[img][index])
+        entry = self.annotations.get(img, name)
+        if entry is None: return
         # if self.data_point_selector.popup and self.data_point_selector.popup.winfo_exists():
         #     self.data_point_selector.popup.destroy()
         canvas_data_point = self.find_canvas_point_data(name)
@@ -243,26 +263,27 @@ class MainGui(tk.Tk):
         self.data_point_selector.vars[name].set(False)
         if canvas_data_point is not None:
             self.manual_draw_data_point_on_canvas(*canvas_data_point, name) 
-        result = get_name_and_color_edit(self, name = name, color = self.data_points[img][index]["color"])
+        old_name = name
+        result = get_name_and_color_edit(self, name = name, color = entry["color"])
         if result and result[2]:
             name, color, change_loc = result
             self.show_status(f"Currently editing point {name} position")
             self.image_viewer.canvas.focus_force()
             pos_func = partial(
                 self.handle_final_data_point_editer__,
-                index,
+                old_name,
                 img,
                 name,
                 color,
                 canvas_data_point
             )
             self.image_viewer.pos_input_fcn = pos_func
-            data_pts = self.data_points[img]
+            data_pts = self.annotations.points(img)
             self.image_viewer.togle_motion_picker(self.point_radius.get(), data_pts)
         if result and not result[2]:
             name, color, change_loc = result
-            self.handle_final_data_point_editer__(index, img, name, color, canvas_data_point,
-                                                  self.data_points[img][index]["pos"])
+            self.handle_final_data_point_editer__(old_name, img, name, color, canvas_data_point,
+                                                  entry["pos"])
         else:
             self.update_data_point_selector()
     
@@ -279,11 +300,7 @@ class MainGui(tk.Tk):
     
     def find_canvas_point_data(self, name):
         if self.image_viewer is None: return None
-        img = self.selected_image.get()
-        for pt in self.data_points[img]:
-            if name == pt["name"]:
-                return pt
-        return None
+        return self.annotations.get(self.selected_image.get(), name)
 
     def manual_remove_data_point_on_canvas(self, x, y, color):
         if (x, y, color) in self.image_viewer.data_draw_points:
@@ -312,14 +329,8 @@ class MainGui(tk.Tk):
             var.set(False)
 
     def check_data_points(self):
-        save = False
         for image in self.images:
-            if image not in self.data_points.keys():
-                save = True
-                self.data_points[image] = []
-        
-        if save:
-            save_data_points(self.data_points)
+            self.annotations.add_image(image)
     
     def update_image_selector(self):
         if self.combo_box is None:
@@ -342,7 +353,7 @@ class MainGui(tk.Tk):
             return
         
         img = self.selected_image.get()
-        data_pts = self.data_points[img]
+        data_pts = self.annotations.points(img)
 
         img = self.image_viewer.get_image__(self.point_radius.get(), data_pts)
         img.save(file_path)
@@ -368,23 +379,44 @@ class MainGui(tk.Tk):
         self.combo_box.bind("<<ComboboxSelected>>", self.on_image_selection__)
     
     def display_new_image(self):
+        if self.image_viewer is not None:
+            # Remembered so the same points come back if this viewer is shown again
+            self.image_viewer.shown_points = [name for name, var in self.data_point_selector.vars.items() if var.get()]
         self.toggle_data_points_off()
         if not hasattr(self, "selected_image"):
             return
-        img_path = get_image_path(self.selected_image.get())
+        name = self.selected_image.get()
+        img_path = get_image_path(name)
         if img_path is None:
             messagebox.showwarning("Image Not Found", f"The image {img_path} does not exist!")
             return
         print("image path is", img_path)
         if self.image_viewer is not None:
-            # destroy current zoom image viewer
-            self.image_viewer.destroy()
-        self.image_viewer = CanvasImage(self, img_path)
+            # hide the current zoom image viewer, self.viewers destroys it once it is not recent anymore
+            self.hide_image_viewer__()
+        viewer = self.viewers.get(name, img_path)
+        if viewer is None:
+            viewer = CanvasImage(self, img_path)
+        self.image_viewer = viewer
         self.image_viewer.grid(row=1, column=1)
+        self.viewers.put(name, viewer)
+        self.restored_points__ = {point : True for point in viewer.shown_points}
         self.data_point_selector.vars = {}
         # self.image_viewer.pack(side="top", fill="both", expand=True)
 
     
+    def hide_image_viewer__(self):
+        """ Leave no zoom or point picking mode behind on a viewer that goes off screen """
+        viewer = self.image_viewer
+        if getattr(viewer, "magnifier_on", False):
+            viewer.togle_motion_picker()
+        viewer.zoom_in_option = False
+        viewer.zoom_out_option = False
+        viewer.canvas.config(cursor="")
+        self.zoom_in_button.config(image=self.zoom_in_icon)
+        self.zoom_out_button.config(image=self.zoom_out_icon)
+        viewer.hide()
+
     def zoom_in__(self, event = None):
         if self.image_viewer is None:
             return
@@ -432,9 +464,14 @@ class MainGui(tk.Tk):
 
 
     def delete_image__(self, name):
-        delete_image(name)
+        def release_viewer():
+            # The viewer still has the file open, it goes before the file does
+            if self.viewers.remove(name) is self.image_viewer:
+                self.image_viewer = None
+        if not delete_image(name, on_confirmed = release_viewer):
+            return
         self.images = [Path(file_path).stem for file_path in load_image_paths()]
-        self.data_points = get_data_points()
+        self.load_annotations__()
         if self.images == {} or len(self.images) == 0:
             self.images = []
             img_or_sync = askcustom(self, "No Images Found", "No images have been registered yet, please either sync with an external directory that has images, or select an image",
@@ -473,20 +510,30 @@ class MainGui(tk.Tk):
             filetypes=filetypes
         )
         if filename:
-            new_image = add_image(filename)
-            if new_image is not None:
-                img_name = Path(new_image).stem
-                if img_name in self.images:
-                    messagebox.showwarning("Duplicate Image", "You are trying to register an image who's name already exists in the registrar!")
-                    return
-                self.images.append(Path(new_image).stem)
-                self.update_image_selector()
-                self.check_data_points()
-                self.update_delete_images_menu()
-                if hasattr(self, "selected_image"):
-                    self.selected_image.set(Path(new_image).stem)
-                    self.display_new_image()
-                    self.update_data_point_selector()
+            # The image is hashed and copied on a worker thread, the window keeps responding meanwhile
+            status_label = ttk.Label(self.toolbar, text=f"Importing {Path(filename).name}...")
+            status_label.pack(side = 'right', padx=5, anchor="ne")
+            self.poll_new_image__(filename, start_add_image(filename), status_label)
+
+    def poll_new_image__(self, filename, future, status_label):
+        if not future.done():
+            self.after(100, self.poll_new_image__, filename, future, status_label)
+            return
+        status_label.destroy()
+        new_image = finish_add_image(filename, future)
+        if new_image is not None:
+            img_name = Path(new_image).stem
+            if img_name in self.images:
+                messagebox.showwarning("Duplicate Image", "You are trying to register an image who's name already exists in the registrar!")
+                return
+            self.images.append(Path(new_image).stem)
+            self.update_image_selector()
+            self.check_data_points()
+            self.update_delete_images_menu()
+            if hasattr(self, "selected_image"):
+                self.selected_image.set(Path(new_image).stem)
+                self.display_new_image()
+                self.update_data_point_selector()
     
     def show_status(self, text):
         if self.status_window and self.status_window.winfo_exists():
@@ -523,6 +570,73 @@ class MainGui(tk.Tk):
             self.status_window.destroy()
             self.status_window = None
 
+    def start_resource_validation__(self):
+        self.resource_validation = start_resource_validation()
+        self.poll_resource_validation__()
+
+    def poll_resource_validation__(self):
+        if not self.resource_validation.done():
+            self.after(500, self.poll_resource_validation__)
+            return
+        try:
+            problems = self.resource_validation.result()
+        except Exception as e:
+            problems = [f"The images could not be checked: {e}"]
+        self.resource_validation = None
+        if len(problems) > 0:
+            shown = "\n".join(problems[:10])
+            if len(problems) > 10:
+                shown += f"\n... and {len(problems) - 10} more"
+            messagebox.showwarning("Image Problems", shown)
+
+    def poll_failed_saves__(self):
+        check_failed_saves()
+        self.after(1000, self.poll_failed_saves__)
+
+    def resume_interrupted_sync__(self):
+        self.background_sync = start_background_sync(resume = True)
+        if self.background_sync is None:
+            return
+        self.sync_status_label = ttk.Label(self.toolbar, text="Syncing...")
+        self.sync_status_label.pack(side = 'right', padx=5, anchor="ne")
+        self.poll_background_sync__()
+
+    def poll_background_sync__(self):
+        if self.background_sync.is_running():
+            done, total = self.background_sync.progress()
+            self.sync_status_label.configure(text=f"Syncing {done}/{total}" if total > 0 else "Syncing...")
+            self.after(200, self.poll_background_sync__)
+            return
+        self.sync_status_label.destroy()
+        self.sync_status_label = None
+        if not self.background_sync.result and not self.background_sync.is_cancelled():
+            messagebox.showwarning("External Sync Failed",
+                                   "Error: Resuming the interrupted sync failed, please sync manually with the application sync button")
+        self.background_sync = None
+
+    def close_after_sync(self, sync):
+        """ Hide the main window right away and let sync finish in the background, then close """
+        self.withdraw()
+        window = tk.Toplevel(self)
+        window.title("Syncing")
+        window.resizable(False, False)
+        label = ttk.Label(window, text="Syncing...", width=30, padding=10)
+        label.pack()
+        # Quitting leaves the partial copies and the resume file behind, the sync continues on the next launch
+        ttk.Button(window, text="Quit Now", command=self.destroy).pack(pady=(0, 10))
+        window.protocol("WM_DELETE_WINDOW", self.destroy)
+        def poll():
+            if sync.is_running():
+                done, total = sync.progress()
+                label.configure(text=f"Syncing {done}/{total} files" if total > 0 else "Syncing...")
+                self.after(200, poll)
+                return
+            if not sync.result:
+                messagebox.showwarning("External Sync Failed",
+                                       "Error: External sync failed, please sync manually with the application sync button on the next launch", parent=window)
+            self.destroy()
+        poll()
+
 
 if __name__ == '__main__':
     root = MainGui()
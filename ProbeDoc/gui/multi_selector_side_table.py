@@ -6,6 +6,7 @@ from tkinter import ttk
 from .collapsable_note import CollapsableNote
 from .scrollable_frame import ScrollableFrame
 from functools import partial
+from ..utils.startup_profile import phase
 
 
 # This is the side table that has the different data points and the "edit" "delete" and soon notes function
@@ -22,7 +23,8 @@ class MultiSelectSideTable:
         self.bind_func = self.on_item_toggle
         self.edit_points_fcn = self.edit_button
         self.delete_points_fcn = self.delete_button
-        self.make_dropdown(row=row, column=column)
+        with phase("make_dropdown"):
+            self.make_dropdown(row=row, column=column)
         self.notes_callback = None
         self.get_notes_callback = None
         self.max_width = 70
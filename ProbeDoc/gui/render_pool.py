@@ -0,0 +1,74 @@
+# Worker threads that resample image tiles off the Tk thread
+# Pillow releases the GIL while it crops and resizes, so a LANCZOS resize of a tile can run on a worker while
+# the Tk thread keeps handling input. Tk itself must only be used from the Tk thread, so the workers hand back
+# PIL images and the viewer turns them into PhotoImages when it polls for results with after().
+# One pool is shared by every viewer, with RenderWorkers threads.
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ..utils.config import config
+
+
+class RenderPool:
+    def __init__(self, workers : int):
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self.__lock = threading.Lock()
+        self.__queued = 0
+        self.__running = 0
+        self.__completed = 0
+        self.__cancelled = 0
+        self.__latencies = deque(maxlen=256)  # seconds from submit to finished, of the latest jobs
+
+    def submit(self, fcn, *args, done = None):
+        """ Run fcn(*args) on a worker, done(future) is called on the worker thread once it finished or was cancelled """
+        submitted = time.perf_counter()
+        def run():
+            with self.__lock:
+                self.__queued -= 1
+                self.__running += 1
+            try:
+                return fcn(*args)
+            finally:
+                with self.__lock:
+                    self.__running -= 1
+                    self.__completed += 1
+                    self.__latencies.append(time.perf_counter() - submitted)
+        with self.__lock:
+            self.__queued += 1
+        future = self.__executor.submit(run)
+        if done is not None:
+            future.add_done_callback(done)
+        return future
+
+    def cancel(self, future):
+        """ Cancel a job that did not start yet, a running job finishes and its result is ignored by the caller """
+        if future.cancel():
+            with self.__lock:
+                self.__queued -= 1
+                self.__cancelled += 1
+            return True
+        return False
+
+    def stats(self):
+        """ Queue depth, jobs running, finished and cancelled, and the latency of the latest jobs in ms """
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+            stats = {"queued" : self.__queued, "running" : self.__running,
+                     "completed" : self.__completed, "cancelled" : self.__cancelled}
+        stats["latency_avg"] = 1000 * sum(latencies) / len(latencies) if latencies else 0.0
+        stats["latency_p95"] = 1000 * latencies[max(0, int(len(latencies) * 0.95) - 1)] if latencies else 0.0
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def render_pool():
+    """ The pool shared by all the viewers, started the first time it is needed """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool(max(1, config["RenderWorkers"]))
+        return _pool
@@ -0,0 +1,90 @@
+# Progress window for a running TransferEngine (see utils/transfer.py)
+# The copying happens on the engine's threads, this only polls the engine with after() so the gui never freezes
+
+import os
+import tkinter as tk
+from tkinter import ttk
+
+
+class TransferDialog:
+    def __init__(self, parent, engine, title = "Syncing", poll_ms = 100):
+        self.engine = engine
+        self.poll_ms = poll_ms
+
+        self.window = tk.Toplevel(parent)
+        self.window.title(title)
+        self.window.transient(parent)
+        self.window.resizable(False, False)
+
+        self.total_label = ttk.Label(self.window, text="Preparing...", width=50)
+        self.total_label.pack(padx=10, pady=(10, 2), anchor="w")
+        self.total_bar = ttk.Progressbar(self.window, orient="horizontal", length=360, maximum=100)
+        self.total_bar.pack(padx=10, pady=2)
+        self.file_label = ttk.Label(self.window, text="", width=50)
+        self.file_label.pack(padx=10, pady=(8, 2), anchor="w")
+        self.file_bar = ttk.Progressbar(self.window, orient="horizontal", length=360, maximum=100)
+        self.file_bar.pack(padx=10, pady=2)
+
+        button_frame = ttk.Frame(self.window)
+        button_frame.pack(pady=10)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel)
+        self.cancel_button.pack(side="left", padx=5)
+        self.retry_button = ttk.Button(button_frame, text="Retry Failed", command=self.retry, state="disabled")
+        self.retry_button.pack(side="left", padx=5)
+        self.close_button = ttk.Button(button_frame, text="Close", command=self.close, state="disabled")
+        self.close_button.pack(side="left", padx=5)
+
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        # Modal, show_transfer runs a nested event loop and the main window must not start another sync meanwhile
+        self.window.wait_visibility()
+        self.window.grab_set()
+        self.poll__()
+
+    def poll__(self):
+        if not self.window.winfo_exists():
+            return
+        done_files, total_files, done_bytes, total_bytes = self.engine.progress()
+        self.total_label.configure(text=f"{done_files} / {total_files} files, {done_bytes >> 20} / {total_bytes >> 20} MB")
+        self.total_bar["value"] = 100.0 * done_bytes / total_bytes if total_bytes > 0 else 100.0
+        job = self.engine.current
+        if job is not None:
+            self.file_label.configure(text=os.path.basename(job.destination))
+            self.file_bar["value"] = 100.0 * job.done_bytes / job.size if job.size > 0 else 100.0
+        if self.engine.is_running():
+            self.window.after(self.poll_ms, self.poll__)
+            return
+        failed = self.engine.failed()
+        if len(failed) == 0:
+            self.close()
+            return
+        # Leave the window up so the failed files can be retried
+        self.total_label.configure(text=f"{len(failed)} of {total_files} files were not copied")
+        self.file_label.configure(text=", ".join(os.path.basename(job.destination) for job in failed[:3]))
+        self.cancel_button.configure(state="disabled")
+        self.retry_button.configure(state="normal")
+        self.close_button.configure(state="normal")
+
+    def cancel(self):
+        if self.engine.is_running():
+            self.engine.cancel()
+            self.cancel_button.configure(state="disabled")
+            return
+        self.close()
+
+    def retry(self):
+        if self.engine.retry_failed():
+            self.cancel_button.configure(state="normal")
+            self.retry_button.configure(state="disabled")
+            self.close_button.configure(state="disabled")
+            self.poll__()
+
+    def close(self):
+        if self.window.winfo_exists():
+            self.window.grab_release()
+            self.window.destroy()
+
+
+def show_transfer(parent, engine, title = "Syncing"):
+    """ Shows the progress of engine and returns once the window is closed, the gui keeps running meanwhile """
+    dialog = TransferDialog(parent, engine, title)
+    parent.wait_window(dialog.window)
@@ -0,0 +1,54 @@
+# Recently shown image viewers, kept alive (hidden) when another image is selected
+# Building a CanvasImage means opening the image and building or mapping its pyramid, so switching back
+# and forth between two images used to redo all of it and lose the zoom and scroll position every time.
+# The least recently shown viewers are destroyed once there are more than ViewerCacheSize of them or their
+# decoded pyramids take more than ViewerCacheMaxBytes together, the viewer on screen is never evicted.
+# ViewerCacheSize 0 only keeps the viewer on screen, which is how it worked before.
+
+from collections import OrderedDict
+from ..utils.config import config
+
+
+class ViewerCache:
+    """ Image name -> CanvasImage, least recently shown first """
+    def __init__(self):
+        self.viewers = OrderedDict()
+
+    def get(self, name, path):
+        """ The viewer of name if it is still alive and shows the file at path, None otherwise """
+        viewer = self.viewers.get(name)
+        if viewer is None:
+            return None
+        if viewer.path != path:
+            self.remove(name)  # the name was registered again with another image
+            return None
+        self.viewers.move_to_end(name)
+        return viewer
+
+    def put(self, name, viewer):
+        """ Remember the viewer now on screen and evict what no longer fits """
+        old = self.viewers.pop(name, None)
+        if old is not None and old is not viewer:
+            old.destroy()
+        self.viewers[name] = viewer
+        self.evict__(keep = viewer)
+
+    def remove(self, name):
+        viewer = self.viewers.pop(name, None)
+        if viewer is not None:
+            viewer.destroy()
+        return viewer
+
+    def memory_size(self):
+        return sum(viewer.memory_size() for viewer in self.viewers.values())
+
+    def evict__(self, keep):
+        total = self.memory_size()
+        for name in list(self.viewers.keys()):
+            if len(self.viewers) <= config["ViewerCacheSize"] and total <= config["ViewerCacheMaxBytes"]:
+                break
+            viewer = self.viewers[name]
+            if viewer is keep:
+                continue
+            total -= viewer.memory_size()
+            self.remove(name)
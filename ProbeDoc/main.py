@@ -1,14 +1,35 @@
-from .utils.safety import resource_check, ask_external_sync
+from .utils.safety import resource_check, ask_external_sync, flush_pending_saves
 from .gui.main_gui import MainGui
+from .utils.startup_profile import phase, first_frame
 
 def main():
-    resource_check()
+    with phase("resource_check"):
+        resource_check()
     def on_close():
-        ask_external_sync()
-        root.destroy()
-    root = MainGui()
+        flush_pending_saves()
+        if root.background_sync is not None:
+            # The window keeps responding while a long copy winds down, polled like the transfer dialog
+            root.background_sync.cancel()
+            root.protocol("WM_DELETE_WINDOW", lambda: None)
+            wait_for_background_sync(root.background_sync)
+            return
+        close()
+    def wait_for_background_sync(sync):
+        if sync.is_running():
+            root.after(100, wait_for_background_sync, sync)
+            return
+        close()
+    def close():
+        sync = ask_external_sync()
+        if sync is None:
+            root.destroy()
+        else:
+            root.close_after_sync(sync)
+    with phase("MainGui.__init__"):
+        root = MainGui()
     root.protocol("WM_DELETE_WINDOW", on_close)
     root.bind_all("<Button-1>", lambda event: event.widget.focus_set())
+    root.after_idle(first_frame, root)
     root.mainloop()
 
 
@@ -0,0 +1,136 @@
+# In memory model of the data points the gui works on
+# Every image keeps its points in a dict by name, so looking up, editing or deleting a point never has to scan
+# the whole list, and the point names are kept sorted as points are added and removed (the order the selector shows)
+# Listeners are told about every change (this is where the gui hooks up saving)
+# to_dict() gives back the on disk format: {image : [{"name", "color", "pos", "notes"}, ...]}
+
+import re
+import bisect
+
+
+# Point names are dates typed in by hand (YYYY/MM/DD), this turns them into a sortable YYYY-MM-DD
+def date_key(name : str):
+    match = re.match(r"^\s*(\d{4})\D(\d{1,2})\D(\d{1,2})", name)
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+class AnnotationStore:
+    def __init__(self, data_points):
+        self.__source = data_points  # dict (or LazyDataPoints) in the on disk format, read once per image
+        self.__points = {}  # image -> {name : entry}, in insertion order
+        self.__sorted = {}  # image -> sorted [name]
+        self.listeners = []
+
+    def subscribe(self, fcn):
+        """ fcn(event, img, name, entry) is called after every change
+            event is one of "image", "add", "edit", "delete", "note", for "edit" name is the old name """
+        self.listeners.append(fcn)
+
+    def notify__(self, event, img, name = None, entry = None):
+        for fcn in self.listeners:
+            fcn(event, img, name, entry)
+
+    def image_points__(self, img):
+        if img not in self.__points:
+            points = self.__source[img] if img in self.__source else []
+            if not isinstance(points, list):
+                points = []
+            self.__points[img] = {}
+            for entry in points:
+                entry.setdefault("notes", "")
+                self.__points[img][entry["name"]] = entry
+            self.__sorted[img] = sorted(self.__points[img])
+        return self.__points[img]
+
+    def images(self):
+        return list(dict.fromkeys(list(self.__source.keys()) + list(self.__points.keys())))
+
+    def has_image(self, img):
+        return img in self.__points or img in self.__source
+
+    def add_image(self, img):
+        if self.has_image(img):
+            return False
+        self.__points[img] = {}
+        self.__sorted[img] = []
+        self.notify__("image", img)
+        return True
+
+    def points(self, img):
+        """ List of the points of img, in the order they were added """
+        return list(self.image_points__(img).values())
+
+    def sorted_by_name(self, img):
+        points = self.image_points__(img)
+        return [points[name] for name in self.__sorted[img]]
+
+    def get(self, img, name):
+        return self.image_points__(img).get(name, None)
+
+    def __contains__(self, key):
+        img, name = key
+        return name in self.image_points__(img)
+
+    def get_note(self, img, name):
+        entry = self.get(img, name)
+        if entry is None:
+            return ""
+        return entry.get("notes", "")
+
+    def add__(self, img, entry):
+        self.__points[img][entry["name"]] = entry
+        bisect.insort(self.__sorted[img], entry["name"])
+
+    def remove__(self, img, name):
+        entry = self.__points[img].pop(name)
+        names = self.__sorted[img]
+        i = bisect.bisect_left(names, name)
+        if i < len(names) and names[i] == name:
+            names.pop(i)
+        return entry
+
+    def add(self, img, entry):
+        """ Returns False if a point with the same name is already on the image """
+        entry.setdefault("notes", "")
+        if entry["name"] in self.image_points__(img):
+            return False
+        self.add__(img, entry)
+        self.notify__("add", img, entry["name"], entry)
+        return True
+
+    def edit(self, img, old_name, entry):
+        """ Replace the point old_name with entry (which may have a new name), keeps the notes """
+        points = self.image_points__(img)
+        if old_name not in points:
+            return False
+        if entry["name"] != old_name and entry["name"] in points:
+            return False
+        old = self.remove__(img, old_name)
+        entry.setdefault("notes", old.get("notes", ""))
+        self.add__(img, entry)
+        self.notify__("edit", img, old_name, entry)
+        return True
+
+    def delete(self, img, name):
+        if name not in self.image_points__(img):
+            return None
+        entry = self.remove__(img, name)
+        self.notify__("delete", img, name, entry)
+        return entry
+
+    def set_note(self, img, name, note):
+        entry = self.get(img, name)
+        if entry is None:
+            return False
+        if entry.get("notes", "") == note:
+            return True  # nothing changed, no need to save
+        entry["notes"] = note
+        self.notify__("note", img, name, entry)
+        return True
+
+    def to_dict(self):
+        """ Every image's points in the on disk format """
+        return {img : self.points(img) for img in self.images()}
@@ -0,0 +1,115 @@
+# External sync that runs on a background thread, used on exit so the window can close right away
+# Before any file is copied a resume file is written with the copies that are about to happen
+# (and the size/mtime of each source). If the program is killed in the middle, the next launch finds the
+# resume file and runs the sync again, continuing the partial .tmp copies whose source did not change.
+
+import os
+import json
+import threading
+from .transfer import TransferEngine
+
+
+class BackgroundSync:
+    def __init__(self, sync_fcn, resume_file : str, max_workers = 4, retries = 2, delta_min_size = None,
+                 delta_block_size = 1 << 16):
+        self.sync_fcn = sync_fcn  # sync_fcn(run_copies) runs the sync, returns True on success
+        self.resume_file = resume_file
+        self.max_workers = max_workers
+        self.retries = retries
+        self.delta_min_size = delta_min_size
+        self.delta_block_size = delta_block_size
+        self.engine = None
+        self.result = None
+        self.__cancelled = False
+        self.__thread = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name="background-sync", daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            self.result = self.sync_fcn(self.run_copies)
+            if self.result:
+                # Also covers a resumed sync that turned out to have nothing left to copy
+                clear_resume_state(self.resume_file)
+        except Exception as e:
+            print(f"Error during background sync: {e}")
+            self.result = False
+
+    def run_copies(self, jobs : list):
+        previous = load_resume_state(self.resume_file)
+        for job in jobs:
+            # Only continue a partial copy if the source is still the one it was started from
+            old = previous.get(job.destination)
+            if old is not None and os.path.exists(job.source):
+                stat = os.stat(job.source)
+                job.resumable = old.get("size") == stat.st_size and old.get("mtime") == stat.st_mtime_ns
+        store_resume_state(self.resume_file, jobs)
+        if self.__cancelled:
+            return jobs  # cancelled while the files were being compared, the resume file has the copies for next time
+        self.engine = TransferEngine(self.max_workers, self.retries, keep_partial = True,
+                                     delta_min_size = self.delta_min_size, delta_block_size = self.delta_block_size)
+        self.engine.start(jobs)
+        self.engine.wait()
+        failed = self.engine.failed()
+        if len(failed) == 0:
+            clear_resume_state(self.resume_file)
+        return failed
+
+    def progress(self):
+        """ (done files, total files), (0, 0) while the sync is still working out what to copy """
+        if self.engine is None:
+            return 0, 0
+        done_files, total_files, done_bytes, total_bytes = self.engine.progress()
+        return done_files, total_files
+
+    def cancel(self):
+        self.__cancelled = True
+        if self.engine is not None:
+            self.engine.cancel()
+
+    def is_cancelled(self):
+        return self.__cancelled
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def wait(self, timeout = None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return not self.is_running()
+
+
+def load_resume_state(resume_file : str):
+    """ destination -> {"source", "size", "mtime"} of an interrupted sync """
+    if not os.path.exists(resume_file):
+        return {}
+    try:
+        with open(resume_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get("jobs", {})
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Ignoring unreadable resume file {resume_file}: {e}")
+        return {}
+
+def store_resume_state(resume_file : str, jobs : list):
+    state = {}
+    for job in jobs:
+        try:
+            stat = os.stat(job.source)
+        except OSError:
+            continue
+        state[job.destination] = {"source" : job.source, "size" : stat.st_size, "mtime" : stat.st_mtime_ns}
+    tmp_path = resume_file + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"jobs" : state}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, resume_file)
+
+def clear_resume_state(resume_file : str):
+    if os.path.exists(resume_file):
+        os.remove(resume_file)
+
+def has_resume_state(resume_file : str):
+    return os.path.exists(resume_file)
@@ -4,18 +4,56 @@ script_path = os.path.abspath(__file__)
 script_directory = os.path.dirname(script_path)
 parent_directory = os.path.dirname(script_directory)
 resource_directory = os.path.join(parent_directory, "resources")
+# Lets benchmarks run the program against a generated resource directory
+resource_directory = os.environ.get("PROBEDOC_RESOURCE_DIR", resource_directory)
 
 config = {
         "ResourceDirectory"     : resource_directory,
         "SavePointsFile"        : os.path.join(resource_directory, "data_points.json"),
+        "SavePointsJournalFile" : os.path.join(resource_directory, "data_points.journal"),
+        "JournalCompactThreshold" : 500,
+        "SqliteDatabaseFile"    : os.path.join(resource_directory, "probe_doc.db"),
+        "ShardDirectory"        : os.path.join(resource_directory, "points"),
+        "StorageBackend"        : "json",
+        "WriteBehindWindow"     : 0.25,
+        "SyncUseHash"           : False,
+        "TransferWorkers"       : 4,
+        "TransferRetries"       : 2,
+        "DeltaMinSize"          : 64 << 20,
+        "DeltaBlockSize"        : 1 << 16,
+        "SyncTarget"            : "directory",
+        "PackCompactRatio"      : 0.5,
+        "ValidateImageHashes"   : False,
+        "PyramidCacheMaxBytes"  : 4 << 30,
+        "RasterCacheMaxBytes"   : 16 << 30,
+        "ViewerCacheSize"       : 4,
+        "ViewerCacheMaxBytes"   : 1 << 30,
+        "TileSize"              : 256,
+        "TileCacheSize"         : 256,
+        "RenderWorkers"         : min(4, os.cpu_count() or 1),
+        "DecodeWorkers"         : min(8, os.cpu_count() or 1),
+        "ResamplingQuality"     : "adaptive",
+        "InteractiveFilter"     : "nearest",
+        "SettleDelay"           : 200,
         "ImageListsFile"        : os.path.join(resource_directory, "images.json"),
         "ImageOriginalListsFile": os.path.join(resource_directory, "images_original.json"),
+        "ImageHashesFile"       : os.path.join(resource_directory, "image_hashes.json"),
         "ImagesDirectory"       : os.path.join(resource_directory, "images"),
+        "ImageObjectsDirectory" : os.path.join(resource_directory, "images", "objects"),
         "ZoomOutImg"            : os.path.join(resource_directory, "zoom_out.png"),
         "ZoomInImg"             : os.path.join(resource_directory, "zoom_in.png"),
         "ZoomOutImgActivated"   : os.path.join(resource_directory, "zoom_out_activated.png"),
         "ZoomInImgActivated"    : os.path.join(resource_directory, "zoom_in_activated.png"),
         "SettingsFile"          : os.path.join(resource_directory, "settings.json"),
+        "SyncResumeFile"        : os.path.join(resource_directory, ".sync_resume.json"),
+        "ChangeLogDirectory"    : os.path.join(resource_directory, "changes"),
+        "MergeStateFile"        : os.path.join(resource_directory, ".merge_state.json"),
+        "MergeConflictsFile"    : os.path.join(resource_directory, "merge_conflicts.json"),
+        "PackedChangesDirectory": os.path.join(resource_directory, ".packed_changes"),
+        "ResourceManifestFile"  : os.path.join(resource_directory, ".resource_manifest.json"),
+        "PyramidCacheDirectory" : os.path.join(resource_directory, "pyramid_cache"),
+        "RasterCacheDirectory"  : os.path.join(resource_directory, "raster_cache"),
+        "RigId"                 : None,
         "ZoomInCursorFallback"  : "plus",
         "ZoomOutCursorFallback" : "minus"
 }
@@ -0,0 +1,52 @@
+# Content addressed image storage
+# Every imported image is stored once under resources/images/objects/<sha256><ext>, the registry (images.json,
+# or the images table of the sqlite backend) maps the image name to that hash.
+# A renamed copy of an image that is already registered is recognized by its hash and never copied again,
+# and two different images that happen to share a file name no longer collide.
+
+import os
+import shutil
+import hashlib
+from pathlib import Path
+from .config import config
+
+_chunk_size = 1 << 20  # read 1 MB at a time so hashing never loads a whole image
+
+
+def hash_file(path : str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def object_name(digest : str, ext : str):
+    return digest + ext.lower()
+
+def object_path(digest : str, ext : str):
+    return os.path.join(config["ImageObjectsDirectory"], object_name(digest, ext))
+
+def store_file(source_path : str, digest : str):
+    """ Copy source_path into the object store, returns the stored path. Known content is not copied again """
+    dest_path = object_path(digest, Path(source_path).suffix)
+    if os.path.exists(dest_path):
+        return dest_path
+    os.makedirs(config["ImageObjectsDirectory"], exist_ok = True)
+    tmp_path = dest_path + ".tmp"
+    shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)  # a half copied file never shows up under its hash
+    return dest_path
+
+def unique_name(img_name : str, taken):
+    """ img_name, or img_name with _2, _3... added to the stem if that stem is already taken """
+    stem, ext = Path(img_name).stem, Path(img_name).suffix
+    taken_stems = {Path(name).stem for name in taken}
+    if stem not in taken_stems:
+        return img_name
+    i = 2
+    while f"{stem}_{i}" in taken_stems:
+        i += 1
+    return f"{stem}_{i}{ext}"
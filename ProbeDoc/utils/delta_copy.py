@@ -0,0 +1,208 @@
+# rsync style delta copy for large files that changed a little (re-exported TIFFs for example)
+# The destination's blocks are described by a signature file stored next to it (<file>.blocksig):
+# a cheap rolling checksum (adler32) and a strong hash per block. The source is scanned with the rolling
+# checksum, every block of it that is already somewhere in the destination is copied from the old destination
+# file (server side with copy_file_range where the share supports it), only the bytes that match nothing are
+# written from the source.
+# Unchanged regions cost one adler32 + one hash per block (both in C), the byte by byte rolling only happens
+# around the changes. If too much of the file changed the delta is given up and the caller does a full copy.
+
+import os
+import mmap
+import json
+import zlib
+import shutil
+import hashlib
+
+signature_suffix = ".blocksig"
+_mod = 65521  # adler32 modulus
+
+
+def signature_path(path : str):
+    return path + signature_suffix
+
+def _strong(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+def compute_signature(path : str, block_size : int):
+    """ {"size", "mtime", "block_size", "weak", "strong"} of every full block of path """
+    weak, strong = [], []
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            weak.append(zlib.adler32(block))
+            strong.append(_strong(block))
+    stat = os.stat(path)
+    return {"size" : stat.st_size, "mtime" : stat.st_mtime_ns, "block_size" : block_size, "weak" : weak, "strong" : strong}
+
+def load_signature(path : str, block_size : int):
+    """ The stored signature of path, or a freshly computed one if it is missing or no longer matches the file """
+    stat = os.stat(path)
+    try:
+        with open(signature_path(path), 'r', encoding='utf-8') as f:
+            signature = json.load(f)
+        if (signature.get("size") == stat.st_size and signature.get("mtime") == stat.st_mtime_ns
+                and signature.get("block_size") == block_size):
+            return signature
+    except (OSError, json.JSONDecodeError):
+        pass
+    return compute_signature(path, block_size)
+
+def store_signature(path : str, signature : dict):
+    stat = os.stat(path)
+    signature = dict(signature, size = stat.st_size, mtime = stat.st_mtime_ns)
+    tmp_path = signature_path(path) + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(signature, f)
+    os.replace(tmp_path, signature_path(path))
+
+def remove_signature(path : str):
+    if os.path.exists(signature_path(path)):
+        os.remove(signature_path(path))
+
+
+class DeltaStats:
+    def __init__(self):
+        self.literal_bytes = 0  # written from the source
+        self.matched_bytes = 0  # copied from the old destination
+        self.rolled_bytes = 0  # bytes the rolling checksum had to step over one at a time
+
+
+class DeltaTooLarge(Exception):
+    pass
+
+
+class _Writer:
+    """ Writes the new file, runs of matched blocks become a single copy_file_range
+        Without copy_file_range (Windows, macOS) they are read and written through the file objects """
+    def __init__(self, old_file, new_file, stats):
+        self.old_file = old_file
+        self.new_file = new_file
+        self.stats = stats
+        self.offset = 0
+        self.run_start = None  # run of consecutive old blocks waiting to be copied
+        self.run_length = 0
+        self.server_copy = hasattr(os, "copy_file_range")
+
+    def literal(self, data):
+        self.flush()
+        if len(data) == 0:
+            return
+        self.new_file.seek(self.offset)
+        self.new_file.write(data)
+        self.offset += len(data)
+        self.stats.literal_bytes += len(data)
+
+    def block(self, old_offset, length):
+        if self.run_start is not None and self.run_start + self.run_length == old_offset:
+            self.run_length += length
+            return
+        self.flush()
+        self.run_start, self.run_length = old_offset, length
+
+    def flush(self):
+        if self.run_start is None:
+            return
+        copied = 0
+        while copied < self.run_length:
+            n = 0
+            if self.server_copy:
+                self.new_file.flush()  # literals still in the buffer go first, copy_file_range bypasses it
+                try:
+                    n = os.copy_file_range(self.old_file.fileno(), self.new_file.fileno(), self.run_length - copied,
+                                           self.run_start + copied, self.offset + copied)
+                except OSError:
+                    self.server_copy = False
+            if n == 0:
+                self.old_file.seek(self.run_start + copied)
+                data = self.old_file.read(min(self.run_length - copied, 1 << 20))
+                if len(data) == 0:
+                    raise OSError(f"{self.old_file.name} is shorter than its signature")
+                self.new_file.seek(self.offset + copied)
+                n = self.new_file.write(data)
+            copied += n
+        self.offset += self.run_length
+        self.stats.matched_bytes += self.run_length
+        self.run_start, self.run_length = None, 0
+
+
+def _write_delta(src, size, signature, writer, stats, max_rolled, progress_fcn, check_cancel):
+    block_size = signature["block_size"]
+    blocks = {}
+    for i, weak in enumerate(signature["weak"]):
+        blocks.setdefault(weak, []).append(i)
+    strong = signature["strong"]
+
+    pos = 0
+    literal_start = 0
+    reported = 0
+    weak = None
+    while pos + block_size <= size:
+        if weak is None:
+            weak = zlib.adler32(src[pos:pos + block_size])
+            a, b = weak & 0xffff, weak >> 16
+        candidates = blocks.get(weak)
+        if candidates is not None:
+            digest = _strong(src[pos:pos + block_size])
+            match = next((i for i in candidates if strong[i] == digest), None)
+            if match is not None:
+                writer.literal(src[literal_start:pos])
+                writer.block(match * block_size, block_size)
+                pos += block_size
+                literal_start = pos
+                weak = None
+                if progress_fcn is not None:
+                    progress_fcn(pos - reported)
+                    reported = pos
+                check_cancel()
+                continue
+        # No block starts here, slide the window by one byte
+        if pos + block_size < size:
+            out_byte, in_byte = src[pos], src[pos + block_size]
+            a = (a - out_byte + in_byte) % _mod
+            b = (b - block_size * out_byte + a - 1) % _mod
+            weak = (b << 16) | a
+        pos += 1
+        stats.rolled_bytes += 1
+        if stats.rolled_bytes > max_rolled:
+            raise DeltaTooLarge()
+        if stats.rolled_bytes % block_size == 0:
+            check_cancel()
+    writer.literal(src[literal_start:size])
+    if progress_fcn is not None:
+        progress_fcn(size - reported)
+
+def delta_copy(source : str, destination : str, block_size = 1 << 16, max_rolled = 8 << 20,
+               progress_fcn = None, check_cancel = None):
+    """ Update destination to match source, reusing the blocks destination already has
+        Returns DeltaStats, or None if the delta was given up (then nothing was changed)
+        progress_fcn(n_bytes) is called with the source bytes done, check_cancel() may raise to stop """
+    check_cancel = check_cancel or (lambda: None)
+    signature = load_signature(destination, block_size)
+    size = os.path.getsize(source)
+    stats = DeltaStats()
+    tmp_path = destination + ".tmp"
+    try:
+        with open(source, 'rb') as src_file, open(destination, 'rb') as old_file, open(tmp_path, 'wb') as new_file:
+            writer = _Writer(old_file, new_file, stats)
+            if size > 0:
+                with mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ) as src:
+                    _write_delta(src, size, signature, writer, stats, max_rolled, progress_fcn, check_cancel)
+            writer.flush()
+            new_file.truncate(size)
+    except DeltaTooLarge:
+        os.remove(tmp_path)
+        return None
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    shutil.copystat(source, tmp_path)
+    os.replace(tmp_path, destination)
+    return stats
+
+def sign_copy(source : str, destination : str, block_size = 1 << 16):
+    """ Store the signature of destination (a fresh copy of source), computed from the local source """
+    store_signature(destination, compute_signature(source, block_size))
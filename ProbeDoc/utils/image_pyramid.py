@@ -0,0 +1,167 @@
+# Multi resolution pyramids of the registered images
+# CanvasImage shows an image from a pyramid of downscaled levels (each half the size of the one before, down to
+# about 512 pixels). Building one means decoding the whole image and several LANCZOS resizes, which for a
+# multi gigapixel scan takes minutes. Images are therefore prepared when they are imported: a background thread
+# builds the whole pyramid and writes every level to the pyramid cache (utils/pyramid_cache.py) as an
+# uncompressed raster, and for a huge image makes its MappedRaster (utils/mapped_raster.py) as well.
+# A viewer opened afterwards maps the levels and reads only the pixels of the tiles on screen.
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from .config import config
+from . import pyramid_cache
+from . import mapped_raster
+
+huge_size = 14000  # images with more pixels than huge_size x huge_size are huge, level 0 is a downscaled copy
+band_width = 1024  # rows of a huge image read at a time
+reduction = 2  # reduction degree of the pyramid
+
+_lock = threading.Lock()
+_queued = {}  # path -> Event set once the pyramid of path is prepared
+_jobs = queue.Queue()
+_worker = None
+
+
+def is_huge(width : int, height : int):
+    return width * height > huge_size * huge_size
+
+def smaller_size(width : int, height : int):
+    """ ((width, height) of level 0 of a huge image, compression ratio, band length) """
+    w1, h1 = float(width), float(height)
+    w2, h2 = float(huge_size), float(huge_size)
+    aspect_ratio1 = w1 / h1
+    aspect_ratio2 = w2 / h2  # it equals to 1.0
+    if aspect_ratio1 == aspect_ratio2:
+        return (int(w2), int(h2)), h2 / h1, int(w2)
+    elif aspect_ratio1 > aspect_ratio2:
+        return (int(w2), int(w2 / aspect_ratio1)), h2 / w1, int(w2)
+    else:  # aspect_ratio1 < aspect_ration2
+        return (int(h2 * aspect_ratio1), int(h2)), h2 / h1, int(h2 * aspect_ratio1)
+
+def level_sizes(width : int, height : int):
+    w, h = smaller_size(width, height)[0] if is_huge(width, height) else (width, height)
+    sizes = [(w, h)]
+    while w > 512 and h > 512:  # top pyramid image is around 512 pixels in size
+        w /= reduction  # divide on reduction degree
+        h /= reduction  # divide on reduction degree
+        sizes.append((int(w), int(h)))
+    return sizes
+
+def displayable(image):
+    """ image in a mode the pyramid levels can be resized and cached in (palette and two band images are converted) """
+    if image.mode in ("L", "RGB", "RGBA", "I;16", "I", "F", "CMYK"):
+        return image
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+def reduce_band__(raster, top, band, w, k, resample):
+    """ Band of rows [top, top + band) of the raster, resized to the width of level 0 """
+    width = raster.size[0]
+    cropped = raster.crop((0, top, width, top + band))  # crop tile band
+    return cropped.resize((w, int(band * k)+1), resample)
+
+def smaller(raster, resample = Image.Resampling.LANCZOS, cancel = None, progress = None):
+    """ Level 0 of a huge image, read from its MappedRaster band by band. None if cancelled
+        Bands are read and resized on DecodeWorkers threads (the crop reads its rows from the mapped file by offset
+        and Pillow lets go of the GIL while it resizes), and pasted in order as they come back.
+        progress(done, total) is called with the number of bands pasted so far, on the calling thread """
+    width, height = raster.size
+    size, k, w = smaller_size(width, height)
+    image = Image.new('RGB', size)
+    bands = [(i, min(band_width, height - i)) for i in range(0, height, band_width)]
+    n = len(bands)
+    workers = max(1, config["DecodeWorkers"])
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as executor:
+        in_flight = deque()  # at most two bands per worker are held in memory at a time
+        j = 0
+        while j < n:
+            while len(in_flight) < 2 * workers and j + len(in_flight) < n:
+                top, band = bands[j + len(in_flight)]
+                in_flight.append(executor.submit(reduce_band__, raster, top, band, w, k, resample))
+            if cancel is not None and cancel.is_set():
+                for future in in_flight:
+                    future.cancel()
+                return None
+            image.paste(in_flight.popleft().result(), (0, int(bands[j][0] * k)))
+            j += 1
+            if progress is not None:
+                progress(j, n)
+    return image
+
+def build(path : str, cancel = None, progress = None):
+    """ Every level of the pyramid of the image at path, finest first. None if cancelled
+        progress(done, total) reports the bands of a huge image, see smaller """
+    with Image.open(path) as image:
+        width, height = image.size
+        raster = mapped_raster.open_raster(path, image) if is_huge(width, height) else None
+    if is_huge(width, height):
+        if raster is None:
+            raster = mapped_raster.convert(path, cancel)
+            if raster is None:
+                return None
+        base = smaller(raster, cancel = cancel, progress = progress)
+        if base is None:
+            return None
+    else:
+        with Image.open(path) as image:
+            base = displayable(image)
+            base.load()
+    levels = [base]
+    for size in level_sizes(width, height)[1:]:
+        if cancel is not None and cancel.is_set():
+            return None
+        levels.append(levels[-1].resize(size, Image.Resampling.LANCZOS))
+    return levels
+
+def prepare(path : str):
+    """ Build the pyramid of the image at path and write it to the pyramid cache, unless it is there already """
+    with Image.open(path) as image:
+        n_levels = len(level_sizes(*image.size))
+        if n_levels == 1 and not is_huge(*image.size):
+            return  # small enough to be shown straight from the file
+    levels = pyramid_cache.load(path)
+    if levels is not None:
+        pyramid_cache.release(path)
+        if len(levels) == n_levels:
+            return
+    levels = build(path)
+    if levels is not None:
+        pyramid_cache.store(path, levels)
+
+def prepare_async(path : str):
+    """ Queue the image at path to be prepared on the background import thread """
+    global _worker
+    with _lock:
+        if path in _queued:
+            return
+        _queued[path] = threading.Event()
+        _jobs.put(path)
+        if _worker is None:
+            _worker = threading.Thread(target=_run, name="image-import", daemon=True)
+            _worker.start()
+
+def _run():
+    while True:
+        path = _jobs.get()
+        try:
+            prepare(path)
+        except Exception as e:
+            print(f"Error preparing the image pyramid of {path}: {e}")
+        with _lock:
+            _queued.pop(path).set()
+
+def preparing(path : str):
+    with _lock:
+        return path in _queued
+
+def wait(path : str, cancel = None):
+    """ Wait until the image at path is prepared, False if cancel was set first """
+    with _lock:
+        done = _queued.get(path)
+    while done is not None and not done.wait(0.1):
+        if cancel is not None and cancel.is_set():
+            return False
+    return True
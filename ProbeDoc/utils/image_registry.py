@@ -0,0 +1,72 @@
+# Cached map of image stem -> path in the images directory
+# get_image_path used to list the whole directory on every call, which made resource_check O(n^2)
+# and is very slow on a network mounted resource directory.
+# The map is built with a single listdir and only rebuilt when the directory's mtime changes,
+# add_image and delete_image keep it up to date themselves.
+
+import os
+import threading
+from pathlib import Path
+
+
+class ImageRegistry:
+    def __init__(self, directory : str):
+        self.directory = directory
+        self.__lock = threading.Lock()
+        self.__paths = None  # stem -> path
+        self.__mtime = None
+
+    def dir_mtime__(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def rebuild__(self, mtime):
+        paths = {}
+        if mtime is not None:
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                # The first file with a stem wins, same as the old directory scan
+                paths.setdefault(Path(entry.name).stem, entry.path)
+        self.__paths = paths
+        self.__mtime = mtime
+
+    def paths__(self):
+        mtime = self.dir_mtime__()
+        if self.__paths is None or mtime != self.__mtime:
+            self.rebuild__(mtime)
+        return self.__paths
+
+    def get(self, img_name : str):
+        with self.__lock:
+            return self.paths__().get(img_name, None)
+
+    def stems(self):
+        with self.__lock:
+            return list(self.paths__().keys())
+
+    def add(self, path : str):
+        """ Register a file that was just put in the directory """
+        with self.__lock:
+            if self.__paths is None:
+                self.rebuild__(self.dir_mtime__())
+                return
+            # Our own change moved the mtime, so the map is updated here instead of re-listing everything
+            self.__paths.setdefault(Path(path).stem, path)
+            self.__mtime = self.dir_mtime__()
+
+    def remove(self, img_name : str):
+        """ Forget a file that was just removed from the directory """
+        with self.__lock:
+            if self.__paths is None:
+                self.rebuild__(self.dir_mtime__())
+                return
+            self.__paths.pop(img_name, None)
+            self.__mtime = self.dir_mtime__()
+
+    def invalidate(self):
+        with self.__lock:
+            self.__paths = None
+            self.__mtime = None
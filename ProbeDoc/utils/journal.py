@@ -0,0 +1,156 @@
+# Append-only edit journal for the data points
+# Instead of re-writing the entire data_points.json on every click, each edit (add/edit/delete/note)
+# is appended as a single json line to a journal next to the snapshot. The cost of a write is then
+# the size of the edit, not the size of the dataset.
+# Once the journal gets long enough it is folded back into a fresh snapshot on a background thread.
+#
+# NOTE: every record only ever sets or removes points by name (an edit removes the old name and sets the new one,
+# a note sets a field of the point), so after a replay every point is whatever the last record touching
+# its name made it. Replaying records that are already part of the snapshot therefore changes nothing,
+# which is what makes it safe if the program dies between writing the new snapshot and truncating the journal.
+
+import os
+import json
+import threading
+
+_lock = threading.Lock()
+_compact_thread = None
+_record_count = 0
+
+
+def apply_records(data_points : dict, records : list):
+    """ Apply records in order, the points of every image they touch are indexed by name once """
+    by_name = {}  # image -> {name : entry}, in the order of the list
+    for record in records:
+        img = record.get("image")
+        if img is None:
+            continue
+        points = by_name.get(img)
+        if points is None:
+            existing = data_points.get(img)
+            points = by_name[img] = {entry["name"] : entry for entry in existing} if isinstance(existing, list) else {}
+        op = record.get("op")
+        if op == "image":
+            continue
+        if op == "add":
+            points[record["entry"]["name"]] = record["entry"]
+        elif op == "edit":
+            entry = record["entry"]
+            old_name = record.get("old_name", entry["name"])
+            if old_name != entry["name"]:
+                points.pop(old_name, None)  # renamed, goes to the end like in AnnotationStore
+            points[entry["name"]] = entry
+        elif op == "delete":
+            points.pop(record["name"], None)
+        elif op == "note":
+            if record["name"] in points:
+                points[record["name"]]["notes"] = record["notes"]
+        else:
+            print(f"Unknown journal record {op}, skipping")
+    for img, points in by_name.items():
+        data_points[img] = list(points.values())
+
+def _read_records(journal_path : str, end = None):
+    if not os.path.exists(journal_path):
+        return []
+    with open(journal_path, 'rb') as f:
+        raw = f.read() if end is None else f.read(end)
+    records = []
+    for line in raw.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            # The last line could be half written if the program was killed mid write
+            print(f"Skipping corrupt journal line in {journal_path}")
+    return records
+
+def replay(data_points : dict, journal_path : str, end = None):
+    """ Apply every record in the journal to data_points, returns the number of records applied """
+    global _record_count
+    records = _read_records(journal_path, end)
+    apply_records(data_points, records)
+    if end is None:
+        _record_count = len(records)
+    return len(records)
+
+def append_records(journal_path : str, records : list):
+    """ Append a batch of records with a single write and fsync """
+    global _record_count
+    lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+    with _lock:
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        _record_count += len(records)
+    return _record_count
+
+def _write_snapshot(snapshot_path : str, data_points : dict):
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data_points, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_path)
+
+def write_snapshot(snapshot_path : str, journal_path : str, data_points : dict):
+    """ Write a full snapshot and drop the journal, everything in the journal is already in data_points """
+    global _record_count
+    # A running compaction would otherwise put its older snapshot back over this one
+    wait_for_compaction()
+    with _lock:
+        _write_snapshot(snapshot_path, data_points)
+        # Truncate rather than remove, so a sync never leaves an older journal behind on the other side
+        with open(journal_path, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        _record_count = 0
+
+def compact(snapshot_path : str, journal_path : str):
+    """ Fold the journal into a fresh snapshot, records appended while compacting are kept """
+    global _record_count
+    with _lock:
+        end = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+    if end == 0:
+        return
+    data_points = {}
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            data_points = json.load(f)
+    replay(data_points, journal_path, end)
+    with _lock:
+        _write_snapshot(snapshot_path, data_points)
+        with open(journal_path, 'rb') as f:
+            f.seek(end)
+            tail = f.read()
+        tmp_path = journal_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, journal_path)
+        _record_count = len([line for line in tail.splitlines() if line.strip()])
+
+def maybe_compact(snapshot_path : str, journal_path : str, threshold : int):
+    """ Start a background compaction once the journal holds more than threshold records """
+    global _compact_thread
+    if _record_count < threshold:
+        return False
+    if _compact_thread is not None and _compact_thread.is_alive():
+        return False
+
+    def run():
+        try:
+            compact(snapshot_path, journal_path)
+        except Exception as e:
+            print(f"Error compacting journal: {e}")
+
+    _compact_thread = threading.Thread(target=run, name="journal-compact", daemon=True)
+    _compact_thread.start()
+    return True
+
+def wait_for_compaction():
+    if _compact_thread is not None and _compact_thread.is_alive():
+        _compact_thread.join()
@@ -0,0 +1,47 @@
+# The storage backends that do not keep everything in one file (sqlite, shards) hand this to the gui
+# instead of a dict, so that only the images that are actually looked at get loaded
+
+from collections.abc import MutableMapping
+
+
+class LazyDataPoints(MutableMapping):
+    """ dict like view of the data points, an image's points are only loaded once that image is accessed """
+    def __init__(self, image_keys_fcn, get_points_fcn):
+        self.image_keys_fcn = image_keys_fcn  # returns every image with points
+        self.get_points_fcn = get_points_fcn  # returns the list of points of a single image
+        self.__cache = {}
+        self.__keys = None
+
+    def image_keys__(self):
+        if self.__keys is None:
+            self.__keys = set(self.image_keys_fcn())
+        return self.__keys
+
+    def __getitem__(self, img):
+        if img not in self.__cache:
+            if img not in self.image_keys__():
+                raise KeyError(img)
+            self.__cache[img] = self.get_points_fcn(img)
+        return self.__cache[img]
+
+    def __setitem__(self, img, points):
+        self.image_keys__().add(img)
+        self.__cache[img] = points
+
+    def __delitem__(self, img):
+        if img not in self.image_keys__():
+            raise KeyError(img)
+        self.__keys.discard(img)
+        self.__cache.pop(img, None)
+
+    def __contains__(self, img):
+        return img in self.__cache or img in self.image_keys__()
+
+    def __iter__(self):
+        return iter(list(self.image_keys__()))
+
+    def __len__(self):
+        return len(self.image_keys__())
+
+    def loaded(self):
+        return dict(self.__cache)
@@ -0,0 +1,165 @@
+# Uncompressed, memory mapped access to huge images
+# CanvasImage used to read a huge image by opening the file again for every band and pointing the raw decoder
+# at the band's offset, which only worked for uncompressed files. A MappedRaster maps the pixels instead and
+# a crop copies just the rows and columns it covers, the OS page cache does the rest.
+# Uncompressed files (raw TIFF, BMP, PPM) are mapped where they are. Anything else (compressed TIFF, PNG, JPEG)
+# is decoded once and written as a raw file under resources/raster_cache/<key>.raw (the key of the pyramid cache)
+# with a json header next to it, later sessions map that file. The cache is capped at RasterCacheMaxBytes, least recently used first.
+
+import os
+import json
+import mmap
+import threading
+from PIL import Image
+from .config import config
+from . import pyramid_cache
+
+_lock = threading.Lock()
+_bytes_per_pixel = {"L" : 1, "P" : 1, "I;16" : 2, "I;16B" : 2, "RGB" : 3, "BGR" : 3, "RGBX" : 4, "RGBA" : 4,
+                    "BGRX" : 4, "BGRA" : 4, "CMYK" : 4, "I" : 4, "F" : 4, "I;32" : 4, "F;32F" : 4}
+_stored_modes = {"L", "RGB", "RGBA", "I;16", "I", "F"}  # anything else is converted to RGB when it is cached
+_rows_per_write = 256
+
+
+class MappedRaster:
+    """ The pixels of an uncompressed image file, opened with a memory map """
+    def __init__(self, path : str, mode : str, size, offset = 0, rawmode = None, stride = 0, orientation = 1):
+        self.path = path
+        self.mode = mode
+        self.size = tuple(size)
+        self.rawmode = rawmode or mode
+        self.__bpp = _bytes_per_pixel[self.rawmode]
+        self.__stride = stride or self.size[0] * self.__bpp
+        self.__offset = offset
+        self.__orientation = orientation
+        with open(path, 'rb') as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def row_offset__(self, y):
+        if self.__orientation < 0:
+            y = self.size[1] - 1 - y  # stored bottom up (BMP)
+        return self.__offset + y * self.__stride
+
+    def crop(self, box):
+        """ Like Image.crop, only the rows and columns inside box are read from the file """
+        left, top, right, bottom = map(int, box)
+        width, height = self.size
+        x0, y0, x1, y1 = max(left, 0), max(top, 0), min(right, width), min(bottom, height)
+        if x1 <= x0 or y1 <= y0:
+            return Image.new(self.mode, (max(right - left, 0), max(bottom - top, 0)))
+        if x0 == 0 and x1 == width and self.__orientation >= 0 and self.__stride == width * self.__bpp:
+            start = self.row_offset__(y0)
+            data = self.__map[start:start + (y1 - y0) * self.__stride]  # whole rows, one read
+        else:
+            row_bytes = (x1 - x0) * self.__bpp
+            data = b"".join(self.__map[start:start + row_bytes]
+                            for start in (self.row_offset__(y) + x0 * self.__bpp for y in range(y0, y1)))
+        region = Image.frombytes(self.mode, (x1 - x0, y1 - y0), data, "raw", self.rawmode)
+        if (x0, y0, x1, y1) == (left, top, right, bottom):
+            return region
+        # Out of bounds parts are black, like Image.crop
+        image = Image.new(self.mode, (right - left, bottom - top))
+        image.paste(region, (x0 - left, y0 - top))
+        return image
+
+    def close(self):
+        self.__map.close()
+
+
+def raw_layout(image):
+    """ (offset, rawmode, stride, orientation) if the pixels of the opened image are stored uncompressed
+        and contiguous in its file, None otherwise """
+    tiles = image.tile
+    if image.mode == "P" or len(tiles) == 0 or any(tile[0] != "raw" for tile in tiles):
+        return None
+    args = tiles[0][3] if isinstance(tiles[0][3], tuple) else (tiles[0][3],)
+    rawmode = args[0]
+    if rawmode not in _bytes_per_pixel:
+        return None
+    width, height = image.size
+    stride = (args[1] if len(args) > 1 else 0) or width * _bytes_per_pixel[rawmode]
+    orientation = args[2] if len(args) > 2 else 1
+    offset = tiles[0][2]
+    if orientation < 0 and len(tiles) > 1:
+        return None
+    for tile in tiles:
+        # Strips have to cover whole rows and follow each other in the file
+        extents = tile[1]
+        if extents[0] != 0 or extents[2] != width or tile[3] != tiles[0][3] or tile[2] != offset + extents[1] * stride:
+            return None
+    return offset, rawmode, stride, orientation
+
+def _cache_paths(path : str):
+    key = pyramid_cache.cache_key(path)
+    return os.path.join(config["RasterCacheDirectory"], key + ".raw"), os.path.join(config["RasterCacheDirectory"], key + ".json")
+
+def open_raster(path : str, image = None):
+    """ A MappedRaster of the image at path if it can be mapped in place or was converted before, None otherwise """
+    if image is None:
+        image = Image.open(path)
+    layout = raw_layout(image)
+    if layout is not None:
+        offset, rawmode, stride, orientation = layout
+        return MappedRaster(path, image.mode, image.size, offset, rawmode, stride, orientation)
+    raw_path, header_path = _cache_paths(path)
+    with _lock:
+        try:
+            with open(header_path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+            raster = MappedRaster(raw_path, header["mode"], header["size"])
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(header_path)  # least recently used goes first
+    return raster
+
+def convert(path : str, cancel = None):
+    """ Decode the image at path once and write it to the raster cache, returns its MappedRaster (None if cancelled) """
+    raw_path, header_path = _cache_paths(path)
+    os.makedirs(config["RasterCacheDirectory"], exist_ok = True)
+    with Image.open(path) as image:
+        image.load()  # compressed formats can only be decoded as a whole
+        mode = image.mode if image.mode in _stored_modes else "RGB"
+        width, height = image.size
+        tmp_path = raw_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for top in range(0, height, _rows_per_write):
+                if cancel is not None and cancel.is_set():
+                    break
+                band = image.crop((0, top, width, min(height, top + _rows_per_write)))
+                f.write((band if band.mode == mode else band.convert(mode)).tobytes())
+    if cancel is not None and cancel.is_set():
+        os.remove(tmp_path)
+        return None
+    with _lock:
+        os.replace(tmp_path, raw_path)
+        with open(header_path, 'w', encoding='utf-8') as f:
+            json.dump({"mode" : mode, "size" : [width, height], "source" : path}, f)
+        evict__(keep = raw_path)
+    return MappedRaster(raw_path, mode, (width, height))
+
+def evict__(keep = None):
+    """ Remove the least recently used rasters until the cache fits RasterCacheMaxBytes """
+    directory = config["RasterCacheDirectory"]
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            header_path = os.path.join(directory, name)
+            raw_path = header_path[:-len(".json")] + ".raw"
+            try:
+                entries.append((os.stat(header_path).st_mtime, raw_path, header_path, os.stat(raw_path).st_size))
+            except OSError:
+                continue
+    total = sum(entry[3] for entry in entries)
+    for _, raw_path, header_path, size in sorted(entries):
+        if total <= config["RasterCacheMaxBytes"]:
+            break
+        if raw_path == keep:
+            continue
+        try:
+            os.remove(header_path)
+            os.remove(raw_path)
+        except OSError as e:
+            # Still mapped by an open viewer (Windows), tried again next time
+            print(f"Could not evict raster cache entry {raw_path}: {e}")
+            continue
+        total -= size
@@ -0,0 +1,244 @@
+# Packed sync target, for sync directories on network shares where every file open/close is slow
+# Instead of one file per resource the sync directory holds a single tar archive plus a json index:
+#   probe_doc.<generation>.tar   every synced file, changed files are appended as new members at the end
+#   probe_doc.pack.json          relative path -> offset/size/mtime of the newest copy in the tar
+# A sync appends the changed files in one go and rewrites the index, so it costs a handful of file operations
+# no matter how many files changed. Older copies of a file stay in the tar as dead bytes until there are
+# enough of them, then the live members are written to a new generation of the tar and the old one is removed.
+# The tar stays a valid archive, so it can be unpacked with any tar tool if ever needed.
+# The appends run as TransferJobs (PackJob), so a packed sync gets the same progress, cancel and retries as a
+# directory sync. The pack is a single file, so the jobs take turns writing to it.
+
+import os
+import json
+import tarfile
+import threading
+from . import sync_engine
+from .transfer import TransferJob
+from .persistence import atomic_write_text
+
+index_name = "probe_doc.pack.json"
+_block = tarfile.BLOCKSIZE
+_end_marker = b"\0" * (2 * _block)
+_chunk_size = 1 << 20
+
+
+def index_path(sync_dir : str):
+    return os.path.join(sync_dir, index_name)
+
+def exists(sync_dir : str):
+    return os.path.exists(index_path(sync_dir))
+
+def load_index(sync_dir : str):
+    """ {"pack", "end", "dead", "members" : {relpath : {"offset", "size", "mtime", "hash"}}} """
+    path = index_path(sync_dir)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable pack index {path}: {e}")
+    return {"pack" : None, "generation" : 0, "end" : 0, "dead" : 0, "members" : {}}
+
+def has_member(sync_dir : str, relpath : str):
+    return relpath in load_index(sync_dir)["members"]
+
+def has_members(sync_dir : str, prefix : str):
+    return any(relpath.startswith(prefix) for relpath in load_index(sync_dir)["members"])
+
+def store_index(sync_dir : str, index : dict):
+    atomic_write_text(index_path(sync_dir), json.dumps(index))
+
+def _pack_name(generation : int):
+    return f"probe_doc.{generation}.tar"
+
+def _write_member(pack, relpath : str, source_path : str, entry : dict, progress_fcn = None, check_cancel = None):
+    """ Write a tar member at the current position of pack, returns its data offset
+        progress_fcn(n_bytes) is called with the bytes written, check_cancel() may raise to stop """
+    info = tarfile.TarInfo(relpath)
+    info.size = entry["size"]
+    info.mtime = entry["mtime"] / 1e9
+    pack.write(info.tobuf(format=tarfile.PAX_FORMAT))
+    offset = pack.tell()
+    with open(source_path, 'rb') as src:
+        remaining = entry["size"]
+        while remaining > 0:
+            if check_cancel is not None:
+                check_cancel()
+            chunk = src.read(min(_chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"{source_path} shrank while it was being packed")
+            pack.write(chunk)
+            remaining -= len(chunk)
+            if progress_fcn is not None:
+                progress_fcn(len(chunk))
+    padding = -entry["size"] % _block
+    if padding:
+        pack.write(b"\0" * padding)
+    return offset
+
+class PackJob(TransferJob):
+    """ Appends one file to the pack instead of copying it to a file of its own """
+    def __init__(self, writer, relpath : str, source_path : str, entry : dict):
+        super().__init__(source_path, os.path.join(writer.sync_dir, relpath), entry["size"])
+        self.writer = writer
+        self.relpath = relpath
+        self.entry = entry
+        self.offset = None  # data offset in the pack once it is written
+
+    def copy(self, engine):
+        self.offset = self.writer.append(self, engine)
+
+
+class _PackWriter:
+    """ The open pack, one member is written at a time, a member that fails is cut off again """
+    def __init__(self, sync_dir : str, pack):
+        self.sync_dir = sync_dir
+        self.pack = pack
+        self.lock = threading.Lock()
+
+    def append(self, job : PackJob, engine):
+        with self.lock:
+            start = self.pack.tell()
+            try:
+                return _write_member(self.pack, job.relpath, job.source, job.entry,
+                                     lambda n_bytes: engine.progress__(job, n_bytes), engine.check_cancel__)
+            except BaseException:
+                self.pack.seek(start)
+                raise
+
+def plan(source : str, sync_dir : str, ignore = sync_engine.default_ignore, with_hash = False, delete = True):
+    """ (relative paths to append, relative paths to drop from the index, source manifest, index) """
+    last_source = sync_engine.load_manifest(source) or {}
+    source_manifest = sync_engine.scan(source, ignore, last_source, with_hash)
+    index = load_index(sync_dir)
+    members = index["members"]
+    copy = sorted(relpath for relpath, entry in source_manifest.items()
+                  if not sync_engine.same_file(entry, members.get(relpath)))
+    drop = []
+    if delete:
+        drop = sorted(relpath for relpath, entry in last_source.items()
+                      if relpath not in source_manifest and sync_engine.same_file(entry, members.get(relpath)))
+    return copy, drop, source_manifest, index
+
+def sync_to_pack(source : str, sync_dir : str, ignore = sync_engine.default_ignore, with_hash = False,
+                 delete = True, dry_run = False, compact_ratio = 0.5, run_copies = None):
+    """ Append the new and changed files of source to the pack in sync_dir, returns the relative paths that failed
+        run_copies(jobs) runs the PackJobs and returns the ones that did not finish (see sync_engine.execute) """
+    run_copies = run_copies or sync_engine.run_transfer
+    copy, drop, source_manifest, index = plan(source, sync_dir, ignore, with_hash, delete)
+    print(f"Packed sync {source} -> {sync_dir}")
+    for relpath in copy:
+        state = "changed" if relpath in index["members"] else "new"
+        print(f"  {state:8} {relpath} ({source_manifest[relpath]['size']} bytes)")
+    for relpath in drop:
+        print(f"  deleted  {relpath}")
+    print(f"  {len(copy)} files to append, {len(drop)} to drop")
+    if dry_run:
+        return []
+
+    os.makedirs(sync_dir, exist_ok = True)
+    members = index["members"]
+    failed = []
+    if len(copy) > 0:
+        if index["pack"] is None:
+            index["pack"] = _pack_name(index["generation"])
+        pack_path = os.path.join(sync_dir, index["pack"])
+        # Anything after index["end"] is from an append that never made it into the index, it is overwritten
+        with open(pack_path, 'r+b' if os.path.exists(pack_path) else 'w+b') as pack:
+            pack.seek(index["end"])
+            writer = _PackWriter(sync_dir, pack)
+            jobs = [PackJob(writer, relpath, os.path.join(source, relpath), source_manifest[relpath]) for relpath in copy]
+            failed_jobs = run_copies(jobs)
+            for job in jobs:
+                if job in failed_jobs:
+                    failed.append(job.relpath)
+                    continue
+                old = members.get(job.relpath)
+                if old is not None:
+                    index["dead"] += old["size"]
+                members[job.relpath] = dict(source_manifest[job.relpath], offset = job.offset)
+            index["end"] = pack.tell()
+            pack.write(_end_marker)
+            pack.truncate()
+            pack.flush()
+            os.fsync(pack.fileno())
+    for relpath in drop:
+        index["dead"] += members.pop(relpath)["size"]
+    store_index(sync_dir, index)
+    sync_engine.store_manifest(source, {relpath : entry for relpath, entry in source_manifest.items() if relpath not in failed})
+
+    live = sum(entry["size"] for entry in members.values())
+    if index["dead"] > max(live * compact_ratio, _chunk_size):
+        compact(sync_dir)
+    return failed
+
+def compact(sync_dir : str):
+    """ Write the live members to a new generation of the pack and drop the old one """
+    index = load_index(sync_dir)
+    if index["pack"] is None:
+        return
+    old_path = os.path.join(sync_dir, index["pack"])
+    generation = index["generation"] + 1
+    new_name = _pack_name(generation)
+    members = {}
+    with open(old_path, 'rb') as old, open(os.path.join(sync_dir, new_name), 'wb') as new:
+        # In pack order, so the old pack is read front to back
+        for relpath, entry in sorted(index["members"].items(), key=lambda item: item[1]["offset"]):
+            info = tarfile.TarInfo(relpath)
+            info.size = entry["size"]
+            info.mtime = entry["mtime"] / 1e9
+            new.write(info.tobuf(format=tarfile.PAX_FORMAT))
+            offset = new.tell()
+            old.seek(entry["offset"])
+            remaining = entry["size"] + (-entry["size"] % _block)
+            while remaining > 0:
+                chunk = old.read(min(_chunk_size, remaining))
+                new.write(chunk)
+                remaining -= len(chunk)
+            members[relpath] = dict(entry, offset = offset)
+        end = new.tell()
+        new.write(_end_marker)
+        new.flush()
+        os.fsync(new.fileno())
+    # The index switches to the new pack in one atomic replace, the old pack is only removed after that
+    store_index(sync_dir, {"pack" : new_name, "generation" : generation, "end" : end, "dead" : 0, "members" : members})
+    os.remove(old_path)
+    print(f"Compacted the sync pack into {new_name}")
+
+def restore_from_pack(sync_dir : str, destination : str, ignore = sync_engine.default_ignore, prefix = ""):
+    """ Extract the members of the pack that differ from the files in destination (nothing is deleted)
+        Only members under prefix are looked at. Returns the relative paths that failed """
+    index = load_index(sync_dir)
+    if index["pack"] is None:
+        return []
+    local = sync_engine.scan(destination, ignore)
+    to_extract = [(relpath, entry) for relpath, entry in index["members"].items()
+                  if relpath.startswith(prefix) and not sync_engine.is_ignored(relpath, ignore)
+                  and not sync_engine.same_file(entry, local.get(relpath))]
+    to_extract.sort(key=lambda item: item[1]["offset"])
+    failed = []
+    with open(os.path.join(sync_dir, index["pack"]), 'rb') as pack:
+        for relpath, entry in to_extract:
+            path = os.path.join(destination, relpath)
+            tmp_path = path + ".tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                pack.seek(entry["offset"])
+                remaining = entry["size"]
+                with open(tmp_path, 'wb') as out:
+                    while remaining > 0:
+                        chunk = pack.read(min(_chunk_size, remaining))
+                        if not chunk:
+                            raise IOError("pack is shorter than its index")
+                        out.write(chunk)
+                        remaining -= len(chunk)
+                os.utime(tmp_path, ns = (entry["mtime"], entry["mtime"]))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error restoring {relpath} from the sync pack: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                failed.append(relpath)
+    print(f"Restored {len(to_extract) - len(failed)} files from the sync pack")
+    return failed
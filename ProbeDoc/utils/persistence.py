@@ -0,0 +1,212 @@
+# Write-behind persistence, so that saving never blocks the Tk event loop
+# The gui hands its mutations (data point records and json files) to the service and returns right away,
+# a background thread waits for a short window so a burst of edits is written together, then writes them
+# Json files are written atomically (temp file, fsync, rename), data point records go through
+# the record writer (the journal, or the sqlite database)
+# A batch that fails to write is put back in the queue and tried again a few times, after that it is held
+# until the gui asks the user (see failed_writes and retry_failed), nothing is dropped
+# NOTE: anything that reads from disk has to call flush() first, see safe_json_load and get_data_points
+
+import os
+import copy
+import json
+import time
+import atexit
+import threading
+
+
+def atomic_write_text(filepath : str, text : str):
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+class PersistenceService:
+    """ Collects mutations and writes them on a background thread """
+    def __init__(self, write_records, window = 0.25):
+        self.write_records = write_records  # called with a list of data point records
+        self.window = window  # seconds to wait for more mutations before writing
+        self.__cond = threading.Condition()
+        self.__records = []
+        self.__json = {}  # filepath -> serialized json, only the last store of a file is written
+        self.__busy = False
+        self.__flushing = False
+        self.__stopping = False
+        self.__thread = None
+        self.retries = 3  # attempts of a failed batch before it is held for the gui
+        self.__attempts = 0
+        self.__failed_records = []  # held batches, see failed_writes
+        self.__failed_json = {}
+        self.last_error = None
+        # Counters
+        self.submitted = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.errors = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def start(self):
+        with self.__cond:
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            self.__stopping = False
+            self.__thread = threading.Thread(target=self.__run, name="write-behind", daemon=True)
+            self.__thread.start()
+
+    def submit_record(self, record : dict):
+        record = copy.deepcopy(record)  # the entries are the live ones of the gui, written later on another thread
+        with self.__cond:
+            self.submitted += 1
+            # A note is committed on every <FocusOut>, only the last one of a burst matters
+            if record.get("op") == "note":
+                key = (record.get("image"), record.get("name"))
+                n_before = len(self.__records)
+                self.__records = [r for r in self.__records
+                                  if not (r.get("op") == "note" and (r.get("image"), r.get("name")) == key)]
+                self.coalesced += n_before - len(self.__records)
+            self.__records.append(record)
+            self.__cond.notify_all()
+        self.start()
+
+    def submit_json(self, filepath : str, data):
+        text = json.dumps(data, indent=4)  # serialized now, the caller is free to keep changing data
+        with self.__cond:
+            self.submitted += 1
+            if filepath in self.__json:
+                self.coalesced += 1
+            self.__json[filepath] = text
+            self.__cond.notify_all()
+        self.start()
+
+    def queue_depth(self):
+        with self.__cond:
+            return len(self.__records) + len(self.__json)
+
+    def pending__(self):
+        return len(self.__records) > 0 or len(self.__json) > 0
+
+    def flush(self, timeout = None):
+        """ Block until everything submitted so far is on disk """
+        with self.__cond:
+            if not self.pending__() and not self.__busy:
+                return True
+            self.__flushing = True
+            self.__cond.notify_all()
+            done = self.__cond.wait_for(lambda: not self.pending__() and not self.__busy, timeout)
+            self.__flushing = False
+            return done
+
+    def failed_writes(self):
+        """ (number of held records and files, error of the last failed write) """
+        with self.__cond:
+            return len(self.__failed_records) + len(self.__failed_json), self.last_error
+
+    def retry_failed(self):
+        """ Put the held batches back in the queue """
+        with self.__cond:
+            self.requeue__(self.__failed_records, self.__failed_json)
+            self.__failed_records, self.__failed_json = [], {}
+            self.__cond.notify_all()
+        self.start()
+
+    def requeue__(self, records, json_files):
+        # In front of anything submitted since, a newer store of the same file wins
+        self.__records = records + self.__records
+        for filepath, text in json_files.items():
+            self.__json.setdefault(filepath, text)
+
+    def stop(self, timeout = None):
+        self.retry_failed()  # one last try before closing
+        self.flush(timeout)
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify_all()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        n_failed, error = self.failed_writes()
+        if n_failed > 0:
+            print(f"Error: {n_failed} saves could not be written: {error}")
+
+    def stats(self):
+        with self.__cond:
+            return {
+                "queue_depth" : len(self.__records) + len(self.__json),
+                "submitted" : self.submitted,
+                "coalesced" : self.coalesced,
+                "writes" : self.writes,
+                "errors" : self.errors,
+                "last_write_latency" : self.last_latency,
+                "max_write_latency" : self.max_latency,
+                "mean_write_latency" : self.total_latency / self.writes if self.writes else 0.0,
+            }
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: self.pending__() or self.__stopping)
+                if self.__stopping and not self.pending__():
+                    return
+                # Let the burst collect, unless someone is waiting on it
+                self.__cond.wait_for(lambda: self.__flushing or self.__stopping, self.window)
+                records, self.__records = self.__records, []
+                json_files, self.__json = self.__json, {}
+                self.__busy = True
+            start = time.perf_counter()
+            try:
+                for filepath, text in json_files.items():
+                    atomic_write_text(filepath, text)
+                if len(records) > 0:
+                    self.write_records(records)
+            except Exception as e:
+                print(f"Error writing behind: {e}")
+                with self.__cond:
+                    self.errors += 1
+                    self.last_error = str(e)
+                    self.__attempts += 1
+                    if self.__attempts <= self.retries and not self.__stopping:
+                        self.requeue__(records, json_files)
+                    else:
+                        self.__attempts = 0
+                        self.__failed_records += records
+                        for filepath, text in json_files.items():
+                            self.__failed_json.setdefault(filepath, text)
+                    self.__busy = False
+                    self.__cond.notify_all()
+                    self.__cond.wait_for(lambda: self.__stopping, 0.5 * self.__attempts)  # give the disk a moment
+                continue
+            latency = time.perf_counter() - start
+            with self.__cond:
+                self.__attempts = 0
+                for filepath in json_files:
+                    self.__failed_json.pop(filepath, None)  # a held older version must not overwrite it later
+                self.writes += 1
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+                self.__busy = False
+                self.__cond.notify_all()
+
+
+_service = None
+
+def get_service(write_records = None, window = 0.25):
+    global _service
+    if _service is None:
+        _service = PersistenceService(write_records, window)
+        atexit.register(_service.stop)
+    return _service
+
+def flush(timeout = None):
+    if _service is None:
+        return True
+    return _service.flush(timeout)
+
+def stop(timeout = None):
+    if _service is None:
+        return
+    _service.stop(timeout)
@@ -0,0 +1,180 @@
+# Record level merge of the data points of several rigs sharing one sync directory
+# Every rig appends each edit it makes (the same records as the journal, plus a "ts" modification time)
+# to its own change log, resources/changes/<rig id>.jsonl, which the normal sync copies to the sync directory.
+# A backup no longer overwrites the local points with the synced data_points.json, instead the records the
+# other rigs appended since the last merge are read from the synced change logs and merged one point at a
+# time, keyed by (image, name): the newest modification wins. When a point was changed on both sides since the
+# last merge the losing side is kept in a conflict list so nothing is silently lost.
+# A merge only reads the new part of each change log, so its cost is the number of changed records.
+# Points that existed before a rig kept a change log are added to its log once as "seed" records (ts 0), a seed
+# only fills in points the merging rig does not know yet and never counts as a conflict.
+
+import os
+import json
+import time
+from .persistence import atomic_write_text
+
+changes_dir_name = "changes"
+
+
+def changelog_path(directory : str, rig : str):
+    return os.path.join(directory, rig + ".jsonl")
+
+def append_changes(directory : str, rig : str, records : list):
+    """ Append records to the change log of rig with a single write """
+    if len(records) == 0:
+        return
+    os.makedirs(directory, exist_ok = True)
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+    with open(changelog_path(directory, rig), 'a', encoding='utf-8') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_changes(path : str, offset : int = 0):
+    """ (records after byte offset, offset to continue from next time)
+        A half written last line is left for the next read """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        raw = f.read()
+    end = raw.rfind(b"\n") + 1
+    records = []
+    for line in raw[:end].decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            print(f"Skipping corrupt change log line in {path}")
+    return records, offset + end
+
+def has_changes(sync_dir : str):
+    return os.path.isdir(os.path.join(sync_dir, changes_dir_name))
+
+def load_state(state_file : str):
+    """ {"own_offset", "offsets" : {rig : offset}, "versions" : {image : {name : [ts, rig]}}} """
+    state = {}
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable merge state {state_file}: {e}")
+    state.setdefault("own_offset", 0)
+    state.setdefault("offsets", {})
+    state.setdefault("versions", {})
+    return state
+
+def store_state(state_file : str, state : dict):
+    atomic_write_text(state_file, json.dumps(state))
+
+def seed(directory : str, rig : str, load_points, state_file : str):
+    """ The first time it is called for a rig, add every point it has (load_points()) to its change log
+        so other rigs merge them too """
+    state = load_state(state_file)
+    if state.get("seeded", False):
+        return
+    records = []
+    for img, entries in load_points().items():
+        records.append({"op" : "image", "image" : img, "ts" : 0, "seed" : True})
+        for entry in entries:
+            records.append({"op" : "add", "image" : img, "entry" : entry, "ts" : 0, "seed" : True})
+    append_changes(directory, rig, records)
+    state["seeded"] = True
+    store_state(state_file, state)
+
+def split_record(record : dict):
+    """ [((image, name), record)] with every record touching a single point, image records have no key """
+    op = record.get("op")
+    img = record.get("image")
+    if op == "edit":
+        entry = record["entry"]
+        old_name = record.get("old_name", entry["name"])
+        add = {"op" : "add", "image" : img, "entry" : entry, "ts" : record.get("ts", 0)}
+        if old_name == entry["name"]:
+            return [((img, entry["name"]), add)]
+        delete = {"op" : "delete", "image" : img, "name" : old_name, "ts" : record.get("ts", 0)}
+        return [((img, old_name), delete), ((img, entry["name"]), add)]
+    if op == "add":
+        return [((img, record["entry"]["name"]), record)]
+    if op in ("delete", "note"):
+        return [((img, record["name"]), record)]
+    return [(None, record)]
+
+def _get_version(versions : dict, key):
+    version = versions.get(key[0], {}).get(key[1])
+    return tuple(version) if version is not None else None
+
+def _set_version(versions : dict, key, version):
+    versions.setdefault(key[0], {})[key[1]] = list(version)
+
+def merge(local_changes_dir : str, remote_changes_dir : str, rig : str, state_file : str, apply_fcn):
+    """ Merge the records the other rigs added to the change logs in remote_changes_dir since the last merge
+        apply_fcn(records) writes the winning records to the local points
+        Returns (number of records applied, conflicts) """
+    state = load_state(state_file)
+    versions = state["versions"]
+    # Points changed here since the last merge
+    local_records, state["own_offset"] = read_changes(changelog_path(local_changes_dir, rig), state["own_offset"])
+    local_changed = set()
+    for record in local_records:
+        for key, part in split_record(record):
+            if key is None:
+                continue
+            if record.get("seed", False):
+                if _get_version(versions, key) is None:
+                    _set_version(versions, key, (0, rig))
+                continue
+            _set_version(versions, key, (part.get("ts", 0), rig))
+            local_changed.add(key)
+
+    incoming = []
+    for filename in sorted(os.listdir(remote_changes_dir)):
+        if not filename.endswith(".jsonl"):
+            continue
+        other = filename[:-len(".jsonl")]
+        if other == rig:
+            continue
+        records, state["offsets"][other] = read_changes(os.path.join(remote_changes_dir, filename),
+                                                        state["offsets"].get(other, 0))
+        for i, record in enumerate(records):
+            incoming.append((record.get("ts", 0), other, i, record))
+    incoming.sort(key=lambda item: item[:3])
+
+    to_apply = []
+    conflicts = []
+    for ts, other, i, record in incoming:
+        for key, part in split_record(record):
+            if key is None:
+                to_apply.append(part)
+                continue
+            local_version = _get_version(versions, key)
+            if record.get("seed", False) and local_version is not None:
+                continue  # a point that existed before the change logs, both sides know it already
+            remote_wins = local_version is None or (ts, other) > local_version
+            if key in local_changed:
+                conflicts.append({"image" : key[0], "name" : key[1], "kept" : other if remote_wins else rig,
+                                  "local" : list(local_version) if local_version else None,
+                                  "remote" : [ts, other], "record" : part, "merged_at" : time.time()})
+            if remote_wins:
+                _set_version(versions, key, (ts, other))
+                to_apply.append(part)
+    if len(to_apply) > 0:
+        apply_fcn(to_apply)
+    # Only stored once the records are applied, a merge that dies half way is simply done again
+    store_state(state_file, state)
+    return len(to_apply), conflicts
+
+def append_conflicts(conflicts_file : str, conflicts : list):
+    if len(conflicts) == 0:
+        return
+    existing = []
+    if os.path.exists(conflicts_file):
+        try:
+            with open(conflicts_file, 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable conflict list {conflicts_file}: {e}")
+    atomic_write_text(conflicts_file, json.dumps(existing + conflicts, indent=4))
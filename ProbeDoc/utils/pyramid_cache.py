@@ -0,0 +1,159 @@
+# Persistent on disk cache of the image pyramids CanvasImage builds
+# Building a pyramid means several LANCZOS resizes of the whole image (and for a huge image reading the
+# whole file band by band), which used to happen every time an image was selected.
+# Every level is stored uncompressed under resources/pyramid_cache/<key>/ and opened again as a MappedRaster,
+# so reopening an image only maps a few files and only the pixels of the tiles shown are read from disk.
+# The key is the content hash of the image (the file name in the content addressed store) plus its mtime.
+# The cache is capped at PyramidCacheMaxBytes, the least recently used pyramids are removed first.
+# Opening a pyramid only notes the time in memory, index.json gets it when a store evicts or the program exits.
+
+import os
+import re
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from .config import config
+from . import mapped_raster
+
+_lock = threading.Lock()
+_in_use = {}  # key -> number of open viewers, these are never evicted
+_last_used = {}  # key -> time it was last loaded, not in index.json yet
+_raw_modes = {"L", "I", "I;16", "F", "RGB", "RGBA", "CMYK"}  # the modes a MappedRaster can read
+_hex = re.compile(r"^[0-9a-f]{64}$")
+_rows_per_write = 256
+
+
+def cache_key(path : str):
+    stat = os.stat(path)
+    stem = Path(path).stem
+    if _hex.match(stem):
+        digest = stem  # content addressed, the name is the hash
+    else:
+        # Images from before content addressing, hashing the whole file would cost more than the pyramid
+        digest = hashlib.sha256(f"{os.path.abspath(path)}:{stat.st_size}".encode()).hexdigest()
+    return f"{digest}_{stat.st_mtime_ns}"
+
+def _index_path():
+    return os.path.join(config["PyramidCacheDirectory"], "index.json")
+
+def _load_index():
+    try:
+        with open(_index_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def _store_index(index : dict):
+    os.makedirs(config["PyramidCacheDirectory"], exist_ok = True)
+    tmp_path = _index_path() + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, _index_path())
+
+def _apply_last_used(index : dict):
+    for key, last_used in _last_used.items():
+        if key in index:
+            index[key]["last_used"] = max(index[key]["last_used"], last_used)
+    _last_used.clear()
+
+def save_access_times():
+    """ Write the times noted by load to index.json, runs on exit """
+    with _lock:
+        if len(_last_used) == 0:
+            return
+        index = _load_index()
+        _apply_last_used(index)
+        try:
+            _store_index(index)
+        except OSError as e:
+            print(f"Could not update the pyramid cache index: {e}")
+
+atexit.register(save_access_times)
+
+def load(path : str):
+    """ The cached pyramid levels of the image at path as MappedRasters, or None if there are none """
+    try:
+        key = cache_key(path)
+    except OSError:
+        return None
+    with _lock:
+        index = _load_index()
+        entry = index.get(key)
+        if entry is None:
+            return None
+        levels = []
+        try:
+            for level in entry["levels"]:
+                levels.append(mapped_raster.MappedRaster(os.path.join(config["PyramidCacheDirectory"], key, level["file"]),
+                                                         level["mode"], level["size"]))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Dropping unreadable pyramid cache entry {key}: {e}")
+            index.pop(key)
+            _store_index(index)
+            return None
+        _last_used[key] = time.time()
+        _in_use[key] = _in_use.get(key, 0) + 1
+    return levels
+
+def release(path : str):
+    """ Call once a viewer that got its levels from load is closed """
+    try:
+        key = cache_key(path)
+    except OSError:
+        return
+    with _lock:
+        if _in_use.get(key, 0) > 1:
+            _in_use[key] -= 1
+        else:
+            _in_use.pop(key, None)
+
+def store(path : str, levels : list):
+    """ Write the pyramid levels of the image at path to the cache """
+    if len(levels) == 0 or any(level.mode not in _raw_modes for level in levels):
+        return
+    key = cache_key(path)
+    directory = os.path.join(config["PyramidCacheDirectory"], key)
+    tmp_directory = directory + ".tmp"
+    shutil.rmtree(tmp_directory, ignore_errors = True)
+    os.makedirs(tmp_directory)
+    meta = []
+    n_bytes = 0
+    for i, level in enumerate(levels):
+        filename = f"level_{i}.raw"
+        with open(os.path.join(tmp_directory, filename), 'wb') as f:
+            # A band of rows at a time, tobytes of a whole huge level would double its memory
+            width, height = level.size
+            for top in range(0, height, _rows_per_write):
+                f.write(level.crop((0, top, width, min(height, top + _rows_per_write))).tobytes())
+            n_bytes += f.tell()
+        meta.append({"file" : filename, "mode" : level.mode, "size" : list(level.size)})
+    with _lock:
+        shutil.rmtree(directory, ignore_errors = True)
+        os.replace(tmp_directory, directory)
+        index = _load_index()
+        index[key] = {"levels" : meta, "bytes" : n_bytes, "last_used" : time.time()}
+        _apply_last_used(index)
+        evict__(index, keep = key)
+        _store_index(index)
+
+def evict__(index : dict, keep = None):
+    """ Remove the least recently used pyramids until the cache fits PyramidCacheMaxBytes """
+    total = sum(entry["bytes"] for entry in index.values())
+    for key in sorted(index.keys(), key=lambda key: index[key]["last_used"]):
+        if total <= config["PyramidCacheMaxBytes"]:
+            break
+        if key == keep or key in _in_use:
+            continue
+        try:
+            shutil.rmtree(os.path.join(config["PyramidCacheDirectory"], key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Still mapped by an image that was not garbage collected yet (Windows), tried again next time
+            print(f"Could not evict pyramid cache entry {key}: {e}")
+            continue
+        total -= index.pop(key)["bytes"]
@@ -0,0 +1,53 @@
+# Cached manifest of the registered image files, so startup does not have to look at their contents
+# resource_check used to find every image again before the window could open. Now the manifest
+# (resources/.resource_manifest.json) remembers the path, size and mtime of every registered image and the
+# startup check is one stat per image. Anything slower (hashing the files against their registered content
+# hash) happens in full_check, which the gui runs on a background thread once the window is up.
+
+import os
+from .content_store import hash_file
+
+
+def quick_check(images : dict, manifest : dict):
+    """ images: stem -> path. One stat per image, updates manifest in place
+        Returns (missing stems, stems whose file changed since the manifest was written) """
+    missing, changed = [], []
+    for stem, path in images.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            missing.append(stem)
+            continue
+        entry = manifest.get(stem)
+        if entry is not None and entry.get("path") == path and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns:
+            continue
+        if entry is not None:
+            changed.append(stem)
+        manifest[stem] = {"path" : path, "size" : stat.st_size, "mtime" : stat.st_mtime_ns}
+    for stem in list(manifest.keys()):
+        if stem not in images:
+            manifest.pop(stem)
+    return missing, changed
+
+def full_check(images : dict, hashes : dict, manifest : dict, with_hash = False):
+    """ images: stem -> path, hashes: stem -> registered content hash (None for images from before content addressing)
+        Checks every image exists and, with_hash, that its content still matches its hash.
+        A file already verified at its current size and mtime is not hashed again. Returns a list of problems """
+    problems = []
+    for stem, path in images.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            problems.append(f"{stem}: {path} does not exist")
+            continue
+        digest = hashes.get(stem)
+        if not with_hash or digest is None:
+            continue
+        entry = manifest.setdefault(stem, {"path" : path, "size" : stat.st_size, "mtime" : stat.st_mtime_ns})
+        if entry.get("verified") == digest and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns:
+            continue
+        if hash_file(path) != digest:
+            problems.append(f"{stem}: {path} no longer matches the image that was registered")
+            continue
+        manifest[stem] = {"path" : path, "size" : stat.st_size, "mtime" : stat.st_mtime_ns, "verified" : digest}
+    return problems
@@ -2,8 +2,26 @@
 # And there should be an avoidance of all errors
 
 from .config import config
+from . import journal
+from . import sqlite_store
+from . import persistence
+from . import shards
+from .image_registry import ImageRegistry
+from . import content_store
+from . import sync_engine
+from .transfer import TransferEngine
+from . import background_sync
+from . import point_merge
+from . import packed_sync
+from . import resource_manifest
+from . import image_pyramid
+from functools import partial
 import os
 import json
+import time
+import uuid
+import threading
+from concurrent.futures import Future
 from pathlib import Path
 import shutil
 from tkinter import messagebox
@@ -11,15 +29,51 @@ from tkinter import filedialog
 import tkinter as tk
 
 def safe_json_load(filepath : str):
+    # A store of this file could still be waiting on the write behind thread
+    persistence.flush()
     if os.path.exists(filepath):
         with open(filepath, 'r', encoding='utf-8') as f:
             return json.load(f)
     else:
         return {}
 
+# Hands the data to the write behind thread, the file is replaced atomically once it is written
 def safe_json_store(filepath : str, data : dict):
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=4)
+    persistence_service().submit_json(filepath, data)
+
+def persistence_service():
+    service = persistence.get_service(write_local_records__, config["WriteBehindWindow"])
+    service.window = config["WriteBehindWindow"]
+    return service
+
+# Polled by the gui, saves the write behind thread gave up on are only tried again once the user was asked
+# The user is only asked again once more saves failed than when they last said no
+_declined_saves = 0
+_asking_saves = False
+
+def check_failed_saves():
+    global _declined_saves, _asking_saves
+    n_failed, error = persistence_service().failed_writes()
+    if n_failed <= _declined_saves or _asking_saves:
+        if n_failed == 0:
+            _declined_saves = 0
+        return
+    _asking_saves = True  # the dialog runs a nested event loop, the poll must not open a second one
+    try:
+        retry = messagebox.askretrycancel("Saving Failed",
+                                          f"{n_failed} changes could not be saved:\n{error}\n\n"
+                                          "Retry now? Otherwise they are tried again when the program closes.")
+    finally:
+        _asking_saves = False
+    if retry:
+        _declined_saves = 0
+        persistence_service().retry_failed()
+    else:
+        _declined_saves = n_failed
+
+# Called on exit, makes sure nothing is left in the write behind queue
+def flush_pending_saves():
+    persistence.stop()
 
 def set_always_sync_on_startup(new_state_ : tk.BooleanVar):
     new_state = new_state_.get()
@@ -76,13 +130,136 @@ def safe_copy_dir(source_dir : str, destination_dir : str, relative_ignore = [])
         print(f"Error: {e}")
 
 
+# The gui sets this to show the progress of a running transfer, fcn(engine, title)
+# Without it (before the main window exists) transfers just block until done
+transfer_view = None
+
+def set_transfer_view(fcn):
+    global transfer_view
+    transfer_view = fcn
+
+def run_transfer__(jobs : list, title = "Syncing"):
+    engine = TransferEngine(config["TransferWorkers"], config["TransferRetries"],
+                            delta_min_size = config["DeltaMinSize"], delta_block_size = config["DeltaBlockSize"])
+    engine.start(jobs)
+    if transfer_view is not None:
+        transfer_view(engine, title)
+    engine.wait()
+    return engine.failed()
+
+def use_sqlite():
+    return config.get("StorageBackend", "json") == "sqlite"
+
+def use_shards():
+    return config.get("StorageBackend", "json") == "sharded"
+
+def use_packed_sync():
+    return config.get("SyncTarget", "directory") == "packed"
+
+def load_storage_settings():
+    settings = safe_json_load(config["SettingsFile"])
+    for key in ["StorageBackend", "JournalCompactThreshold", "WriteBehindWindow", "SyncUseHash", "TransferWorkers", "TransferRetries",
+                "DeltaMinSize", "DeltaBlockSize", "SyncTarget", "PackCompactRatio", "ValidateImageHashes",
+                "PyramidCacheMaxBytes", "RasterCacheMaxBytes", "ViewerCacheSize", "ViewerCacheMaxBytes",
+                "TileSize", "TileCacheSize", "RenderWorkers", "DecodeWorkers", "ResamplingQuality", "InteractiveFilter", "SettleDelay"]:
+        config[key] = settings.get(key, config[key])
+    # Identifies the change log of this installation, made here on the Tk thread because the write behind thread
+    # needs it and must not load or store settings.json itself (that would flush, i.e. wait on itself)
+    if "RigId" not in settings:
+        settings["RigId"] = uuid.uuid4().hex[:12]
+        safe_json_store(config["SettingsFile"], settings)
+    config["RigId"] = settings["RigId"]
+    if use_sqlite() and not sqlite_store.is_migrated():
+        images = load_json_image_hashes__()
+        images_original = safe_json_load(config["ImageOriginalListsFile"])
+        data_points = safe_json_load(config["SavePointsFile"])
+        journal.replay(data_points, config["SavePointsJournalFile"])
+        sqlite_store.migrate_from_json(images,
+                                       images_original if images_original != {} else [],
+                                       data_points)
+    if use_shards() and not shards.exists():
+        data_points = safe_json_load(config["SavePointsFile"])
+        journal.replay(data_points, config["SavePointsJournalFile"])
+        shards.migrate_from_json(data_points)
+    seed_change_log__()
+
+# Identifies the change log of this installation, stored in settings.json (which is never synced)
+# Set by load_storage_settings on startup, safe to call from the write behind thread
+def rig_id():
+    if config["RigId"] is None:
+        raise RuntimeError("load_storage_settings has to run before points are saved or merged")
+    return config["RigId"]
+
+def has_local_points__():
+    return any(os.path.exists(path) for path in [config["SavePointsFile"], config["SavePointsJournalFile"],
+                                                  config["SqliteDatabaseFile"], config["ShardDirectory"]])
+
+# The point files are not copied when the points can be merged record by record
+point_files = ["data_points.json", "data_points.journal", "probe_doc.db", "points/*"]
+
 def backup_from_sync():
     resource_check(False)
     destination_dir = config.get("ExternalSyncDir", None)
     if not config.get("PerformExternalSync", False) or not destination_dir:
         messagebox.warning("Unable to sync", "Sync directory does not exist, or was not specified, unable to use as backup")
         return
-    safe_copy_dir(source_dir = destination_dir, destination_dir = config["ResourceDirectory"], relative_ignore = ["settings.json"])
+    persistence.flush()
+    journal.wait_for_compaction()
+    # The database is about to be overwritten, it is re-opened on the next access
+    sqlite_store.close()
+    # The sync directory holds a pack instead of plain files if it was last synced with "SyncTarget": "packed"
+    packed = packed_sync.exists(destination_dir)
+    changes_prefix = point_merge.changes_dir_name + "/"
+    # A sync directory without change logs (from before the record merge) still replaces the local points
+    if packed:
+        merge_points = packed_sync.has_members(destination_dir, changes_prefix)
+    else:
+        merge_points = point_merge.has_changes(destination_dir)
+    ignore = sync_engine.default_ignore + [changes_prefix + "*"]
+    keep_local_points = merge_points and has_local_points__()
+    if keep_local_points:
+        ignore = ignore + point_files
+    # Only new or changed files are copied, nothing local is ever deleted by a backup
+    if packed:
+        packed_sync.restore_from_pack(destination_dir, config["ResourceDirectory"], ignore)
+        has_journal = packed_sync.has_member(destination_dir, "data_points.journal")
+    else:
+        sync_engine.sync_dirs(destination_dir, config["ResourceDirectory"], ignore = ignore, with_hash = config["SyncUseHash"],
+                              delete = False, scan_destination = True,
+                              run_copies = partial(run_transfer__, title = "Restoring From Sync"))
+        has_journal = os.path.exists(os.path.join(destination_dir, "data_points.journal"))
+    # An older sync directory has no journal, the local one would otherwise be replayed over the synced points.
+    # When the local points were kept the journal holds their latest edits and has to stay
+    if not keep_local_points and not has_journal and os.path.exists(config["SavePointsJournalFile"]):
+        os.remove(config["SavePointsJournalFile"])
+    image_registry.invalidate()
+    object_registry.invalidate()
+    invalidate_image_hashes()
+    # The shards now match the sync directory
+    shards.reset()
+    if shards.exists():
+        shards.mark_synced()
+    if merge_points:
+        if packed:
+            # The change logs have to come out of the pack first, only the ones that grew are extracted
+            packed_sync.restore_from_pack(destination_dir, config["PackedChangesDirectory"], prefix = changes_prefix)
+            merge_from_sync__(os.path.join(config["PackedChangesDirectory"], point_merge.changes_dir_name))
+        else:
+            merge_from_sync__(os.path.join(destination_dir, point_merge.changes_dir_name))
+
+# Points from before this rig kept a change log are added to it once, other rigs would never see them otherwise
+def seed_change_log__():
+    point_merge.seed(config["ChangeLogDirectory"], rig_id(), get_data_points, config["MergeStateFile"])
+
+def merge_from_sync__(remote_changes_dir : str):
+    applied, conflicts = point_merge.merge(config["ChangeLogDirectory"], remote_changes_dir, rig_id(),
+                                           config["MergeStateFile"], write_data_point_records__)
+    print(f"Merged {applied} point changes from {remote_changes_dir}, {len(conflicts)} conflicts")
+    if len(conflicts) > 0:
+        point_merge.append_conflicts(config["MergeConflictsFile"], conflicts)
+        messagebox.showinfo("Merge Conflicts",
+                            f"{len(conflicts)} points were changed both here and on another computer, the newest change was kept.\n"
+                            f"The other versions are listed in {config['MergeConflictsFile']}")
 
 def set_external_sync():
     directory_path = filedialog.askdirectory()
@@ -94,7 +271,9 @@ def set_external_sync():
         safe_json_store(config["SettingsFile"], settings)
         resource_check(False)
 
-def external_sync(force = False):
+# dry_run only prints what would be copied and deleted
+# run_copies replaces the default way of running the copies (see sync_engine.execute)
+def external_sync(force = False, dry_run = False, run_copies = None, scan_destination = False):
     if force:
         resource_check(False)
     if not config.get("PerformExternalSync", False):
@@ -102,7 +281,30 @@ def external_sync(force = False):
     destination_dir = config.get("ExternalSyncDir", None)
     if not destination_dir:
         return False
-    safe_copy_dir(config["ResourceDirectory"], destination_dir, relative_ignore = ["settings.json"]) 
+    persistence.flush()
+    sqlite_store.checkpoint()
+    journal.wait_for_compaction()
+    # Only the shards dirty now are cleared afterwards, this may run in the background while points are edited
+    synced_shards = shards.dirty_snapshot() if use_shards() else None
+    if use_packed_sync():
+        failed = packed_sync.sync_to_pack(config["ResourceDirectory"], destination_dir, with_hash = config["SyncUseHash"],
+                                          dry_run = dry_run, compact_ratio = config["PackCompactRatio"],
+                                          run_copies = run_copies or partial(run_transfer__, title = "Syncing"))
+        if len(failed) > 0:
+            return False
+        if use_shards() and not dry_run:
+            shards.mark_synced(synced_shards)
+        return True
+    sync_plan, failed = sync_engine.sync_dirs(config["ResourceDirectory"], destination_dir,
+                                              with_hash = config["SyncUseHash"], dry_run = dry_run,
+                                              scan_destination = scan_destination,
+                                              run_copies = run_copies or partial(run_transfer__, title = "Syncing"))
+    if dry_run:
+        return True
+    if len(failed) > 0:
+        return False
+    if use_shards():
+        shards.mark_synced(synced_shards)
     return True
 
 def external_sync_data_points():
@@ -111,9 +313,28 @@ def external_sync_data_points():
     destination_dir = config.get("ExternalSyncDir", None)
     if not destination_dir:
         return
+    if use_shards():
+        # Only the shards that were edited since the last sync are copied
+        persistence.flush()
+        destination_shard_dir = os.path.join(destination_dir, Path(config["ShardDirectory"]).name)
+        os.makedirs(destination_shard_dir, exist_ok = True)
+        dirty = shards.dirty_snapshot()
+        for img in dirty:
+            if os.path.exists(shards.shard_path(img)):
+                safe_copy_file(shards.shard_path(img), os.path.join(destination_shard_dir, Path(shards.shard_path(img)).name))
+        safe_copy_file(shards.index_path(), os.path.join(destination_shard_dir, "index.json"))
+        shards.mark_synced(dirty)
+        return
     destination_file = os.path.join(destination_dir, "data_points.json")
     source_file = config["SavePointsFile"]
+    persistence.flush()
+    journal.wait_for_compaction()
     safe_copy_file(source_file, destination_file)
+    if os.path.exists(config["SavePointsJournalFile"]):
+        safe_copy_file(config["SavePointsJournalFile"], os.path.join(destination_dir, "data_points.journal"))
+    if use_sqlite():
+        sqlite_store.checkpoint()
+        safe_copy_file(config["SqliteDatabaseFile"], os.path.join(destination_dir, Path(config["SqliteDatabaseFile"]).name))
     # destination_file = os.path.join(destination_dir, "notes.txt")
     # source_file = config["NotesFile"]
     # safe_copy_file(source_file, destination_file)
@@ -126,112 +347,313 @@ def external_sync_images():
         return
     destination_img_dir = os.path.join(destination_dir, "images")
     source_dir = config["ImagesDirectory"]
-    safe_copy_dir(source_dir, destination_img_dir)
+    persistence.flush()
+    sync_engine.sync_dirs(source_dir, destination_img_dir, with_hash = config["SyncUseHash"],
+                          run_copies = partial(run_transfer__, title = "Syncing Images"))
+    if use_sqlite():
+        # The image lists live in the database
+        sqlite_store.checkpoint()
+        safe_copy_file(config["SqliteDatabaseFile"], os.path.join(destination_dir, Path(config["SqliteDatabaseFile"]).name))
+        return
     safe_copy_file(config["ImageListsFile"], os.path.join(destination_dir, "images.json"))
     safe_copy_file(config["ImageOriginalListsFile"], os.path.join(destination_dir, "images_original.json"))
+    if os.path.exists(config["ImageHashesFile"]):
+        safe_copy_file(config["ImageHashesFile"], os.path.join(destination_dir, Path(config["ImageHashesFile"]).name))
 
 
 def get_data_points():
+    persistence.flush()
+    if use_sqlite():
+        # Points of an image are only read once that image is accessed
+        return sqlite_store.load_data_points()
+    if use_shards():
+        return shards.load_data_points()
     points_file = safe_json_load(config["SavePointsFile"])
+    # Edits since the last snapshot live in the journal
+    journal.replay(points_file, config["SavePointsJournalFile"])
+    journal.maybe_compact(config["SavePointsFile"], config["SavePointsJournalFile"], config["JournalCompactThreshold"])
     for key in points_file.keys():
         for entry in points_file[key]:
              if "notes" not in entry.keys():
                  entry["notes"] = ""
     return points_file
 
+# Runs the external sync on a background thread, returns the BackgroundSync or None if there is no sync directory
+# resume: an earlier sync was interrupted, the sync directory is scanned instead of trusting its manifest
+def start_background_sync(resume = False):
+    if not config.get("PerformExternalSync", False) or not config.get("ExternalSyncDir", None):
+        return None
+    sync = background_sync.BackgroundSync(
+        lambda run_copies: external_sync(force = False, run_copies = run_copies, scan_destination = resume),
+        config["SyncResumeFile"], config["TransferWorkers"], config["TransferRetries"], config["DeltaMinSize"],
+        config["DeltaBlockSize"])
+    sync.start()
+    return sync
+
+def has_interrupted_sync():
+    return background_sync.has_resume_state(config["SyncResumeFile"])
+
+# Returns the running BackgroundSync, or None if no sync was asked for or it could not start
 def ask_external_sync():
     if messagebox.askyesno("Confirm Sync", "Would you like to sync the data upon exit?"):
-        synced = external_sync(force=False)
-        if not synced:
+        sync = start_background_sync()
+        if sync is None:
             messagebox.showwarning("External Sync Failed", 
                                    "Error: External sync failed, please sync manually or with application sync button")
-            return False
-    return True
+        return sync
+    return None
 
+# Writes the entire data points file, only use this when most of the data changed
+# For single edits use the functions below, they only append to the journal
 def save_data_points(data):
-    safe_json_store(config["SavePointsFile"], data)
+    persistence.flush()
+    if use_sqlite():
+        sqlite_store.replace_points(data)
+        return
+    if use_shards():
+        shards.write_shards(data)
+        return
+    journal.write_snapshot(config["SavePointsFile"], config["SavePointsJournalFile"], data)
     # NOTE: Change: made external_sync (for anything) not automatic
     # external_sync_data_points()
 
-def load_image_paths():
+def save_data_point_record__(record : dict):
+    record["ts"] = time.time()
+    persistence_service().submit_record(record)
+
+# Runs on the write behind thread, edits made here also go to this rig's change log (see point_merge.py)
+def write_local_records__(records : list):
+    point_merge.append_changes(config["ChangeLogDirectory"], rig_id(), records)
+    write_data_point_records__(records)
+
+# Runs on the write behind thread
+def write_data_point_records__(records : list):
+    if use_sqlite():
+        sqlite_store.apply_records(records)
+        return
+    if use_shards():
+        shards.apply_records(records)
+        return
+    journal.append_records(config["SavePointsJournalFile"], records)
+    journal.maybe_compact(config["SavePointsFile"], config["SavePointsJournalFile"], config["JournalCompactThreshold"])
+
+def save_new_image_points(img : str):
+    save_data_point_record__({"op" : "image", "image" : img})
+
+def save_data_point(img : str, entry : dict):
+    save_data_point_record__({"op" : "add", "image" : img, "entry" : entry})
+
+def save_edited_data_point(img : str, old_name : str, entry : dict):
+    save_data_point_record__({"op" : "edit", "image" : img, "old_name" : old_name, "entry" : entry})
+
+def save_deleted_data_point(img : str, name : str):
+    save_data_point_record__({"op" : "delete", "image" : img, "name" : name})
+
+def save_data_point_note(img : str, name : str, note : str):
+    save_data_point_record__({"op" : "note", "image" : img, "name" : name, "notes" : note})
+
+# name -> content hash of every registered image, None for images stored before content addressing
+def load_image_hashes():
+    if use_sqlite():
+        return sqlite_store.load_image_hashes()
+    return load_json_image_hashes__()
+
+# images.json stays the plain list of names older versions read (and append to), the hashes are kept
+# next to it in image_hashes.json. A dict in images.json is from the version that kept the hashes in it
+def load_json_image_hashes__():
     imgs = safe_json_load(config["ImageListsFile"])
-    if imgs == {}:
-        return []
-    return imgs
+    if isinstance(imgs, dict):
+        return imgs
+    hashes = safe_json_load(config["ImageHashesFile"])
+    return {img : hashes.get(img, None) for img in imgs}
+
+def store_json_image_hashes__(images : dict):
+    safe_json_store(config["ImageListsFile"], list(images.keys()))
+    safe_json_store(config["ImageHashesFile"], {name : digest for name, digest in images.items() if digest is not None})
+
+def load_image_paths():
+    if use_sqlite():
+        return sqlite_store.load_image_names()
+    return list(load_image_hashes().keys())
 
 def load_original_image_paths():
+    if use_sqlite():
+        return sqlite_store.load_original_image_paths()
     imgs = safe_json_load(config["ImageOriginalListsFile"])
     if imgs == {}:
         return []
     return imgs
 
-# Copies the image into the 
+# Stores the image in the content addressed image store and registers it
+# Returns the name it was registered under, or None
 def add_image(source_image_path : str):
-    if not os.path.exists(config["ImagesDirectory"]):
-        os.makedirs(config["ImagesDirectory"], exist_ok = True)
-    img_name = Path(source_image_path).name
-    dest_image_path = os.path.join(config["ImagesDirectory"], img_name)
-    images = load_image_paths()
-    images_original = load_original_image_paths()
-    images_original.append(source_image_path)
-    if img_name not in images:
+    return finish_add_image(source_image_path, start_add_image(source_image_path))
+
+# Hashing and copying a large image takes a while, this does both on a worker thread
+# Returns a Future of (hash, stored path), the gui polls it and hands it to finish_add_image
+def start_add_image(source_image_path : str):
+    future = Future()
+    def run():
         try:
-            shutil.copy(source_image_path, dest_image_path)
-            images.append(img_name)
-            print("appending to image lists file")
-            safe_json_store(config["ImageListsFile"], images)
-            safe_json_store(config["ImageOriginalListsFile"], images_original)
-            # NOTE: Change: made external_sync (for anything) not automatic
-            # external_sync_images()
-            return dest_image_path
-        except FileNotFoundError:
-            print(f"Error: Source file '{source_image_path}' not found.")
-            return None
-        except IsADirectoryError:
-            print(f"Error: Destination is a directory, but expected a file path for shutil.copyfile(). Use shutil.copy() instead.")
-            return None
-        except PermissionError:
-            print("Error: Permission denied.")
-            return None
+            digest = content_store.hash_file(source_image_path)
+            future.set_result((digest, content_store.store_file(source_image_path, digest)))
         except Exception as e:
-            print(f"An error occurred: {e}")
+            future.set_exception(e)
+    threading.Thread(target=run, name="image-store", daemon=True).start()
+    return future
+
+# Runs on the Tk thread once the Future of start_add_image is done
+# Returns the name the image was registered under, or None
+def finish_add_image(source_image_path : str, future : Future):
+    try:
+        digest, stored_path = future.result()
+    except FileNotFoundError:
+        print(f"Error: Source file '{source_image_path}' not found.")
+        return None
+    except PermissionError:
+        print("Error: Permission denied.")
+        return None
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+    images = load_image_hashes()
+    source_stem = Path(source_image_path).stem
+    for name, known_digest in images.items():
+        if known_digest == digest and Path(name).stem == source_stem:
+            messagebox.showinfo("Image Already Registered", f"This image is already registered as {source_stem}")
             return None
-    return None
+    # Content that is stored already is registered under the new name too, the stored file is shared.
+    # A different image with the same file name gets its own name instead of being refused
+    img_name = content_store.unique_name(Path(source_image_path).name, images.keys())
+    object_registry.add(stored_path)
+    if use_sqlite():
+        sqlite_store.add_image_entry(img_name, source_image_path, digest)
+    else:
+        images[img_name] = digest
+        images_original = load_original_image_paths()
+        images_original.append(source_image_path)
+        print("appending to image lists file")
+        store_json_image_hashes__(images)
+        safe_json_store(config["ImageOriginalListsFile"], images_original)
+    invalidate_image_hashes()
+    # The pyramid (and for a huge image its raster) is built in the background so the first view is fast
+    image_pyramid.prepare_async(stored_path)
+    # NOTE: Change: made external_sync (for anything) not automatic
+    # external_sync_images()
+    return img_name
+
+
+# stem -> path of everything in the images directory, only re-listed when the directory changes
+image_registry = ImageRegistry(config["ImagesDirectory"])
+# hash -> path of everything in the content addressed object store
+object_registry = ImageRegistry(config["ImageObjectsDirectory"])
+_image_hashes = None
 
+def image_hashes_by_stem__():
+    global _image_hashes
+    if _image_hashes is None:
+        _image_hashes = {Path(name).stem : digest for name, digest in load_image_hashes().items()}
+    return _image_hashes
+
+def invalidate_image_hashes():
+    global _image_hashes
+    _image_hashes = None
 
 # This takes a single image name, and return's its path
 def get_image_path(img_name : str):
-    directory = config["ImagesDirectory"]
-    imgs = os.listdir(directory)
-    for img in imgs:
-        if Path(img).stem == img_name:
-            return os.path.join(directory, img)
-    return None
+    digest = image_hashes_by_stem__().get(img_name, None)
+    if digest is not None:
+        return object_registry.get(digest)
+    # Images registered before content addressing keep their name in the images directory
+    return image_registry.get(img_name)
+
+# stem -> path of every registered image
+# Content addressed images are found from their hash, so no directory has to be listed for them
+def registered_image_paths__():
+    paths = {}
+    for name, digest in load_image_hashes().items():
+        stem = Path(name).stem
+        if digest is not None:
+            paths[stem] = content_store.object_path(digest, Path(name).suffix)
+        else:
+            paths[stem] = image_registry.get(stem) or os.path.join(config["ImagesDirectory"], name)
+    return paths
+
+# Full check of the registered images (existence, and the content hashes with "ValidateImageHashes")
+# Runs on a background thread, the returned Future gets the list of problems
+def start_resource_validation():
+    paths = registered_image_paths__()
+    hashes = dict(image_hashes_by_stem__())
+    manifest = safe_json_load(config["ResourceManifestFile"])
+    future = Future()
+    def run():
+        try:
+            problems = resource_manifest.full_check(paths, hashes, manifest, config["ValidateImageHashes"])
+            safe_json_store(config["ResourceManifestFile"], manifest)
+            future.set_result(problems)
+        except Exception as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name="resource-validation", daemon=True).start()
+    return future
 
-def delete_image(img_name : str):
+# on_confirmed() is called once the user confirmed, before anything is removed
+# Returns True if the image was deleted
+def delete_image(img_name : str, on_confirmed = None):
     path = get_image_path(img_name)
     if path is None:
-        return
-    images = [Path(file_path).stem for file_path in load_image_paths()]
-    data_points = get_data_points()
-    if img_name not in data_points.keys():
-        return
+        return False
+    if use_sqlite():
+        n_points = sqlite_store.count_points(img_name)
+    else:
+        data_points = get_data_points()
+        if img_name not in data_points.keys():
+            return False
+        n_points = len(data_points[img_name])
     if not messagebox.askyesno("Confirm Delete", f"Are you sure you would like to delete {img_name}?"):
-        return
-    if not messagebox.askyesno("Confirm Delete", f"Are you sure that you're sure about this? You are going to delete {len(data_points[img_name])} points"):
-        return
+        return False
+    if not messagebox.askyesno("Confirm Delete", f"Are you sure that you're sure about this? You are going to delete {n_points} points"):
+        return False
     messagebox.showinfo(f"Deleting {img_name}...", "Alright, fuck it")
-    try:
-        os.remove(path)
-        print("deleted file")
-    except OSError as e:
-        print(f"Error: {e.strerror}")
+    if on_confirmed is not None:
+        on_confirmed()
+    images = load_image_hashes()
+    digest = image_hashes_by_stem__().get(img_name, None)
+    if digest is not None:
+        # Objects are named by hash and extension, the same content added as .png and .tif is two files
+        own_name = next(name for name in images.keys() if Path(name).stem == img_name)
+        path = content_store.object_path(digest, Path(own_name).suffix)
+    other_paths = [content_store.object_path(d, Path(name).suffix) for name, d in images.items()
+                   if d == digest and Path(name).stem != img_name]
+    # Stored content is only removed once no other registered name points at the same file
+    shared = digest is not None and path in other_paths
+    if not shared:
+        try:
+            os.remove(path)
+            if digest is not None:
+                object_registry.remove(digest)
+                # Another extension of the same content is still stored under this hash
+                for other_path in other_paths:
+                    object_registry.add(other_path)
+            else:
+                image_registry.remove(img_name)
+            print("deleted file")
+        except OSError as e:
+            print(f"Error: {e.strerror}")
+    invalidate_image_hashes()
+    if use_sqlite():
+        sqlite_store.delete_image_entry(img_name)
+        return True
     del data_points[img_name]
-    n_images = [file_path for file_path in load_image_paths() if Path(file_path).stem != img_name]
+    n_images = {name : d for name, d in images.items() if Path(name).stem != img_name}
     n_original_images = [file_path for file_path in load_original_image_paths() if Path(file_path).stem != img_name]
-    save_data_points(data_points)
-    safe_json_store(config["ImageListsFile"], n_images)
+    if use_shards():
+        persistence.flush()
+        shards.delete_shard(img_name)
+    else:
+        save_data_points(data_points)
+    store_json_image_hashes__(n_images)
     safe_json_store(config["ImageOriginalListsFile"], n_original_images)
+    return True
 
 
 
@@ -239,24 +661,19 @@ def delete_image(img_name : str):
 # The point of this function is to make sure all the resources and everything is set
 # Before accidentally changing any data
 def resource_check(do_backup_sync=True):
-    for file in load_image_paths():
-        im_name = Path(file).stem
-        im_path = get_image_path(im_name)
-        if im_path is None or not os.path.exists(im_path):
-            messagebox.showwarning("Image Not Found", f"The image {file} does not exist! Please put that image into the resources/images directory manually")
-        assert im_path and os.path.exists(im_path), f"Error image file path {file} does not exist, exiting before important data over written"
-    data_points = get_data_points()
-    # keys = list(data_points.keys())
-    # for key in keys:
-    #     assert key in config["ImagePaths"], f"Error expexted the image {key} to be a current valid image path"
-    save = False
-    for file in load_image_paths():
-        im_name = Path(file).stem
-        if im_name not in data_points.keys():
-            data_points[file] = {}
-            save = True
-    if save:
-        save_data_points(data_points)
+    load_storage_settings()
+    # One stat per image against the cached manifest, the full check runs once the window is up
+    # (see start_resource_validation). Images without points get their entry from MainGui.check_data_points
+    manifest = safe_json_load(config["ResourceManifestFile"])
+    old_manifest = json.dumps(manifest, sort_keys=True)
+    missing, changed = resource_manifest.quick_check(registered_image_paths__(), manifest)
+    for im_name in missing:
+        messagebox.showwarning("Image Not Found", f"The image {im_name} does not exist! Please put that image into the resources/images directory manually")
+        assert False, f"Error image file for {im_name} does not exist, exiting before important data over written"
+    if len(changed) > 0:
+        print(f"Image files changed since the last start: {', '.join(changed)}")
+    if json.dumps(manifest, sort_keys=True) != old_manifest:
+        safe_json_store(config["ResourceManifestFile"], manifest)
 
     # Checking for external sync
     settings = safe_json_load(config["SettingsFile"])
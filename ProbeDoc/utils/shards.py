@@ -0,0 +1,144 @@
+# Per image sharded data points
+# Selected with "StorageBackend" : "sharded" in settings.json
+# Every image gets its own small file resources/points/<image>.json, plus a tiny index.json that lists the images
+# and which shards changed since the last external sync. Editing one point then only rewrites that image's file,
+# and a sync only has to copy the shards that changed.
+
+import os
+import json
+import threading
+from .config import config
+from . import journal
+from .persistence import atomic_write_text
+from .lazy_points import LazyDataPoints
+
+_lock = threading.RLock()
+_index = None
+_writes = {}  # image -> times its shard was written this session, tells dirty_snapshot apart from later edits
+
+
+def shard_path(img : str):
+    return os.path.join(config["ShardDirectory"], img + ".json")
+
+def index_path():
+    return os.path.join(config["ShardDirectory"], "index.json")
+
+def exists():
+    return os.path.exists(index_path())
+
+def _load_index():
+    global _index
+    if _index is None:
+        if os.path.exists(index_path()):
+            with open(index_path(), 'r', encoding='utf-8') as f:
+                _index = json.load(f)
+        else:
+            _index = {}
+        _index.setdefault("images", [])
+        _index.setdefault("dirty", [])
+    return _index
+
+def _store_index():
+    os.makedirs(config["ShardDirectory"], exist_ok = True)
+    atomic_write_text(index_path(), json.dumps(_index, indent=4))
+
+def reset():
+    """ Forget the cached index, used after the shard directory was replaced by a sync """
+    global _index
+    with _lock:
+        _index = None
+
+def image_keys():
+    with _lock:
+        return list(_load_index()["images"])
+
+def get_points(img : str):
+    path = shard_path(img)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        points = json.load(f)
+    for entry in points:
+        entry.setdefault("notes", "")
+    return points
+
+def _write_shard(img : str, points : list):
+    index = _load_index()
+    atomic_write_text(shard_path(img), json.dumps(points, indent=4))
+    _writes[img] = _writes.get(img, 0) + 1
+    changed = False
+    if img not in index["images"]:
+        index["images"].append(img)
+        changed = True
+    if img not in index["dirty"]:
+        index["dirty"].append(img)
+        changed = True
+    return changed
+
+def write_shards(data_points : dict):
+    """ Write the shard of every image in data_points """
+    if isinstance(data_points, LazyDataPoints):
+        data_points = data_points.loaded()
+    with _lock:
+        os.makedirs(config["ShardDirectory"], exist_ok = True)
+        changed = False
+        for img, points in data_points.items():
+            changed = _write_shard(img, points if isinstance(points, list) else []) or changed
+        if changed or not exists():
+            _store_index()
+
+def apply_records(records : list):
+    """ Apply data point records (see journal.py), only the shards they touch are rewritten """
+    with _lock:
+        os.makedirs(config["ShardDirectory"], exist_ok = True)
+        touched = {}
+        for record in records:
+            img = record.get("image")
+            if img is not None and img not in touched:
+                touched[img] = get_points(img)
+        journal.apply_records(touched, records)
+        changed = False
+        for img, points in touched.items():
+            changed = _write_shard(img, points) or changed
+        if changed:
+            _store_index()
+
+def delete_shard(img : str):
+    with _lock:
+        index = _load_index()
+        if os.path.exists(shard_path(img)):
+            os.remove(shard_path(img))
+        if img in index["images"]:
+            index["images"].remove(img)
+        if img in index["dirty"]:
+            index["dirty"].remove(img)
+        _store_index()
+
+def dirty_snapshot():
+    """ The dirty shards as they are now, a sync takes this when it starts and hands it to mark_synced """
+    with _lock:
+        return {img : _writes.get(img, 0) for img in _load_index()["dirty"]}
+
+def mark_synced(imgs = None):
+    """ Clear the dirty flag of the given shards, or of all shards
+        With a dirty_snapshot, a shard that was written again since the snapshot stays dirty """
+    with _lock:
+        index = _load_index()
+        if imgs is None:
+            index["dirty"] = []
+        elif isinstance(imgs, dict):
+            index["dirty"] = [img for img in index["dirty"] if img not in imgs or _writes.get(img, 0) != imgs[img]]
+        else:
+            index["dirty"] = [img for img in index["dirty"] if img not in imgs]
+        _store_index()
+
+def load_data_points():
+    return LazyDataPoints(image_keys, get_points)
+
+# One shot split of the single data_points.json (and its journal) into shards
+def migrate_from_json(data_points : dict):
+    if exists():
+        return False
+    write_shards(data_points)
+    print(f"Split {len(data_points)} images into shards in {config['ShardDirectory']}")
+    return True
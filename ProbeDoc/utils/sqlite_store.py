@@ -0,0 +1,224 @@
+# SQLite storage backend for the image registry, data points and notes
+# Selected with "StorageBackend" : "sqlite" in settings.json, the json files are migrated over once
+# Lookups go through the (image, name) index, so an edit never has to load or rewrite every image's points
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from .config import config
+from .lazy_points import LazyDataPoints
+from .annotation_store import date_key
+
+_lock = threading.RLock()
+_connection = None
+
+_schema = """
+CREATE TABLE IF NOT EXISTS images (
+    name     TEXT PRIMARY KEY,
+    stem     TEXT NOT NULL,
+    original TEXT
+);
+CREATE TABLE IF NOT EXISTS points (
+    image TEXT NOT NULL,
+    name  TEXT NOT NULL,
+    color TEXT NOT NULL,
+    x     INTEGER,
+    y     INTEGER,
+    date  TEXT
+);
+CREATE TABLE IF NOT EXISTS notes (
+    image TEXT NOT NULL,
+    name  TEXT NOT NULL,
+    notes TEXT NOT NULL DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS points_image_name ON points (image, name);
+CREATE INDEX IF NOT EXISTS points_date ON points (date);
+CREATE UNIQUE INDEX IF NOT EXISTS notes_image_name ON notes (image, name);
+CREATE INDEX IF NOT EXISTS images_stem ON images (stem);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def connect():
+    global _connection
+    with _lock:
+        if _connection is not None:
+            return _connection
+        os.makedirs(os.path.dirname(config["SqliteDatabaseFile"]), exist_ok = True)
+        _connection = sqlite3.connect(config["SqliteDatabaseFile"], check_same_thread = False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        drop_unique_stem__(_connection)
+        _connection.executescript(_schema)
+        columns = [row[1] for row in _connection.execute("PRAGMA table_info(images)")]
+        if "hash" not in columns:
+            # Content hash of the stored image, see content_store.py
+            _connection.execute("ALTER TABLE images ADD COLUMN hash TEXT")
+        _connection.commit()
+        return _connection
+
+def drop_unique_stem__(con):
+    """ Images used to be unique by stem, which dropped a.jpg next to a.png, they are only unique by name now """
+    row = con.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'images'").fetchone()
+    if row is None or "UNIQUE" not in row[0]:
+        return
+    columns = ", ".join(r[1] for r in con.execute("PRAGMA table_info(images)"))
+    con.execute("BEGIN")  # one transaction, an interrupted rebuild leaves the old table as it was
+    try:
+        con.execute("ALTER TABLE images RENAME TO images_old")
+        con.execute("CREATE TABLE images (name TEXT PRIMARY KEY, stem TEXT NOT NULL, original TEXT, hash TEXT)")
+        con.execute(f"INSERT INTO images ({columns}) SELECT {columns} FROM images_old ORDER BY rowid")
+        con.execute("DROP TABLE images_old")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+def close():
+    global _connection
+    with _lock:
+        if _connection is None:
+            return
+        _connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        _connection.close()
+        _connection = None
+
+def checkpoint():
+    """ Fold the write ahead log into the database file, so that the file can be copied on its own """
+    with _lock:
+        if _connection is not None:
+            _connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def is_migrated():
+    with _lock:
+        row = connect().execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+        return row is not None
+
+# One shot migration from the json files, only runs if the database was never filled
+def migrate_from_json(images : list, images_original : list, data_points : dict):
+    if is_migrated():
+        return False
+    originals = {Path(path).name : path for path in images_original}
+    hashes = images if isinstance(images, dict) else {}
+    with _lock:
+        con = connect()
+        with con:
+            # Only a name listed twice is skipped, names with the same stem (a.png and a.jpg) are both kept
+            for img_name in images:
+                con.execute("INSERT OR IGNORE INTO images (name, stem, original, hash) VALUES (?, ?, ?, ?)",
+                            (img_name, Path(img_name).stem, originals.get(img_name), hashes.get(img_name)))
+            for img, points in data_points.items():
+                if not isinstance(points, list):
+                    continue
+                for entry in points:
+                    _upsert_point(con, img, entry)
+            con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', '1')")
+    print(f"Migrated {len(images)} images into {config['SqliteDatabaseFile']}")
+    return True
+
+def load_image_names():
+    with _lock:
+        return [row[0] for row in connect().execute("SELECT name FROM images ORDER BY rowid")]
+
+def load_image_hashes():
+    """ name -> content hash (None for images stored before content addressing) """
+    with _lock:
+        return {name : digest for name, digest in connect().execute("SELECT name, hash FROM images ORDER BY rowid")}
+
+def load_original_image_paths():
+    with _lock:
+        return [row[0] for row in connect().execute("SELECT original FROM images WHERE original IS NOT NULL ORDER BY rowid")]
+
+def add_image_entry(img_name : str, original : str, digest : str = None):
+    with _lock:
+        con = connect()
+        with con:
+            # A name that is taken already is an error, add_image makes every name unique first
+            con.execute("INSERT INTO images (name, stem, original, hash) VALUES (?, ?, ?, ?)",
+                        (img_name, Path(img_name).stem, original, digest))
+
+def delete_image_entry(img : str):
+    """ Removes the image with the stem img and all of its points and notes """
+    with _lock:
+        con = connect()
+        with con:
+            con.execute("DELETE FROM images WHERE stem = ?", (img,))
+            con.execute("DELETE FROM points WHERE image = ?", (img,))
+            con.execute("DELETE FROM notes WHERE image = ?", (img,))
+
+def count_points(img : str):
+    with _lock:
+        return connect().execute("SELECT COUNT(*) FROM points WHERE image = ?", (img,)).fetchone()[0]
+
+def image_keys():
+    """ Every image stem that has points, or is registered """
+    with _lock:
+        rows = connect().execute("SELECT stem FROM images UNION SELECT DISTINCT image FROM points")
+        return [row[0] for row in rows]
+
+def get_points(img : str):
+    with _lock:
+        rows = connect().execute(
+            "SELECT p.name, p.color, p.x, p.y, COALESCE(n.notes, '') FROM points p "
+            "LEFT JOIN notes n ON n.image = p.image AND n.name = p.name "
+            "WHERE p.image = ? ORDER BY p.rowid", (img,))
+        return [{"name" : name, "color" : color, "pos" : [x, y], "notes" : notes}
+                for name, color, x, y, notes in rows]
+
+def _upsert_point(con, img : str, entry : dict):
+    pos = entry.get("pos") or [None, None]
+    con.execute("INSERT OR REPLACE INTO points (image, name, color, x, y, date) VALUES (?, ?, ?, ?, ?, ?)",
+                (img, entry["name"], entry["color"], pos[0], pos[1], date_key(entry["name"])))
+    con.execute("INSERT OR REPLACE INTO notes (image, name, notes) VALUES (?, ?, ?)",
+                (img, entry["name"], entry.get("notes", "")))
+
+def _delete_point(con, img : str, name : str):
+    con.execute("DELETE FROM points WHERE image = ? AND name = ?", (img, name))
+    con.execute("DELETE FROM notes WHERE image = ? AND name = ?", (img, name))
+
+# Same records as the json journal (see journal.py)
+def apply_records(records : list):
+    """ Apply a batch of records in a single transaction """
+    with _lock:
+        con = connect()
+        with con:
+            for record in records:
+                _apply_record(con, record)
+
+def _apply_record(con, record : dict):
+    op = record.get("op")
+    img = record.get("image")
+    if op == "add":
+        _upsert_point(con, img, record["entry"])
+    elif op == "edit":
+        if record.get("old_name") is not None:
+            _delete_point(con, img, record["old_name"])
+        _upsert_point(con, img, record["entry"])
+    elif op == "delete":
+        _delete_point(con, img, record["name"])
+    elif op == "note":
+        con.execute("UPDATE notes SET notes = ? WHERE image = ? AND name = ?",
+                    (record["notes"], img, record["name"]))
+
+def replace_points(data_points : dict):
+    """ Replaces the points of every image in data_points (an image missing from it is left alone) """
+    if isinstance(data_points, LazyDataPoints):
+        data_points = data_points.loaded()
+    with _lock:
+        con = connect()
+        with con:
+            for img, points in data_points.items():
+                con.execute("DELETE FROM points WHERE image = ?", (img,))
+                con.execute("DELETE FROM notes WHERE image = ?", (img,))
+                if not isinstance(points, list):
+                    continue
+                for entry in points:
+                    _upsert_point(con, img, entry)
+
+
+def load_data_points():
+    """ dict like view of the data points, an image's points are only read from the database once it is accessed """
+    return LazyDataPoints(image_keys, get_points)
@@ -0,0 +1,111 @@
+# Startup instrumentation
+# Turned on with the PROBEDOC_PROFILE_STARTUP=<report.json> environment variable or the
+# --profile-startup <report.json> command line flag. It records how long every module import took
+# (time spent in the module itself and including what it imported) and the timings of the startup
+# phases marked with phase(), and writes them as a json report once the first frame is shown.
+# When it is off, phase() does nothing, so the marks can stay in the code.
+# PROBEDOC_EXIT_AFTER_FIRST_FRAME=1 closes the program right after the report is written (for benchmarks).
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+_enabled = False
+_report_path = None
+_start = None
+_phases = []
+_imports = {}  # module -> [cumulative seconds, seconds spent in children]
+_import_stack = []
+
+
+class _TimedLoader:
+    """ Wraps a module loader so executing the module is timed """
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        _import_stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = _import_stack.pop()
+            if _import_stack:
+                _import_stack[-1] += elapsed
+            _imports[module.__name__] = [elapsed, children]
+
+
+class _ImportTimer:
+    """ Meta path finder that finds modules with the other finders and times their loading """
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+def enable(report_path : str):
+    global _enabled, _report_path, _start
+    if _enabled:
+        return
+    _enabled = True
+    _report_path = report_path
+    _start = time.perf_counter()
+    sys.meta_path.insert(0, _ImportTimer())
+
+def enable_from_args(argv : list):
+    """ Turn profiling on if asked for on the command line or in the environment, removes the flag from argv """
+    if "--profile-startup" in argv:
+        i = argv.index("--profile-startup")
+        report_path = argv[i + 1] if i + 1 < len(argv) else "startup_profile.json"
+        del argv[i:i + 2]
+        enable(report_path)
+    elif os.environ.get("PROBEDOC_PROFILE_STARTUP"):
+        enable(os.environ["PROBEDOC_PROFILE_STARTUP"])
+
+def enabled():
+    return _enabled
+
+@contextmanager
+def phase(name : str):
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append({"name" : name, "start" : start - _start, "duration" : time.perf_counter() - start})
+
+def first_frame(root):
+    """ Call with root.after_idle once the main window is built, writes the report """
+    if not _enabled:
+        return
+    # Make sure the window was actually drawn
+    root.update_idletasks()
+    report = {
+        "time_to_first_frame" : time.perf_counter() - _start,
+        "phases" : _phases,
+        "imports" : sorted(({"module" : name, "cumulative" : total, "self" : total - children}
+                            for name, (total, children) in _imports.items()),
+                           key=lambda item: item["cumulative"], reverse=True),
+    }
+    with open(_report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Startup report written to {_report_path}, first frame after {report['time_to_first_frame']:.3f} s")
+    if os.environ.get("PROBEDOC_EXIT_AFTER_FIRST_FRAME"):
+        root.destroy()
@@ -0,0 +1,160 @@
+# Incremental manifest based directory sync
+# Each side of a sync keeps a manifest (.sync_manifest.json) with the size, mtime and (optionally) hash of
+# every file as it was at the end of the last sync. A sync only copies files that are new or changed,
+# so syncing after a day of point edits moves kilobytes instead of every image again.
+# Deletions: a file that was in the source's last manifest but is gone from the source now is deleted from
+# the destination, unless the destination copy was changed since (then it is left alone).
+# Files that only ever existed on the destination (another rig's images for example) are never touched.
+
+import os
+import json
+import fnmatch
+from .content_store import hash_file
+from .transfer import TransferJob, TransferEngine
+from . import delta_copy
+
+manifest_name = ".sync_manifest.json"
+default_ignore = [manifest_name, ".sync_resume.json", ".merge_state.json", ".resource_manifest.json", "merge_conflicts.json", "settings.json", "*.tmp", "*" + delta_copy.signature_suffix, ".packed_changes/*", "pyramid_cache/*", "raster_cache/*", "*.db-wal", "*.db-shm"]
+
+
+def is_ignored(relpath : str, ignore):
+    name = os.path.basename(relpath)
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern) for pattern in ignore)
+
+def load_manifest(root : str):
+    path = os.path.join(root, manifest_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Ignoring unreadable sync manifest {path}: {e}")
+        return None
+
+def store_manifest(root : str, manifest : dict):
+    path = os.path.join(root, manifest_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def scan(root : str, ignore = default_ignore, previous = None, with_hash = False):
+    """ relative path -> {"size", "mtime", "hash"} of every file under root
+        A hash from previous is reused as long as the size and mtime did not change """
+    previous = previous or {}
+    manifest = {}
+    if not os.path.isdir(root):
+        return manifest
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root).replace(os.sep, '/')
+            if is_ignored(relpath, ignore):
+                continue
+            stat = os.stat(path)
+            entry = {"size" : stat.st_size, "mtime" : stat.st_mtime_ns}
+            old = previous.get(relpath)
+            if old is not None and old.get("size") == entry["size"] and old.get("mtime") == entry["mtime"] and old.get("hash"):
+                entry["hash"] = old["hash"]
+            elif with_hash:
+                entry["hash"] = hash_file(path)
+            manifest[relpath] = entry
+    return manifest
+
+def same_file(a : dict, b : dict):
+    if a is None or b is None:
+        return False
+    if a.get("size") != b.get("size"):
+        return False
+    if a.get("hash") and b.get("hash"):
+        return a["hash"] == b["hash"]
+    return a.get("mtime") == b.get("mtime")
+
+class SyncPlan:
+    """ What a sync from source to destination would do """
+    def __init__(self, source : str, destination : str, copy : list, delete : list, source_manifest : dict, destination_manifest : dict):
+        self.source = source
+        self.destination = destination
+        self.copy = copy  # relative paths to copy from source to destination
+        self.delete = delete  # relative paths to delete from destination
+        self.source_manifest = source_manifest
+        self.destination_manifest = destination_manifest
+
+    def bytes_to_copy(self):
+        return sum(self.source_manifest[relpath]["size"] for relpath in self.copy)
+
+    def print_diff(self):
+        print(f"Sync {self.source} -> {self.destination}")
+        for relpath in self.copy:
+            state = "changed" if relpath in self.destination_manifest else "new"
+            print(f"  {state:8} {relpath} ({self.source_manifest[relpath]['size']} bytes)")
+        for relpath in self.delete:
+            print(f"  deleted  {relpath}")
+        print(f"  {len(self.copy)} files to copy ({self.bytes_to_copy()} bytes), {len(self.delete)} to delete")
+
+def plan(source : str, destination : str, ignore = default_ignore, with_hash = False, delete = True, scan_destination = False):
+    last_source = load_manifest(source) or {}
+    source_manifest = scan(source, ignore, last_source, with_hash)
+    # The destination's own manifest is trusted (the destination is usually a slow share),
+    # unless asked to scan it, or it never had a sync
+    destination_manifest = load_manifest(destination)
+    if destination_manifest is None or scan_destination:
+        destination_manifest = scan(destination, ignore, destination_manifest, with_hash)
+    copy = [relpath for relpath, entry in source_manifest.items()
+            if not same_file(entry, destination_manifest.get(relpath))]
+    to_delete = []
+    if delete:
+        to_delete = [relpath for relpath, entry in last_source.items()
+                     if relpath not in source_manifest and same_file(entry, destination_manifest.get(relpath))]
+    return SyncPlan(source, destination, sorted(copy), sorted(to_delete), source_manifest, destination_manifest)
+
+def run_transfer(jobs : list):
+    """ Default way of running the copies, blocks until they are done. Returns the jobs that did not finish """
+    engine = TransferEngine()
+    engine.start(jobs)
+    engine.wait()
+    return engine.failed()
+
+def execute(sync_plan : SyncPlan, run_copies = None):
+    """ Apply the plan, then store the manifests of both sides. Returns the relative paths that failed
+        run_copies(jobs) runs the TransferJobs and returns the ones that did not finish """
+    run_copies = run_copies or run_transfer
+    destination_manifest = dict(sync_plan.destination_manifest)
+    jobs = {}
+    for relpath in sync_plan.copy:
+        job = TransferJob(os.path.join(sync_plan.source, relpath), os.path.join(sync_plan.destination, relpath),
+                          sync_plan.source_manifest[relpath]["size"])
+        jobs[relpath] = job
+    failed_jobs = run_copies(list(jobs.values())) if len(jobs) > 0 else []
+    failed = [relpath for relpath, job in jobs.items() if job in failed_jobs]
+    for relpath in sync_plan.copy:
+        if relpath not in failed:
+            destination_manifest[relpath] = dict(sync_plan.source_manifest[relpath])
+    for relpath in sync_plan.delete:
+        try:
+            os.remove(os.path.join(sync_plan.destination, relpath))
+            delta_copy.remove_signature(os.path.join(sync_plan.destination, relpath))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting {relpath}: {e}")
+            failed.append(relpath)
+            continue
+        destination_manifest.pop(relpath, None)
+    finish(sync_plan, destination_manifest, failed)
+    return failed
+
+def finish(sync_plan : SyncPlan, destination_manifest : dict, failed : list):
+    source_manifest = {relpath : entry for relpath, entry in sync_plan.source_manifest.items() if relpath not in failed}
+    os.makedirs(sync_plan.destination, exist_ok = True)
+    store_manifest(sync_plan.destination, destination_manifest)
+    store_manifest(sync_plan.source, source_manifest)
+
+def sync_dirs(source : str, destination : str, ignore = default_ignore, with_hash = False, delete = True, dry_run = False,
+              scan_destination = False, run_copies = None):
+    sync_plan = plan(source, destination, ignore, with_hash, delete, scan_destination)
+    sync_plan.print_diff()
+    if dry_run:
+        return sync_plan, []
+    return sync_plan, execute(sync_plan, run_copies)
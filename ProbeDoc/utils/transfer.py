@@ -0,0 +1,187 @@
+# Parallel file transfer for sync and backup
+# Copies run on a small bounded thread pool, in chunks, so per file and total progress can be reported
+# and a transfer can be cancelled between chunks. Files that fail are retried a few times, and
+# retry_failed() can be used to try the remaining ones again.
+# Files of at least delta_min_size that already exist at the destination are updated with a block delta
+# (see delta_copy.py) instead of being copied again.
+# Nothing here touches tkinter, the gui polls progress() (see gui/transfer_dialog.py)
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import delta_copy
+
+
+class TransferJob:
+    def __init__(self, source : str, destination : str, size : int = None):
+        self.source = source
+        self.destination = destination
+        self.size = size if size is not None else os.path.getsize(source)
+        self.done_bytes = 0
+        self.state = "pending"  # pending, copying, done, failed, cancelled
+        self.error = None
+        self.attempts = 0
+        self.resumable = False  # a partial .tmp copy left by an interrupted transfer may be continued
+
+    def copy(self, engine):
+        """ Called by a worker of engine, jobs that write somewhere else than a file of their own override this
+            (see packed_sync.PackJob), reporting with engine.progress__ and stopping at engine.check_cancel__ """
+        engine.copy__(self)
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class TransferEngine:
+    def __init__(self, max_workers = 4, retries = 2, chunk_size = 1 << 20,
+                 file_progress_fcn = None, total_progress_fcn = None, keep_partial = False,
+                 delta_min_size = None, delta_block_size = 1 << 16):
+        self.max_workers = max(1, max_workers)
+        self.retries = retries  # extra attempts for a file that failed
+        self.chunk_size = chunk_size
+        self.file_progress_fcn = file_progress_fcn  # fcn(job), called from the worker threads
+        self.total_progress_fcn = total_progress_fcn  # fcn(done_bytes, total_bytes), called from the worker threads
+        self.keep_partial = keep_partial  # keep the .tmp of a cancelled copy, so it can be resumed later
+        self.delta_min_size = delta_min_size  # None: always copy whole files
+        self.delta_block_size = delta_block_size
+        self.jobs = []
+        self.__lock = threading.Lock()
+        self.__cancel = threading.Event()
+        self.__thread = None
+        self.current = None  # the job that last made progress, for display
+
+    def start(self, jobs):
+        """ Start copying in the background, returns right away """
+        self.jobs = list(jobs)
+        self.__start(self.jobs)
+
+    def __start(self, jobs):
+        self.__cancel.clear()
+        self.__thread = threading.Thread(target=self.__run, args=(jobs,), name="transfer", daemon=True)
+        self.__thread.start()
+
+    def __run(self, jobs):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            list(pool.map(self.__transfer, jobs))
+
+    def __transfer(self, job : TransferJob):
+        while True:
+            if self.__cancel.is_set():
+                job.state = "cancelled"
+                return
+            job.attempts += 1
+            job.state = "copying"
+            job.done_bytes = 0
+            try:
+                job.copy(self)
+                job.state = "done"
+                job.error = None
+                return
+            except TransferCancelled:
+                job.state = "cancelled"
+                return
+            except Exception as e:
+                job.error = e
+                if job.attempts > self.retries:
+                    print(f"Error copying {job.source}: {e}")
+                    job.state = "failed"
+                    return
+
+    def use_delta__(self, job : TransferJob):
+        return self.delta_min_size is not None and job.size >= self.delta_min_size
+
+    def check_cancel__(self):
+        if self.__cancel.is_set():
+            raise TransferCancelled()
+
+    def copy__(self, job : TransferJob):
+        os.makedirs(os.path.dirname(job.destination), exist_ok = True)
+        # A partial copy only ever exists under the .tmp name
+        tmp_path = job.destination + ".tmp"
+        offset = 0
+        if job.resumable and os.path.exists(tmp_path) and os.path.getsize(tmp_path) <= job.size:
+            offset = os.path.getsize(tmp_path)
+        if offset == 0 and self.use_delta__(job) and os.path.exists(job.destination):
+            stats = delta_copy.delta_copy(job.source, job.destination, self.delta_block_size,
+                                          progress_fcn = lambda n_bytes: self.progress__(job, n_bytes),
+                                          check_cancel = self.check_cancel__)
+            if stats is not None:
+                delta_copy.sign_copy(job.source, job.destination, self.delta_block_size)
+                return
+            # Too much changed, copy the whole file after all
+            with self.__lock:
+                job.done_bytes = 0
+        try:
+            with open(job.source, 'rb') as src, open(tmp_path, 'ab' if offset > 0 else 'wb') as dst:
+                if offset > 0:
+                    src.seek(offset)
+                    self.progress__(job, offset)
+                while True:
+                    self.check_cancel__()
+                    chunk = src.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    self.progress__(job, len(chunk))
+            shutil.copystat(job.source, tmp_path)
+            os.replace(tmp_path, job.destination)
+            if self.use_delta__(job):
+                # The next sync of this file can then be a delta
+                delta_copy.sign_copy(job.source, job.destination, self.delta_block_size)
+        except TransferCancelled:
+            if not self.keep_partial and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def progress__(self, job, n_bytes):
+        with self.__lock:
+            job.done_bytes += n_bytes
+            self.current = job
+        if self.file_progress_fcn is not None:
+            self.file_progress_fcn(job)
+        if self.total_progress_fcn is not None:
+            done_files, total_files, done_bytes, total_bytes = self.progress()
+            self.total_progress_fcn(done_bytes, total_bytes)
+
+    def cancel(self):
+        self.__cancel.set()
+
+    def cancelled(self):
+        return self.__cancel.is_set()
+
+    def retry_failed(self):
+        """ Run every failed or cancelled job again """
+        if self.is_running():
+            return False
+        jobs = [job for job in self.jobs if job.state in ("failed", "cancelled")]
+        for job in jobs:
+            job.attempts = 0
+            job.state = "pending"
+        if len(jobs) > 0:
+            self.__start(jobs)
+        return len(jobs) > 0
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def wait(self, timeout = None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return not self.is_running()
+
+    def progress(self):
+        """ (done files, total files, done bytes, total bytes) """
+        with self.__lock:
+            done_files = len([job for job in self.jobs if job.state == "done"])
+            done_bytes = sum(job.done_bytes for job in self.jobs)
+            total_bytes = sum(job.size for job in self.jobs)
+        return done_files, len(self.jobs), done_bytes, total_bytes
+
+    def failed(self):
+        return [job for job in self.jobs if job.state not in ("done",)]
@@ -0,0 +1,93 @@
+# Benchmark of the block delta copy (ProbeDoc/utils/delta_copy.py) against a full copy
+# A synthetic large file is copied once, then changed in a few small places (overwritten bytes, an insertion
+# and a deletion, the way a re-exported TIFF changes) and synced again, once as a full copy and once as a delta.
+#
+# Usage (from the repository root):
+#   python benchmarks/delta_copy_benchmark.py [--size-mb 512] [--changes 8] [--dir /path/on/the/share]
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ProbeDoc.utils import delta_copy
+
+
+def make_file(path, size_mb, seed):
+    rng = random.Random(seed)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(rng.randbytes(1 << 20))
+
+def change_file(path, n_changes, seed):
+    """ Overwrite, insert and delete a few KB at random places """
+    rng = random.Random(seed)
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    for i in range(n_changes):
+        pos = rng.randrange(len(data) - 8192)
+        kind = i % 3
+        if kind == 0:
+            data[pos:pos + 4096] = rng.randbytes(4096)
+        elif kind == 1:
+            data[pos:pos] = rng.randbytes(1000)
+        else:
+            del data[pos:pos + 1000]
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def timed(fcn):
+    start = time.perf_counter()
+    result = fcn()
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--changes", type=int, default=8)
+    parser.add_argument("--block-size", type=int, default=1 << 16)
+    parser.add_argument("--dir", default=None, help="where to put the destination copies (a mounted share for example)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="delta_bench_")
+    dest_dir = args.dir or work_dir
+    source = os.path.join(work_dir, "source.bin")
+    full_dest = os.path.join(dest_dir, "full_copy.bin")
+    delta_dest = os.path.join(dest_dir, "delta_copy.bin")
+    try:
+        print(f"Writing a {args.size_mb} MB source file")
+        make_file(source, args.size_mb, 1)
+        shutil.copyfile(source, full_dest)
+        shutil.copyfile(source, delta_dest)
+        sign_time, _ = timed(lambda: delta_copy.sign_copy(source, delta_dest, args.block_size))
+        print(f"Signature of the first copy: {sign_time:.2f} s")
+
+        change_file(source, args.changes, 2)
+        print(f"Changed {args.changes} places in the source")
+
+        full_time, _ = timed(lambda: shutil.copyfile(source, full_dest))
+        delta_time, stats = timed(lambda: delta_copy.delta_copy(source, delta_dest, args.block_size))
+        if stats is None:
+            print("The delta was given up, too much of the file changed")
+            return
+        same = open(source, 'rb').read() == open(delta_dest, 'rb').read()
+        size = os.path.getsize(source)
+        print(f"Full copy:  {full_time:.2f} s, {size >> 20} MB written from the source")
+        print(f"Delta copy: {delta_time:.2f} s, {stats.literal_bytes / 1024:.1f} KB written from the source, "
+              f"{stats.matched_bytes >> 20} MB reused from the old copy, {stats.rolled_bytes} bytes rolled")
+        print(f"Delta copy matches the source: {same}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+        if args.dir:
+            for path in [full_dest, delta_dest, delta_copy.signature_path(delta_dest)]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
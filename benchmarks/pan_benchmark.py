@@ -0,0 +1,132 @@
+# Pan frames per second benchmark for CanvasImage
+# Opens a generated large image in a CanvasImage, waits for its pyramid, then drags the view across the image
+# a few pixels per frame (like a mouse drag would) and times every frame until it is on screen.
+# Every frame gets several motion events, like a fast drag, which the redraw scheduler folds into one redraw.
+# The first pass renders every newly exposed tile, the second pass goes back over the same area
+# so its tiles come from the tile cache. Tiles are resampled on the render pool, so a frame is the time
+# until the cached tiles are up and the missing ones are queued, the pool latency is reported separately. Needs a display, without one it runs itself again under xvfb-run.
+#
+# Usage (from the repository root):
+#   python benchmarks/pan_benchmark.py [--size 12000 9000] [--window 1280 800] [--step 8] [--frames 300] [--events 3] [--zoom 0]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+
+
+def make_image(path, width, height):
+    from PIL import Image, ImageDraw
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 500):
+        draw.line((x, 0, x, height), fill=(255, 0, 0), width=3)
+    for y in range(0, height, 500):
+        draw.line((0, y, width, y), fill=(0, 0, 255), width=3)
+    image.save(path, quality=90)
+
+def wait_for_pyramid(root, viewer):
+    builder = viewer._CanvasImage__builder
+    while builder is not None and builder.is_alive():
+        root.update()
+        time.sleep(0.05)
+    root.update()
+
+def pan(root, viewer, dx, dy, frames, events):
+    """ Seconds every frame took, from the first drag event to the frame being drawn """
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        for _ in range(events):
+            viewer.canvas.scan_mark(0, 0)
+            viewer.canvas.scan_dragto(-dx, -dy, gain=1)
+            viewer.request_redraw()
+        root.update_idletasks()
+        times.append(time.perf_counter() - start)
+    return times
+
+def wait_for_tiles(root, viewer):
+    start = time.perf_counter()
+    while viewer.render_stats()["pending"] > 0:
+        root.update()
+    return time.perf_counter() - start
+
+def report(name, times):
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1]
+    print(f"{name:22} {len(times) / sum(times):8.1f} fps   median {statistics.median(times) * 1000:6.2f} ms"
+          f"   p95 {p95 * 1000:6.2f} ms   max {times[-1] * 1000:6.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=[12000, 9000])
+    parser.add_argument("--window", type=int, nargs=2, default=[1280, 800])
+    parser.add_argument("--step", type=int, default=8, help="pixels panned per frame")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--events", type=int, default=3, help="drag events per frame")
+    parser.add_argument("--zoom", type=int, default=0, help="zoom in steps before panning, negative zooms out")
+    parser.add_argument("--image", default=None, help="use this image instead of a generated one")
+    args = parser.parse_args()
+
+    if not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+        if shutil.which("xvfb-run") is None:
+            raise RuntimeError("No display and xvfb-run is not installed")
+        os.execvp("xvfb-run", ["xvfb-run", "-a", sys.executable] + sys.argv)
+
+    import tkinter as tk
+    from ProbeDoc.utils.config import config
+    from ProbeDoc.gui.canvas_img import CanvasImage
+    from ProbeDoc.gui.render_pool import render_pool
+
+    work_dir = tempfile.mkdtemp(prefix="pan_bench_")
+    # The pyramid cache of the generated image should not end up in the real resources
+    config["PyramidCacheDirectory"] = os.path.join(work_dir, "pyramid_cache")
+    try:
+        path = args.image
+        if path is None:
+            path = os.path.join(work_dir, "large.jpg")
+            make_image(path, *args.size)
+        root = tk.Tk()
+        root.geometry(f"{args.window[0]}x{args.window[1]}")
+        root.rowconfigure(0, weight=1)
+        root.columnconfigure(0, weight=1)
+        start = time.perf_counter()
+        viewer = CanvasImage(root, path)
+        viewer.grid(row=0, column=0)
+        wait_for_pyramid(root, viewer)
+        print(f"{path}: {viewer.imwidth}x{viewer.imheight}, pyramid ready after {time.perf_counter() - start:.2f} s")
+        if args.zoom != 0:
+            viewer.zoom_in_option = args.zoom > 0
+            viewer.zoom_out_option = args.zoom < 0
+            x, y = root.winfo_width() // 2, root.winfo_height() // 2
+            for _ in range(abs(args.zoom)):
+                viewer._CanvasImage__handle_zoom_click(type("Event", (), {"x" : x, "y" : y})())
+            viewer.zoom_in_option = viewer.zoom_out_option = False
+            root.update()
+        print(f"window {args.window[0]}x{args.window[1]}, {args.step} px per frame, zoom {viewer.imscale:.3f}")
+        step = max(1, args.step // args.events)
+        before = viewer.render_stats()
+        report("pan, new tiles", pan(root, viewer, step, step // 2, args.frames, args.events))
+        print(f"last tiles up {wait_for_tiles(root, viewer) * 1000:.1f} ms after the last frame")
+        report("pan back, cached", pan(root, viewer, -step, -(step // 2), args.frames, args.events))
+        wait_for_tiles(root, viewer)
+        pool = render_pool().stats()
+        print(f"render pool: {pool['completed']} tiles, {pool['cancelled']} cancelled, "
+              f"latency avg {pool['latency_avg']:.2f} ms p95 {pool['latency_p95']:.2f} ms")
+        stats = viewer.render_stats()
+        print(f"frames rendered {stats['rendered'] - before['rendered']}, redraws folded {stats['dropped'] - before['dropped']}, "
+              f"tile items {stats['tile_items']}, canvas items {len(viewer.canvas.find_all())}")
+        viewer.destroy()
+        root.destroy()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+
+if __name__ == '__main__':
+    main()
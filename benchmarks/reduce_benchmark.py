@@ -0,0 +1,56 @@
+# Time to make level 0 of a huge image with different numbers of decode workers
+# Writes a generated uncompressed image (PPM, mapped in place like a raw TIFF), then times
+# image_pyramid.smaller() on its MappedRaster with each DecodeWorkers setting. Does not need a display.
+# The gain depends on the cores available, with one core every setting takes about as long.
+#
+# Usage (from the repository root):
+#   python benchmarks/reduce_benchmark.py [--size 20000 15000] [--workers 1 2 4 8]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+
+
+def make_image(path, width, height):
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = None
+    Image.linear_gradient("L").resize((width, height)).convert("RGB").save(path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=[20000, 15000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--image", default=None, help="use this uncompressed image instead of a generated one")
+    args = parser.parse_args()
+
+    from ProbeDoc.utils.config import config
+    from ProbeDoc.utils import image_pyramid, mapped_raster
+
+    work_dir = tempfile.mkdtemp(prefix="reduce_bench_")
+    try:
+        path = args.image
+        if path is None:
+            path = os.path.join(work_dir, "huge.ppm")
+            make_image(path, *args.size)
+        raster = mapped_raster.open_raster(path)
+        if raster is None:
+            raise RuntimeError(f"{path} is not stored uncompressed, it can not be mapped in place")
+        print(f"{path}: {raster.size[0]}x{raster.size[1]}, {os.cpu_count()} cpus")
+        for workers in args.workers:
+            config["DecodeWorkers"] = workers
+            start = time.perf_counter()
+            image_pyramid.smaller(raster)
+            print(f"{workers:3} workers {time.perf_counter() - start:8.2f} s")
+        raster.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Frame time of the tile resampling filters
+# Renders every tile of a viewport the way CanvasImage.tile__ does (Image.resize with a box per tile) from a
+# generated pyramid level, with each filter and at a few zoom scales, and reports the time of a full frame.
+# Only the resampling is timed, making the PhotoImages is the same for every filter. Does not need a display.
+#
+# Usage (from the repository root):
+#   python benchmarks/resample_benchmark.py [--level 8000 6000] [--viewport 1920 1080] [--tile 256] [--runs 5]
+
+import time
+import argparse
+import statistics
+from PIL import Image, ImageDraw
+
+filters = {"nearest" : Image.Resampling.NEAREST, "bilinear" : Image.Resampling.BILINEAR, "lanczos" : Image.Resampling.LANCZOS}
+
+
+def make_level(width, height):
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for x in range(0, width, 97):
+        draw.line((x, 0, x, height), fill=(255, 0, 0), width=2)
+    return image
+
+def frame(level, scale, viewport, tile, resample):
+    """ Resample every tile covering the viewport at the top left of the level shown at scale """
+    width, height = min(viewport[0], int(level.size[0] * scale)), min(viewport[1], int(level.size[1] * scale))
+    for top in range(0, height, tile):
+        for left in range(0, width, tile):
+            right, bottom = min(left + tile, width), min(top + tile, height)
+            box = (left / scale, top / scale, right / scale, bottom / scale)
+            level.resize((right - left, bottom - top), resample, box=box)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--level", type=int, nargs=2, default=[8000, 6000])
+    parser.add_argument("--viewport", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--tile", type=int, default=256)
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.6, 0.8, 1.3, 2.2])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    level = make_level(*args.level)
+    print(f"level {args.level[0]}x{args.level[1]}, viewport {args.viewport[0]}x{args.viewport[1]}, {args.tile} px tiles")
+    print(f"{'scale':>6} " + " ".join(f"{name:>12}" for name in filters))
+    for scale in args.scales:
+        row = []
+        for resample in filters.values():
+            times = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                frame(level, scale, args.viewport, args.tile, resample)
+                times.append(time.perf_counter() - start)
+            row.append(statistics.median(times) * 1000)
+        print(f"{scale:6.2f} " + " ".join(f"{ms:9.1f} ms" for ms in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Time to first frame benchmark
+# Generates a synthetic resource directory (N images, M points per image), starts the program against it
+# with the startup profiler on (see ProbeDoc/utils/startup_profile.py) and reports the time to the first
+# frame and the slowest phases. Needs a display, without one it runs under xvfb-run.
+#
+# Usage (from the repository root):
+#   python benchmarks/startup_benchmark.py [--images 10 50 200] [--points 50] [--size 2048] [--runs 3]
+
+import os
+import sys
+import json
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+icons = ["zoom_in.png", "zoom_out.png", "zoom_in_activated.png", "zoom_out_activated.png", "app_icon.png", "app_icon.ico"]
+
+
+def make_resources(directory, n_images, n_points, size, seed = 1):
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, "images", "objects"), exist_ok = True)
+    for icon in icons:
+        shutil.copy(os.path.join(repo_root, "ProbeDoc", "resources", icon), directory)
+    images, originals, data_points = {}, [], {}
+    for i in range(n_images):
+        image = Image.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(20):
+            x, y = rng.randrange(size), rng.randrange(size)
+            draw.ellipse((x, y, x + size // 8, y + size // 8), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        tmp_path = os.path.join(directory, f"probe_{i}.png")
+        image.save(tmp_path)
+        with open(tmp_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        os.replace(tmp_path, os.path.join(directory, "images", "objects", digest + ".png"))
+        name = f"probe_{i}.png"
+        images[name] = digest
+        originals.append(name)
+        data_points[f"probe_{i}"] = [{"name" : f"2025-{1 + j // 28 % 12:02d}-{1 + j % 28:02d} point {j}",
+                                      "color" : "#ff0000", "pos" : [rng.randrange(size), rng.randrange(size)], "notes" : ""}
+                                     for j in range(n_points)]
+    sync_dir = os.path.join(directory, "sync")
+    os.makedirs(sync_dir, exist_ok = True)
+    # Same layout the program writes, the names in images.json and their hashes in image_hashes.json
+    files = {"images.json" : list(images.keys()), "image_hashes.json" : images,
+             "images_original.json" : originals, "data_points.json" : data_points,
+             # A sync directory is set so no dialog asks for one
+             "settings.json" : {"ExternalSyncDir" : sync_dir, "StartupBackupSync" : False}}
+    for filename, data in files.items():
+        with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+def run_once(resource_dir, report_path):
+    env = dict(os.environ, PROBEDOC_RESOURCE_DIR = resource_dir, PROBEDOC_PROFILE_STARTUP = report_path,
+               PROBEDOC_EXIT_AFTER_FIRST_FRAME = "1")
+    command = [sys.executable, os.path.join(repo_root, "run_documentation.py")]
+    if not env.get("DISPLAY"):
+        if shutil.which("xvfb-run") is None:
+            raise RuntimeError("No display and xvfb-run is not installed")
+        command = ["xvfb-run", "-a"] + command
+    subprocess.run(command, env=env, check=True, cwd=repo_root, stdout=subprocess.DEVNULL)
+    with open(report_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--points", type=int, default=50)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--report", default=None, help="write all the results to this json file")
+    args = parser.parse_args()
+
+    results = []
+    for n_images in args.images:
+        work_dir = tempfile.mkdtemp(prefix="startup_bench_")
+        try:
+            make_resources(work_dir, n_images, args.points, args.size)
+            reports = [run_once(work_dir, os.path.join(work_dir, f"report_{i}.json")) for i in range(args.runs)]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors = True)
+        first_frames = sorted(report["time_to_first_frame"] for report in reports)
+        median = first_frames[len(first_frames) // 2]
+        phases = {}
+        for report in reports:
+            for item in report["phases"]:
+                phases[item["name"]] = phases.get(item["name"], 0.0) + item["duration"] / len(reports)
+        print(f"{n_images} images x {args.points} points: first frame {median:.3f} s (median of {args.runs})")
+        for name, duration in sorted(phases.items(), key=lambda item: item[1], reverse=True):
+            print(f"    {name:24} {duration:.3f} s")
+        slowest = reports[-1]["imports"][:5]
+        print("    slowest imports: " + ", ".join(f"{item['module']} {item['cumulative']:.3f} s" for item in slowest))
+        results.append({"images" : n_images, "points" : args.points, "first_frame" : first_frames, "phases" : phases})
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
+import sys
+from ProbeDoc.utils import startup_profile
+# Has to come before the rest of the program is imported, so the imports are timed too
+startup_profile.enable_from_args(sys.argv)
 from ProbeDoc.main import main
 
 if __name__ == '__main__':